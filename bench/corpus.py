@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+"""
+Generator of synthetic audiobooks for benchmarks.
+
+    python -m bench.corpus <output folder> [options]
+
+Every book gets its own folder with the parts as AAC-LC in MP4
+(.m4a), a cover image and a saved product page (page.pkl) that
+Metadata can parse without network access.
+
+The audio is digital silence encoded as valid AAC frames, padded
+with fill elements up to the requested bitrate, so the files can
+be demuxed, remuxed and tagged like real ones.
+"""
+
+import os
+import sys
+import zlib
+import struct
+import pickle
+import random
+from argparse import ArgumentParser
+
+SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000,
+                24000, 22050, 16000, 12000, 11025, 8000]
+FRAME_SAMPLES = 1024
+
+
+class _BitWriter:
+    def __init__(self):
+        self._bits = []
+
+    def write(self, value, count):
+        for shift in range(count - 1, -1, -1):
+            self._bits.append((value >> shift) & 1)
+
+    def bytes(self):
+        bits = self._bits + [0] * (-len(self._bits) % 8)
+        return bytes(int("".join(map(str, bits[i:i + 8])), 2)
+                     for i in range(0, len(bits), 8))
+
+
+def aac_frame(channels, size):
+    """One silent AAC-LC raw data block of exactly size bytes."""
+    writer = _BitWriter()
+    if channels == 1:
+        #single channel element with tag 0:
+        writer.write(0, 3 + 4)
+    else:
+        #channel pair element with tag 0 and separate windows:
+        writer.write(1, 3)
+        writer.write(0, 4 + 1)
+    for channel in range(min(channels, 2)):
+        #global gain:
+        writer.write(100, 8)
+        #ics_info: long window, max_sfb 0, no prediction:
+        writer.write(0, 1 + 2 + 1 + 6 + 1)
+        #no pulse, tns or gain control data:
+        writer.write(0, 3)
+    head = len(writer._bits)
+
+    #fill the rest with FIL elements and close with END,
+    #each FIL element carries at most 269 bytes:
+    remaining = size * 8 - head - 3
+    while remaining >= 7 + 8:
+        writer.write(6, 3)
+        if (remaining - 7) // 8 >= 15:
+            payload = min((remaining - 15) // 8, 269)
+            writer.write(15, 4)
+            writer.write(payload - 14, 8)
+            remaining -= 15
+        else:
+            payload = (remaining - 7) // 8
+            writer.write(payload, 4)
+            remaining -= 7
+        for i in range(payload):
+            writer.write(0xA5 if i else 0x00, 8)
+            remaining -= 8
+    writer.write(7, 3)
+    data = writer.bytes()
+    return data + b"\x00" * (size - len(data))
+
+
+def audio_specific_config(sample_rate, channels):
+    writer = _BitWriter()
+    writer.write(2, 5)  # AAC LC
+    writer.write(SAMPLE_RATES.index(sample_rate), 4)
+    writer.write(channels, 4)
+    writer.write(0, 3)
+    return writer.bytes()
+
+
+def atom(name, *data):
+    data = b"".join(data)
+    return struct.pack(">I4s", len(data) + 8, name) + data
+
+
+def full_atom(name, version, flags, *data):
+    return atom(name, struct.pack(">I", (version << 24) | flags), *data)
+
+
+def _descriptor(tag, data):
+    return bytes((tag, 0x80, 0x80, 0x80, len(data))) + data
+
+
+def _esds(sample_rate, channels, bitrate):
+    config = _descriptor(0x05, audio_specific_config(sample_rate, channels))
+    decoder = _descriptor(0x04, struct.pack(">BBHBII", 0x40, 0x15, 0, 0,
+                                            bitrate, bitrate) + config)
+    sl = _descriptor(0x06, b"\x02")
+    return full_atom(b"esds", 0, 0, _descriptor(0x03, struct.pack(">HB", 1, 0) + decoder + sl))
+
+
+def _mp4a(sample_rate, channels, bitrate):
+    return atom(b"mp4a", b"\x00" * 6, struct.pack(">H", 1), b"\x00" * 8,
+                struct.pack(">HHHHI", channels, 16, 0, 0, sample_rate << 16),
+                _esds(sample_rate, channels, bitrate))
+
+
+_MATRIX = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+
+def _trak(sample_rate, channels, bitrate, duration, stbl_tables):
+    tkhd = full_atom(b"tkhd", 0, 7, struct.pack(">IIIII", 0, 0, 1, 0, duration),
+                     b"\x00" * 8, struct.pack(">hhhH", 0, 0, 0x0100, 0), _MATRIX,
+                     struct.pack(">II", 0, 0))
+    mdhd = full_atom(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, sample_rate, duration,
+                                                0x55c4, 0))
+    hdlr = full_atom(b"hdlr", 0, 0, struct.pack(">I4s", 0, b"soun"), b"\x00" * 12,
+                     b"SoundHandler\x00")
+    stsd = full_atom(b"stsd", 0, 0, struct.pack(">I", 1), _mp4a(sample_rate, channels, bitrate))
+    minf = atom(b"minf",
+                full_atom(b"smhd", 0, 0, b"\x00" * 4),
+                atom(b"dinf", full_atom(b"dref", 0, 0, struct.pack(">I", 1),
+                                        full_atom(b"url ", 0, 1))),
+                atom(b"stbl", stsd, *stbl_tables))
+    return atom(b"trak", tkhd, atom(b"mdia", mdhd, hdlr, minf))
+
+
+def _mvhd(sample_rate, duration, next_track=2):
+    return full_atom(b"mvhd", 0, 0, struct.pack(">IIII", 0, 0, sample_rate, duration),
+                     struct.pack(">IH", 0x10000, 0x0100), b"\x00" * 10, _MATRIX,
+                     b"\x00" * 24, struct.pack(">I", next_track))
+
+
+def _chpl(chapters, sample_rate):
+    """Nero chapter list as written by MP4Box, times in 100ns units."""
+    data = [struct.pack(">IB", 0, len(chapters))]
+    for start, title in chapters:
+        title = title.encode("utf-8")
+        data.append(struct.pack(">QB", int(start * 10**7 / sample_rate), len(title)) + title)
+    return full_atom(b"chpl", 1, 0, *data)
+
+
+def write_mp4(path, duration=600.0, chunks=100, fragmented=False, sample_rate=44100,
+              channels=2, bitrate=64000, chapters=0):
+    """
+    Write a silent AAC-LC .m4a file.
+
+    duration:   length in seconds
+    chunks:     number of chunks (or fragments) the samples are split into
+    fragmented: write moof/mdat pairs instead of a single mdat
+    bitrate:    bits per second, sets the size of every frame
+    chapters:   number of evenly spaced Nero chapters (chpl)
+    """
+    frames = max(int(duration * sample_rate / FRAME_SAMPLES), 1)
+    chunks = max(min(chunks, frames), 1)
+    frame_size = max(int(bitrate / 8 * FRAME_SAMPLES / sample_rate), 8 * channels)
+    frame = aac_frame(channels, frame_size)
+    per_chunk = -(-frames // chunks)
+    chunks = -(-frames // per_chunk)
+    last = frames - per_chunk * (chunks - 1)
+    total = frames * FRAME_SAMPLES
+
+    ftyp = atom(b"ftyp", b"M4A ", struct.pack(">I", 0), b"M4A mp42isom")
+
+    udta = b""
+    if chapters:
+        step = total // chapters
+        udta = atom(b"udta", _chpl([(i * step, "Chapter {}".format(i + 1))
+                                    for i in range(chapters)], sample_rate))
+
+    with open(path, "wb") as file:
+        file.write(ftyp)
+
+        if not fragmented:
+            def moov(offsets):
+                stts = full_atom(b"stts", 0, 0, struct.pack(">III", 1, frames, FRAME_SAMPLES))
+                entries = [(1, per_chunk)]
+                if last != per_chunk:
+                    entries.append((chunks, last))
+                stsc = full_atom(b"stsc", 0, 0, struct.pack(">I", len(entries)),
+                                 *[struct.pack(">III", first, count, 1) for first, count in entries])
+                stsz = full_atom(b"stsz", 0, 0, struct.pack(">II", frame_size, frames))
+                stco = full_atom(b"stco", 0, 0, struct.pack(">I", len(offsets)),
+                                 struct.pack(">{}I".format(len(offsets)), *offsets))
+                trak = _trak(sample_rate, channels, bitrate, total, [stts, stsc, stsz, stco])
+                return atom(b"moov", _mvhd(sample_rate, total), trak, udta)
+
+            size = len(moov([0] * chunks))
+            start = len(ftyp) + size + 8
+            offsets = [start + i * per_chunk * frame_size for i in range(chunks)]
+            file.write(moov(offsets))
+
+            file.write(struct.pack(">I4s", frames * frame_size + 8, b"mdat"))
+            chunk = frame * per_chunk
+            for i in range(chunks - 1):
+                file.write(chunk)
+            file.write(frame * last)
+
+        else:
+            empty = [full_atom(b"stts", 0, 0, b"\x00" * 4),
+                     full_atom(b"stsc", 0, 0, b"\x00" * 4),
+                     full_atom(b"stsz", 0, 0, b"\x00" * 8),
+                     full_atom(b"stco", 0, 0, b"\x00" * 4)]
+            trak = _trak(sample_rate, channels, bitrate, total, empty)
+            mvex = atom(b"mvex",
+                        full_atom(b"mehd", 0, 0, struct.pack(">I", total)),
+                        full_atom(b"trex", 0, 0, struct.pack(">5I", 1, 1, FRAME_SAMPLES,
+                                                             frame_size, 0)))
+            file.write(atom(b"moov", _mvhd(sample_rate, total), trak, mvex, udta))
+
+            decode_time = 0
+            for i in range(chunks):
+                count = per_chunk if i < chunks - 1 else last
+                #data offset is relative to moof, so the size has to be known:
+                def moof(data_offset):
+                    tfhd = full_atom(b"tfhd", 0, 0x020000, struct.pack(">I", 1))
+                    tfdt = full_atom(b"tfdt", 1, 0, struct.pack(">Q", decode_time))
+                    trun = full_atom(b"trun", 0, 0x000001, struct.pack(">Ii", count, data_offset))
+                    return atom(b"moof", full_atom(b"mfhd", 0, 0, struct.pack(">I", i + 1)),
+                                atom(b"traf", tfhd, tfdt, trun))
+                size = len(moof(0))
+                file.write(moof(size + 8))
+                file.write(struct.pack(">I4s", count * frame_size + 8, b"mdat"))
+                file.write(frame * count)
+                decode_time += count * FRAME_SAMPLES
+
+
+def write_png(path, size, seed=0):
+    """Write an RGB png of roughly size bytes filled with noise."""
+    side = max(int((size / 3) ** 0.5), 1)
+    rand = random.Random(seed)
+    rows = b"".join(b"\x00" + bytes(rand.getrandbits(8) for i in range(side * 3))
+                    for j in range(side))
+
+    def chunk(name, data):
+        return (struct.pack(">I", len(data)) + name + data +
+                struct.pack(">I", zlib.crc32(name + data) & 0xffffffff))
+
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0)))
+        file.write(chunk(b"IDAT", zlib.compress(rows, 1)))
+        file.write(chunk(b"IEND", b""))
+
+
+PAGE = """<html><head><title>{title} Audiobook</title></head><body>
+<h1 class="adbl-prod-h1-title">{title}</h1>
+<ul>
+<li class="adbl-author-row"><span class="adbl-label">By:</span>
+<span class="adbl-prod-author"><a href="#">{author}</a></span></li>
+<li class="adbl-narrator-row"><span class="adbl-label">Narrated by:</span>
+<span class="adbl-prod-author"><a href="#">{narrator}</a></span></li>
+</ul>
+<div class="adbl-series-link"><a href="/series?asin=B000000000">{series}</a>
+<span class="adbl-label">, Book {position}</span></div>
+<span class="adbl-run-time">{hours} hrs and {minutes} mins</span>
+<span class="adbl-date adbl-release-date">01-02-13</span>
+<div class="adbl-content">
+<p>{description}</p>
+<p>&copy;1992 {author} (P)2013 Tantor</p>
+</div>
+</body></html>"""
+
+
+def write_page(path, title, author, narrator, series, position, runtime, description):
+    """Save a product page the way Metadata.http_page does."""
+    html = PAGE.format(title=title, author=author, narrator=narrator, series=series,
+                       position=position, hours=int(runtime // 3600),
+                       minutes=int(runtime % 3600 // 60), description=description)
+    with open(path, "wb") as file:
+        pickle.dump(html.encode("utf-8"), file)
+
+
+def write_tags(path, title, author, description_size, cover=None):
+    """Add an iTunes ilst with a description of the given size and an optional cover."""
+    from mutagenx.mp4 import MP4, MP4Cover
+
+    mp4 = MP4(path)
+    if mp4.tags is None:
+        mp4.add_tags()
+    mp4.tags[b"\xa9nam"] = [title]
+    mp4.tags[b"\xa9ART"] = [author]
+    mp4.tags[b"\xa9alb"] = [title]
+    mp4.tags[b"desc"] = [("x" * description_size)]
+    if cover is not None:
+        with open(cover, "rb") as file:
+            mp4.tags[b"covr"] = [MP4Cover(file.read(), MP4Cover.FORMAT_PNG)]
+    mp4.save()
+
+
+def generate(folder, books=1, parts=3, duration=600.0, chunks=100, fragmented=False,
+             bitrate=64000, description_size=1000, cover_size=100000, tagged=True,
+             chapters=0):
+    """Create books in folder and return the list of book folders."""
+    book_folders = []
+    for book in range(books):
+        title = "Synthetic Book {}".format(book + 1)
+        book_folder = os.path.join(folder, title)
+        os.makedirs(book_folder, exist_ok=True)
+        book_folders.append(book_folder)
+
+        cover = os.path.join(book_folder, "cover.png")
+        write_png(cover, cover_size, seed=book)
+
+        write_page(os.path.join(book_folder, "page.pkl"), title, "Jane Doe", "John Roe",
+                   "Synthetic Saga", book + 1, duration * parts, "x" * description_size)
+
+        for part in range(parts):
+            path = os.path.join(book_folder, "Part {:02d}.m4a".format(part + 1))
+            write_mp4(path, duration, chunks, fragmented, bitrate=bitrate, chapters=chapters)
+            if tagged:
+                write_tags(path, "{}, Part {}".format(title, part + 1), "Jane Doe",
+                           description_size, cover)
+    return book_folders
+
+
+def parse_args(argv):
+    parser = ArgumentParser(description="Generate synthetic audiobooks.")
+    parser.add_argument(dest='folder', metavar='<output folder>')
+    parser.add_argument('--books', type=int, default=1)
+    parser.add_argument('--parts', type=int, default=3)
+    parser.add_argument('--duration', type=float, default=600.0,
+                        help="Duration of every part in seconds. [default: %(default)s]")
+    parser.add_argument('--chunks', type=int, default=100,
+                        help="Chunks (or fragments) per part. [default: %(default)s]")
+    parser.add_argument('--fragmented', action='store_true',
+                        help="Write fragmented files (moof/mdat pairs).")
+    parser.add_argument('--bitrate', type=int, default=64000)
+    parser.add_argument('--chapters', type=int, default=0,
+                        help="Number of Nero chapters in every part. [default: %(default)s]")
+    parser.add_argument('--description-size', type=int, default=1000,
+                        help="Size of the desc atom in bytes. [default: %(default)s]")
+    parser.add_argument('--cover-size', type=int, default=100000,
+                        help="Approximate size of the cover in bytes. [default: %(default)s]")
+    parser.add_argument('--untagged', action='store_true', help="Do not write an ilst atom.")
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    args = parse_args(argv)
+    folders = generate(args.folder, args.books, args.parts, args.duration, args.chunks,
+                       args.fragmented, args.bitrate, args.description_size,
+                       args.cover_size, not args.untagged, args.chapters)
+    for folder in folders:
+        print(folder)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures loading FLAC metadata, with and without the tags.
+
+    python -m bench.flac [--corpus <folder>] [--files N] [--repeat N]
+
+Without --corpus FLAC files with a seek table, Vorbis comments, a
+cover and padding are generated in a temporary folder. Only the
+metadata blocks are valid, the frames after them are random bytes,
+which is all the loader ever looks at.
+"""
+
+import os
+import sys
+import struct
+import random
+import tempfile
+import timeit
+from argparse import ArgumentParser
+
+#bundled libraries:
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                             "tools", "mutagen", "lib"))
+
+from mutagenx.flac import FLAC
+
+
+def _block(code, data, last=False):
+    return struct.pack(">B", code | (0x80 if last else 0)) + struct.pack(">I", len(data))[1:] + data
+
+
+def _streaminfo(samples, rate=44100, channels=2, bits=16):
+    info = struct.pack(">HH", 4096, 4096) + b"\x00\x00\x0e" + b"\x00\x36\x00"
+    value = (rate << 44) | ((channels - 1) << 41) | ((bits - 1) << 36) | samples
+    return info + struct.pack(">Q", value) + bytes(16)
+
+
+def _vorbis_comment(count):
+    vendor = b"bench"
+    data = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", count)
+    for i in range(count):
+        comment = "TAG{}={}".format(i, "value " * 8).encode("utf-8")
+        data += struct.pack("<I", len(comment)) + comment
+    return data
+
+
+def _picture(size):
+    mime, description = b"image/jpeg", b"cover"
+    return (struct.pack(">II", 3, len(mime)) + mime + struct.pack(">I", len(description)) +
+            description + struct.pack(">IIIII", 500, 500, 24, 0, size) + os.urandom(size))
+
+
+def flac_file(path, seconds=600, comments=40, cover=100000, padding=8192, audio=2**20):
+    """Writes a FLAC file whose metadata is valid and whose frames are noise."""
+    rate = 44100
+    seekpoints = b"".join(struct.pack(">QQH", i * rate * 10, i * 4096, 4096)
+                          for i in range(seconds // 10))
+    blocks = [_block(0, _streaminfo(seconds * rate, rate)),
+              _block(3, seekpoints),
+              _block(4, _vorbis_comment(comments)),
+              _block(6, _picture(cover)),
+              _block(1, bytes(padding), last=True)]
+    with open(path, "wb") as file:
+        file.write(b"fLaC" + b"".join(blocks))
+        file.write(b"\xff\xf8" + os.urandom(audio - 2))
+    return path
+
+
+def main(argv):
+    parser = ArgumentParser(description="Benchmark loading FLAC metadata.")
+    parser.add_argument('--corpus', metavar='<folder>',
+                        help="Folder with .flac files, generated when not given.")
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory() as temp:
+        if args.corpus is not None:
+            files = sorted(os.path.join(args.corpus, file) for file in os.listdir(args.corpus)
+                           if file.lower().endswith(".flac"))
+        else:
+            rnd = random.Random(0)
+            files = [flac_file(os.path.join(temp, "{:03d}.flac".format(i)),
+                               comments=rnd.randint(5, 200), cover=rnd.randint(0, 500000))
+                     for i in range(args.files)]
+
+        for name, kwargs in (("full", {}), ("info only", {"info_only": True})):
+            seconds = min(timeit.repeat(lambda: [FLAC(file, **kwargs) for file in files],
+                                        number=1, repeat=args.repeat))
+            print("{:10} {:8.1f} us/file".format(name, seconds / len(files) * 1e6))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures the per-file cost of logging with the settings main.py
+can be started with.
+
+    python -m bench.logging_overhead [files] [repeat]
+
+For every audio file the pipeline scans the folder, normalizes
+its paths and reads a few hundred lines of subprocess progress,
+which is replayed here without running the external tools.
+"""
+
+import os
+import sys
+import logging
+import tempfile
+import timeit
+
+from lib import log
+from lib.log import TRACE
+from lib.tree import Parse
+from lib.util import Tools
+
+logger = logging.getLogger("lib.mux")
+
+#roughly the number of progress lines MP4Box prints per file:
+PROGRESS_LINES = 300
+
+
+def _process(folder):
+    tools = Tools()
+    files = Parse(folder)
+    for file in files.audio_files:
+        tools.path_exists(file)
+        tools.real_path(file)
+        for i in range(PROGRESS_LINES):
+            line = "Importing AAC: |====               | ({}/100)".format(i % 100)
+            if logger.isEnabledFor(TRACE):
+                logger.log(TRACE, "demux current line: %s", line)
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 50
+    repeat = int(argv[2]) if len(argv) > 2 else 20
+
+    settings = [("off", dict(level=logging.WARNING, ring_size=0)),
+                ("default", dict(level=logging.INFO)),
+                ("debug", dict(level=logging.DEBUG)),
+                ("trace", dict(level=TRACE))]
+
+    with tempfile.TemporaryDirectory() as folder, open(os.devnull, "w") as null:
+        for i in range(count):
+            open(os.path.join(folder, "Part {:03d}.m4a".format(i)), "wb").close()
+
+        results = {}
+        for name, kwargs in settings:
+            log.setup(stream=null, **kwargs)
+            seconds = min(timeit.repeat(lambda: _process(folder), number=1, repeat=repeat))
+            results[name] = seconds / count * 1e6
+
+        log.setup(logging.WARNING, ring_size=0)
+
+    print("{:<10} {:>12} {:>12}".format("logging", "us/file", "overhead"))
+    for name, per_file in results.items():
+        print("{:<10} {:>12.1f} {:>11.1f}%".format(
+            name, per_file, (per_file / results["off"] - 1) * 100))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end benchmark of the tagging pipeline.
+
+    python -m bench.run [--corpus <folder>] [--output results.json]
+                        [--baseline baseline.json [--save-baseline]]
+
+Without --corpus a synthetic corpus is generated in a temporary
+folder (see bench/corpus.py). Every stage is run --repeat times and
+the median is recorded. Stages that need something which is not
+available (bs4 for metadata, the MP4Box binary for mux) are reported
+as skipped.
+
+With --baseline every stage is compared with the stored result and
+the exit code is 1 when one of them got slower than --threshold.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import statistics
+from argparse import ArgumentParser
+
+#bundled libraries:
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                             "tools", "mutagen", "lib"))
+
+from lib.tree import Parse
+from bench import corpus
+
+URL = "http://www.audible.com/pd/Sci-Fi-Fantasy/Synthetic-Audiobook/B000000000"
+
+
+class Skipped(Exception):
+    pass
+
+
+def _timed(func, repeat):
+    runs = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def _size(files):
+    return sum(os.path.getsize(file) for file in files)
+
+
+def bench_parse(books, work, **kwargs):
+    def run():
+        for book in books:
+            Parse(book).all_files
+    return run, 0
+
+
+def bench_metadata(books, work, **kwargs):
+    try:
+        from lib.abparse import Metadata
+    except ImportError as err:
+        raise Skipped(err)
+
+    def run():
+        for book in books:
+            metadata = Metadata()
+            metadata.http_page(URL, book)
+            metadata.title
+            metadata.authors
+            metadata.narrators
+            metadata.series()
+            metadata.runtime_sec
+            metadata.date_utc
+            metadata.description
+            metadata.copyright
+    return run, _size(os.path.join(book, "page.pkl") for book in books)
+
+
+def _parts(books):
+    return [file for book in books for file in Parse(book).audio_files]
+
+
+def _binary(path):
+    if path is None or not os.access(path, os.X_OK):
+        raise Skipped("binary not found")
+    return path
+
+
+def bench_demux(books, work, mp4box=None, **kwargs):
+    mp4box = _binary(mp4box)
+    parts = _parts(books)
+
+    def run():
+        for i, part in enumerate(parts):
+            aac = os.path.join(work, "{}.aac".format(i))
+            subprocess.check_call([mp4box, "-raw", "1", part, "-out", aac],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return run, _size(parts)
+
+
+def bench_remux(books, work, mp4box=None, **kwargs):
+    mp4box = _binary(mp4box)
+    parts = _parts(books)
+    aacs = [os.path.join(work, "{}.aac".format(i)) for i in range(len(parts))]
+    if not all(os.path.exists(aac) for aac in aacs):
+        raise Skipped("demux did not run")
+
+    def run():
+        for i, aac in enumerate(aacs):
+            m4b = os.path.join(work, "{}_temp.m4b".format(i))
+            if os.path.exists(m4b):
+                os.remove(m4b)
+            subprocess.check_call([mp4box, "-brand", "M4B ", "-ab", "mp71", "-ipod", "-add",
+                                   "{}:name=Part {}:lang=eng".format(aac, i + 1), m4b],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return run, _size(aacs)
+
+
+def bench_tag(books, work, **kwargs):
+    from lib.template import TagTemplate
+    temps = sorted(os.path.join(work, file) for file in os.listdir(work)
+                   if file.endswith("_temp.m4b"))
+    if not temps:
+        #without MP4Box the generated parts stand in for remuxed ones:
+        temps = _parts(books)
+    cover = os.path.join(books[0], "cover.png")
+    data = {"artist": "Jane Doe (read by John Doe)", "album artist": "Jane Doe",
+            "sort title": "Synthetic Audiobook", "album": "Synthetic Audiobook",
+            "date": "2014-01-01T00:00:00Z", "copyright": "(c) 2014", "description": "x" * 1000,
+            "cover": cover, "tot tracks": len(temps), "disk no": 1}
+
+    def run():
+        #the template is part of the work, it is rendered once per book:
+        template = TagTemplate(data)
+        for i, temp in enumerate(temps):
+            part = dict(data, title="Part {}".format(i + 1))
+            part["track no"] = i + 1
+            template.write(part, temp, os.path.join(work, "tagged_{}.m4b".format(i)))
+    return run, _size(temps)
+
+
+def bench_mutagen_load(books, work, **kwargs):
+    from mutagenx.mp4 import MP4
+    parts = _parts(books)
+
+    def run():
+        for part in parts:
+            MP4(part)
+    return run, 0
+
+
+def bench_mutagen_save(books, work, **kwargs):
+    from mutagenx.mp4 import MP4
+    parts = []
+    for i, part in enumerate(_parts(books)):
+        copy = os.path.join(work, "save_{}.m4a".format(i))
+        shutil.copyfile(part, copy)
+        parts.append(copy)
+
+    def run():
+        for part in parts:
+            mp4 = MP4(part)
+            if mp4.tags is None:
+                mp4.add_tags()
+            #grow the description so the file has to be resized:
+            mp4.tags[b"desc"] = ["y" * (len(mp4.tags.get(b"desc", [""])[0]) + 1500)]
+            mp4.save()
+    return run, 0
+
+
+STAGES = [("parse", bench_parse),
+          ("metadata", bench_metadata),
+          ("demux", bench_demux),
+          ("remux", bench_remux),
+          ("tag", bench_tag),
+          ("mutagen_load", bench_mutagen_load),
+          ("mutagen_save", bench_mutagen_save)]
+
+
+def run_stages(books, repeat, **kwargs):
+    results = {}
+    with tempfile.TemporaryDirectory() as work:
+        for name, setup in STAGES:
+            try:
+                run, size = setup(books, work, **kwargs)
+                runs = _timed(run, repeat)
+            except Skipped as err:
+                results[name] = {"skipped": str(err)}
+                continue
+            seconds = statistics.median(runs)
+            results[name] = {"seconds": seconds,
+                             "runs": runs,
+                             "bytes": size,
+                             "mb_s": size / 2**20 / seconds if size and seconds else None}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return a list of (stage, baseline, current) for every stage that got slower."""
+    regressions = []
+    for name, stage in results["stages"].items():
+        old = baseline.get("stages", {}).get(name, {})
+        if "seconds" not in stage or "seconds" not in old:
+            continue
+        if stage["seconds"] > old["seconds"] * (1 + threshold):
+            regressions.append((name, old["seconds"], stage["seconds"]))
+    return regressions
+
+
+def report(results, baseline=None):
+    lines = ["{:<14} {:>12} {:>10} {:>12}".format("stage", "median ms", "MB/s", "vs baseline")]
+    for name, stage in results["stages"].items():
+        if "skipped" in stage:
+            lines.append("{:<14} skipped: {}".format(name, stage["skipped"]))
+            continue
+        change = ""
+        old = (baseline or {}).get("stages", {}).get(name, {})
+        if "seconds" in old:
+            change = "{:+.1f}%".format((stage["seconds"] / old["seconds"] - 1) * 100)
+        rate = "{:.1f}".format(stage["mb_s"]) if stage["mb_s"] else ""
+        lines.append("{:<14} {:>12.2f} {:>10} {:>12}".format(
+            name, stage["seconds"] * 1e3, rate, change))
+    return "\n".join(lines)
+
+
+def parse_args(argv):
+    parser = ArgumentParser(description="Benchmark the tagging pipeline.")
+    parser.add_argument('--corpus', metavar='<folder>',
+                        help="Folder with book folders, generated when not given.")
+    parser.add_argument('--books', type=int, default=2)
+    parser.add_argument('--parts', type=int, default=3)
+    parser.add_argument('--duration', type=float, default=300.0)
+    parser.add_argument('--fragmented', action='store_true')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--mp4box', default=shutil.which("MP4Box"))
+    parser.add_argument('--output', metavar='<results.json>', default="bench_results.json")
+    parser.add_argument('--baseline', metavar='<baseline.json>')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Store the results as the new baseline.")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Allowed slowdown against the baseline. [default: %(default)s]")
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as temp:
+        if args.corpus is not None:
+            books = sorted(os.path.join(args.corpus, book) for book in os.listdir(args.corpus)
+                           if os.path.isdir(os.path.join(args.corpus, book)))
+        else:
+            books = corpus.generate(temp, args.books, args.parts, args.duration,
+                                    fragmented=args.fragmented)
+
+        results = {"created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                   "python": platform.python_version(),
+                   "platform": platform.platform(),
+                   "corpus": {"books": len(books), "parts": len(_parts(books)),
+                              "bytes": _size(_parts(books))},
+                   "repeat": args.repeat,
+                   "stages": run_stages(books, args.repeat, mp4box=args.mp4box)}
+
+    with open(args.output, mode='w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+
+    baseline = None
+    if args.baseline is not None and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+
+    print(report(results, baseline))
+
+    status = 0
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, old, new in regressions:
+            print("REGRESSION: {} {:.2f} ms -> {:.2f} ms".format(name, old * 1e3, new * 1e3))
+        status = 1 if regressions else 0
+
+    if args.save_baseline and args.baseline is not None:
+        shutil.copyfile(args.output, args.baseline)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -8,7 +8,6 @@ class Config:
         self._verbose = False
         self._input_folder = None
         self._mp4box = ""
-        self._atomicparsley = ""
         self._cover = None
         self._audio_files = []
         self._url = None
@@ -17,6 +16,7 @@ class Config:
         self._narrators = None
         self._series_title = None
         self._series_no = None
+        self._runtime = None
         self._date = None
         self._description = None
         self._copyright = None
@@ -45,13 +45,6 @@ class Config:
     def mp4box(self, value):
         self._mp4box = value
 
-    @property
-    def atomicparsley(self):
-        return self._atomicparsley
-    @atomicparsley.setter
-    def atomicparsley(self, value):
-        self._atomicparsley = value
-
     @property
     def cover(self):
         return self._cover
@@ -157,6 +150,13 @@ class Config:
             except ValueError:
                 self._series_no = 0
 
+    @property
+    def runtime(self):
+        return self._runtime
+    @runtime.setter
+    def runtime(self, val):
+        self._runtime = val
+
     @property
     def date(self):
         return self._date
@@ -10,22 +10,15 @@ from PyQt5 import QtCore
 from config import Config
 from lib.tree import Parse
 from lib.abparse import Metadata
-from lib.mux import Muxer
-from lib.tag import Tag
+from lib.fetch import Fetch
+from lib import sidecar
+from lib import embedded
+from lib import catalog
+from lib.pipeline import Pipeline, tag_data
+from lib.schedule import format_eta
 from gui.resources import Icons
 
-DEBUG = True
-
 logger = logging.getLogger(__name__)
-if DEBUG:
-    logger.setLevel(logging.DEBUG)
-    log_format = logging.Formatter("%(lineno)d: %(funcName)s, %(module)s.py, %(levelname)s: %(message)s")
-else:
-    logger.setLevel(logging.ERROR)
-    log_format = logging.Formatter("%(levelname)s: %(message)s")
-stream = logging.StreamHandler()
-stream.setFormatter(log_format)
-logger.addHandler(stream)
 debug = logger.debug
 error = logger.error
 warn = logger.warning
@@ -52,9 +45,22 @@ class Wizard(QtWidgets.QWizard):
         #self._dialog = QtWidgets.QMessageBox(self)
         #self.mp4box.error.connect(self._error_dialog)
 
-        self.setPage(self.PathPage, PathPage(config))
-        self.setPage(self.URLPage, URLPage(config))
-        self.setPage(self.ProcessingPage, ProcessingPage(config))
+        #metadata for a url given on the command line is fetched
+        #while the user is still choosing the files, unless the
+        #folder already has it:
+        self._fetch = Fetch()
+        if sidecar.find(config.input_folder) is None:
+            self._fetch.prefetch(config.url)
+        #every fetched book is remembered to match folders later:
+        self._catalog = catalog.load()
+
+        #parts are remuxed as soon as the files are chosen,
+        #tagging follows once the metadata is entered:
+        self._pipeline = Pipeline(config.mp4box)
+
+        self.setPage(self.PathPage, PathPage(config, self._pipeline))
+        self.setPage(self.URLPage, URLPage(config, self._fetch, self._catalog))
+        self.setPage(self.ProcessingPage, ProcessingPage(config, self._pipeline))
         self.setStartId(self.PathPage)
 
         QtWidgets.QShortcut(QtGui.QKeySequence("Ctrl+Q"), self, self.close)
@@ -84,7 +90,7 @@ class Wizard(QtWidgets.QWizard):
 
 
 class PathPage(QtWidgets.QWizardPage):
-    def __init__(self, config, parent=None):
+    def __init__(self, config, pipeline=None, parent=None):
         super(PathPage, self).__init__(parent)
         debug("instantiated PathsPage class")
 
@@ -93,6 +99,8 @@ class PathPage(QtWidgets.QWizardPage):
         else:
             self.config = config
 
+        self._pipeline = pipeline
+
         self.setTitle("Audio files path")
         self.setSubTitle("Choose a path which contains audio files to tag:")
 
@@ -323,8 +331,10 @@ class PathPage(QtWidgets.QWizardPage):
 
     def validatePage(self):
         """Just before going to the next page
-        store all data in config."""
+        store all data in config and start remuxing."""
         self._store_files_data()
+        if self._pipeline is not None:
+            self._pipeline.remux_all(self._audio_files)
         return True
 
     def initializePage(self):
@@ -346,7 +356,9 @@ class DescriptionBox(QtWidgets.QPlainTextEdit):
 
 
 class URLPage(QtWidgets.QWizardPage):
-    def __init__(self, config, parent=None):
+    SUBTITLE = "Enter an audible url that points to the metadata of your book."
+
+    def __init__(self, config, fetch=None, catalog=None, parent=None):
         super(URLPage, self).__init__(parent)
         debug("instantiated URLPage class")
 
@@ -355,10 +367,16 @@ class URLPage(QtWidgets.QWizardPage):
         else:
             self.config = config
 
-        self.metadata = Metadata()
+        #metadata is fetched in the background and fills the form as it comes in,
+        #the fetch is shared with the wizard so a prefetched result is reused:
+        self._fetch = fetch if fetch is not None else Fetch()
+        self._fetch.field.connect(self._receive_field)
+        self._fetch.error.connect(self._receive_fetch_error)
+        self._fetch.finished.connect(self._fetch_finished)
+        self._catalog = catalog
 
         self.setTitle("URL")
-        self.setSubTitle("Enter an audible url that points to the metadata of your book.")
+        self.setSubTitle(self.SUBTITLE)
         self.setStyleSheet("")
 
         #add widgets:
@@ -433,6 +451,8 @@ class URLPage(QtWidgets.QWizardPage):
         self._date = None
         self._description = None
         self._copyright = None
+        self._runtime = None
+        self._series_url = None
 
         #self._check_url_update_gui()
 
@@ -571,7 +591,7 @@ class URLPage(QtWidgets.QWizardPage):
 
         self._main_layout.addWidget(group_box)
 
-    def _check_url_update_gui(self):
+    def _check_url_update_gui(self, force=False):
         debug("updating url box")
 
         if self._url is not None:
@@ -580,11 +600,10 @@ class URLPage(QtWidgets.QWizardPage):
                 self._url_edit.setStyleSheet("")
                 #set text of box (again if needed):
                 self._url_edit.setText(self._url)
-                #update gui with real metadata:
-                self._load_metadata()
-                self._update_gui()
-                #only now enable next button:
-                self._next_button_enabled(True)
+                #clear the gui and start fetching real metadata,
+                #next button is enabled once all of it arrived:
+                self._next_button_enabled(False)
+                self._load_metadata(force)
                 return
             else:
                 debug("url is invalid")
@@ -597,7 +616,6 @@ class URLPage(QtWidgets.QWizardPage):
                 self._next_button_enabled(False)
                 #update gui with empty values:
                 self._load_metadata()
-                self._update_gui()
                 return
         else:
             self._url_edit.setStyleSheet("")
@@ -605,7 +623,6 @@ class URLPage(QtWidgets.QWizardPage):
             self._next_button_enabled(False)
             #update gui with empty values:
             self._load_metadata()
-            self._update_gui()
             return
 
     @QtCore.pyqtSlot()
@@ -620,7 +637,7 @@ class URLPage(QtWidgets.QWizardPage):
     @QtCore.pyqtSlot()
     def _reload_clicked(self):
         self._url = self._url_edit.text()
-        self._check_url_update_gui()
+        self._check_url_update_gui(force=True)
         return
 
     @QtCore.pyqtSlot()
@@ -660,35 +677,146 @@ class URLPage(QtWidgets.QWizardPage):
         else:
             return
 
-    def _load_metadata(self):
+    def _load_metadata(self, force=False):
         debug("loading metadata from url: %s", self._url)
 
+        #set all class members to empty values,
+        #the fetch fills them in one by one:
+        self._title = ""
+        self._authors = ""
+        self._narrators = ""
+        self._series = ""
+        self._series_no = ""
+        self._date = ""
+        self._description = ""
+        self._copyright = ""
+        self.setSubTitle(self.SUBTITLE)
+        self._update_gui()
+
         if self._url is not None:
-            #read metadata and set class members:
-            #TODO: handle exceptions!
-            self.metadata.http_page(self._url)
-            self._title = self.metadata.title
-            self._authors = self.metadata.authors
-            self._narrators = self.metadata.narrators
-            (self._series, self._series_no) = self.metadata.series()
-            self._date = self.metadata.date_utc
-            self._description = self.metadata.description
-            self._copyright = self.metadata.copyright
-            debug("got metadata from url")
+            #results of an earlier url are dropped,
+            #those of a prefetch of the same url are replayed:
+            self._fetch.fetch(self._url, force=force)
             return
         else:
-            #set all class members to empty values:
-            self._title = ""
-            self._authors = ""
-            self._narrators = ""
-            self._series = ""
-            self._series_no = ""
-            self._date = ""
-            self._description = ""
-            self._copyright = ""
+            self._fetch.cancel()
             debug("set metadata to blank values")
             return
 
+    @QtCore.pyqtSlot(str, object)
+    def _receive_field(self, name, value):
+        debug("got %s from fetch: %s", name, value)
+        if value is None:
+            value = ("", "") if name == "series" else ""
+
+        if name == "series":
+            (self._series, self._series_no) = value
+            self._series_edit.setText(self._series)
+            self._series_no_edit.setText(str(self._series_no))
+        elif name == "description":
+            self._description = value
+            self._description_edit.setPlainText(value)
+        elif name in ("runtime", "series_url"):
+            setattr(self, "_{}".format(name), value)
+        else:
+            setattr(self, "_{}".format(name), value)
+            getattr(self, "_{}_edit".format(name)).setText(value)
+        return
+
+    @QtCore.pyqtSlot(str)
+    def _receive_fetch_error(self, msg):
+        warn("fetching metadata failed: %s", msg)
+        self._url_edit.setStyleSheet("font-style: italic; color: red;")
+        self.setSubTitle("Could not load metadata: {}".format(msg))
+        return
+
+    @QtCore.pyqtSlot()
+    def _fetch_finished(self):
+        debug("got metadata from url")
+        #keep the result next to the files, later runs need no network:
+        sidecar.export(self.config.input_folder, self._fetch.fields, self._fetch.url)
+        if self._catalog is not None:
+            self._catalog.add(self._fetch.url, self._fetch.fields)
+        self._next_button_enabled(True)
+        return
+
+    def _load_sidecar(self):
+        """Fill the page from a sidecar in the input folder,
+        returns False if there is none."""
+        path = sidecar.find(self.config.input_folder)
+        if path is None:
+            return False
+        try:
+            if not sidecar.load(path, self.config):
+                return False
+        except sidecar.SidecarError as err:
+            warn("ignoring sidecar: %s", err.msg)
+            return False
+
+        self._fetch.cancel()
+        if self.config.url is not None:
+            self._url = self.config.url
+            self._url_edit.setText(self._url)
+
+        self._fill_from_config()
+        self.setSubTitle("Loaded metadata from {}".format(os.path.basename(path)))
+        self._next_button_enabled(True)
+        return True
+
+    def _load_embedded(self):
+        """Prefill the page from the tags already in the first part,
+        returns False if it has none."""
+        if not self.config.audio_files:
+            return False
+        first = self.config.audio_files[0]
+        try:
+            data = embedded.read(first)
+        except OSError as err:
+            warn("could not read tags of %s: %s", first, err)
+            return False
+        if not sidecar.apply(data, self.config):
+            return False
+
+        self._fill_from_config()
+        self.setSubTitle("Prefilled from the tags of {}".format(os.path.basename(first)))
+        self._next_button_enabled(embedded.complete(data))
+        return True
+
+    def _load_catalog(self):
+        """Fill the page from the local catalog if the folder name and
+        length of the parts match a known book, returns False if not."""
+        if self._catalog is None or self.config.input_folder is None:
+            return False
+        name = os.path.basename(self.config.input_folder)
+        data = self._catalog.resolve(name, catalog.duration(self.config.audio_files))
+        if data is not None and not embedded.complete(data):
+            #known from a series listing only, fetch the rest:
+            self._url = data["url"]
+            self._url_edit.setText(self._url)
+            return False
+        if data is None or not sidecar.apply(data, self.config):
+            return False
+
+        self._url = self.config.url
+        self._url_edit.setText(self._url)
+        self._fill_from_config()
+        self.setSubTitle("Matched {} in the local catalog".format(name))
+        self._next_button_enabled(True)
+        return True
+
+    def _fill_from_config(self):
+        self._title = self.config.title
+        self._authors = self.config.authors_string
+        self._narrators = self.config.narrators_string
+        self._series = self.config.series_title or ""
+        self._series_no = self.config.series_no or ""
+        self._date = self.config.date
+        self._description = self.config.description
+        self._copyright = self.config.copyright
+        self._runtime = self.config.runtime
+        self._update_gui()
+        return
+
     def _update_gui(self):
         debug("updating gui with metadata")
         #dumb function that sets whatever class members contain:
@@ -767,11 +895,19 @@ class URLPage(QtWidgets.QWizardPage):
         return Wizard.ProcessingPage
 
     def initializePage(self):
+        #metadata stored with the files wins over the network,
+        #tags already in the files are used when no url is given:
+        if self._load_sidecar():
+            return
+        if self._load_embedded() and self._url is None:
+            return
+        if self._url is None and self._load_catalog():
+            return
         self._check_url_update_gui()
 
 
 class ProcessingPage(QtWidgets.QWizardPage):
-    def __init__(self, config, parent=None):
+    def __init__(self, config, pipeline, parent=None):
         super(ProcessingPage, self).__init__(parent)
         debug("instantiated ProcessingPage class")
 
@@ -783,23 +919,15 @@ class ProcessingPage(QtWidgets.QWizardPage):
         self.setTitle("Processing")
         self.setSubTitle("Review the data that will be used for tagging each file. When ready click Start.")
 
-        #create an instance of mp4box and atomicparsley controllers and threads
-        #connect progress. message and error signals to functions that update
-        #gui elements and widgets
-        self._mp4box = Muxer(config.mp4box)
-        self._mp4box.progress.connect(self._update_progress_bar)
-        self._mp4box.message.connect(self._update_text_box_message)
-        self._mp4box.error.connect(self._update_text_box_error)
-
-        self._tagger = Tag(config.atomicparsley)
-        self._tagger.progress.connect(self._update_progress_bar)
-        self._tagger.message.connect(self._update_text_box_message)
-        self._tagger.error.connect(self._update_text_box_error)
-
-        #create an instance of the controller class that manages calling mp4box and atomicparsley
-        #threads and emits only one signal when it's finished
-        self._controller = Controller(self._mp4box, self._tagger)
-        self._controller.finished.connect(self._finished)
+        #the pipeline has been remuxing since the files were chosen,
+        #connect progress, message and error signals to functions that
+        #update gui elements and widgets:
+        self._pipeline = pipeline
+        self._pipeline.progress.connect(self._update_progress_bar)
+        self._pipeline.message.connect(self._update_text_box_message)
+        self._pipeline.error.connect(self._update_text_box_error)
+        self._pipeline.finished.connect(self._finished)
+        self._pipeline.stopped.connect(self._stopped)
 
         self._main_layout = QtWidgets.QVBoxLayout()
         self._tree_table_layout = QtWidgets.QHBoxLayout()
@@ -813,7 +941,6 @@ class ProcessingPage(QtWidgets.QWizardPage):
         self._start_stop_button = QtWidgets.QPushButton()
 
         self._database = {}
-        self._file_queue = []
 
     def _setup_widgets(self):
         self._log_view.setMaximumHeight(100)
@@ -914,60 +1041,16 @@ class ProcessingPage(QtWidgets.QWizardPage):
     def _parse_metadata(self):
         """Creates a list of dicts that map metadata to each file
         to be tagged."""
-
-        #create/reset database:
-        self._database = {}
-
-        current_track_no = 0
-        for audio_file in self.config.audio_files:
-            debug("parsing through metadata for file: %s", audio_file)
-
-            audio_file_data = {}
-
-            audio_file_data["file"] = audio_file
-
-            audio_file_data["cover"] = self.config.cover
-
-            current_track_no += 1
-            audio_file_data["track no"] = current_track_no
-
-            audio_file_data["tot tracks"] = len(self.config.audio_files)
-
-            audio_file_data["disk no"] = self.config.series_no
-
-            audio_file_data["title"] = self.config.title_full(current_track_no)
-
-            audio_file_data["sort title"] = self.config.title_sort
-
-            artist_string = "{} (read by {})".format(self.config.authors_string,
-                                                     self.config.narrators_string)
-            audio_file_data["artist"] = artist_string
-
-            audio_file_data["album artist"] = self.config.authors_string
-
-            if self.config.series_title is not None:
-                audio_file_data["album"] = self.config.series_title
-            else:
-                audio_file_data["album"] = self.config.title
-
-            audio_file_data["description"] = self.config.description
-
-            audio_file_data["copyright"] = self.config.copyright
-
-            audio_file_data["date"] = self.config.date
-
-            debug("audio_file_data: %s", audio_file_data)
-
-            self._database.update({audio_file: audio_file_data})
+        self._database = tag_data(self.config)
         return
 
-    def _create_queue(self):
-        for item in self._database.keys():
-            self._file_queue.append(self._database[item])
+    def _update_eta(self):
+        self._progress_bar.setFormat("%p% - ETA {}".format(format_eta(self._pipeline.eta())))
 
     @QtCore.pyqtSlot(int)
     def _update_progress_bar(self, value):
         self._progress_bar.setValue(value)
+        self._update_eta()
 
     @QtCore.pyqtSlot(str)
     def _update_text_box_message(self, value):
@@ -981,63 +1064,30 @@ class ProcessingPage(QtWidgets.QWizardPage):
     def _start_stop_button_clicked(self):
         self._start_stop_button.clicked.disconnect()
         self._start_stop_button.setText("Stop")
-        self._start_stop_button.clicked.connect(self._mp4box.exit_thread)
+        self._start_stop_button.clicked.connect(self._pipeline.stop)
 
-        self._loop()
+        #the files are remuxed again if a stop dropped them:
+        self._pipeline.remux_all(self.config.audio_files)
+        self._pipeline.tag_all(self._database)
+        self._update_text_box_message("ETA: {}".format(format_eta(self._pipeline.eta())))
 
-    def _loop(self):
-        if len(self._file_queue) > 0:
-            file = self._file_queue.pop(0)
-            self._controller.process_file(file)
-        else:
-            self._finished()
+    @QtCore.pyqtSlot()
+    def _stopped(self):
+        self._start_stop_button.clicked.disconnect()
+        self._start_stop_button.setText("Start")
+        self._start_stop_button.clicked.connect(self._start_stop_button_clicked)
+        self._progress_bar.setValue(0)
 
     @QtCore.pyqtSlot()
     def _finished(self):
-        if len(self._file_queue) == 0:
-            self._start_stop_button.clicked.disconnect()
-            self._start_stop_button.setText("Done")
-            self._start_stop_button.setDisabled(True)
-            self._update_text_box_message("Finished!")
-        else:
-            self._loop()
+        self._start_stop_button.clicked.disconnect()
+        self._start_stop_button.setText("Done")
+        self._start_stop_button.setDisabled(True)
+        self._progress_bar.setFormat("%p%")
+        self._update_text_box_message("Finished!")
 
     def initializePage(self):
         self._parse_metadata()
-        self._create_queue()
         self._setup_layout()
         self._setup_widgets()
 
-
-class Controller(QtCore.QObject):
-    finished = QtCore.pyqtSignal()
-
-    def __init__(self, mp4box_instance, ap_instance, parent=None):
-        super().__init__(parent)
-        debug("initialized Controller")
-
-        self._mp4box = mp4box_instance
-        self._mp4box.finished.connect(self._tag_file)
-
-        self._tagger = ap_instance
-        self._tagger.finished.connect(self._finished)
-
-        self._data = {}
-
-    def process_file(self, data):
-        self._data = data
-
-        debug("processing file: %s", self._data["file"])
-
-        self._mp4box.reset()
-        self._mp4box.remux(self._data["file"], self._data["track no"])
-
-    @QtCore.pyqtSlot()
-    def _tag_file(self):
-        self._tagger.reset()
-        self._tagger.tag(self._data)
-
-    @QtCore.pyqtSlot()
-    def _finished(self):
-        debug("Finished processing files")
-        self.finished.emit()
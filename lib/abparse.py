@@ -4,8 +4,7 @@ import re
 import os
 import time
 import logging
-import urllib.error
-import urllib.request
+import urllib.parse
 
 try:
     from bs4 import BeautifulSoup
@@ -19,20 +18,10 @@ except ImportError:
 del html5lib
 
 from lib.util import Tools
+from lib import net
+from lib.trace import span
 
-DEBUG = True
-
-#logging is enabled only for debugging
 logger = logging.getLogger(__name__)
-if DEBUG:
-    logger.setLevel(logging.DEBUG)
-    log_format = "%(lineno)d: %(funcName)s, %(module)s.py, %(levelname)s: %(message)s"
-    fmt = logging.Formatter(log_format, datefmt="%d/%m-%H:%M")
-    stream = logging.StreamHandler()
-    stream.setFormatter(fmt)
-else:
-    stream = logging.NullHandler()
-logger.addHandler(stream)
 debug = logger.debug
 
 
@@ -66,6 +55,53 @@ class FileError(Exception):
         self.msg = msg
 
 
+def download(url, cancelled=None):
+    """Returns the contents of url, raises HTTPException or URLException;
+    the download stops with URLException once cancelled() returns True."""
+    try:
+        debug("downloading from url: %s", url)
+        with span("download", cat="metadata", url=url) as request:
+            response = net.client().get(url, cancelled)
+            request.set(bytes=len(response.body), cached=response.cached)
+
+    except net.StatusError as err:
+        raise HTTPException(err.msg) from None
+
+    except net.RequestError as err:
+        raise URLException(err.msg) from None
+
+    return response.body
+
+
+def runtime_to_sec(runtime):
+    """Converts a runtime string like "23 hrs 45 mins" into seconds."""
+    #match string like:
+    #    23 hrs 45 mins
+    #    15 hrs
+    #returns an iterator of matches in sequence
+    exp = re.compile(r'^(\d+)|\s(\d+)')
+    match = re.findall(exp, runtime)
+
+    #filter through tuples for actual results producing a list of either one or two entries:
+    runtime_match_results = [l[0] or l[1] for l in match if l]
+    debug("runtime_match_results: %s", runtime_match_results)
+
+    if runtime_match_results:
+        if len(runtime_match_results) == 1:  # only hrs
+            hrs = int(runtime_match_results[0])
+
+            return hrs * 60 * 60
+        elif len(runtime_match_results) == 2:  # both hrs and mins
+            hrs = int(runtime_match_results[0])
+            mins = int(runtime_match_results[1])
+
+            return (hrs * 60 * 60) + (mins * 60)
+        else:
+            raise RegExException("could not convert runtime string into secconds")
+    else:
+        raise RegExException("could not parse runtime string")
+
+
 class Metadata:
     def __init__(self):
         self._url = None
@@ -110,35 +146,26 @@ class Metadata:
         else:
             return False
 
-    def _http_download(self, url, path=None):
+    def _http_download(self, url, path=None, cancelled=None):
         """Download html page and save downloaded file to pickle"""
-        try:
-            debug("downloading from url: %s", url)
-            self._html = urllib.request.urlopen(url).read()
-
-        except urllib.error.HTTPError as err:
-            raise HTTPException("the server couldn't fulfill the request, \
-                                reason: {}".format(err.code)) from None
+        self._html = download(url, cancelled)
 
-        except urllib.error.URLError as err:
-            raise URLException("failed to reach server, reason: {}".format(err.reason)) from None
-
-        else:
-            if path is not None:
-                if os.path.isdir(path):
-                    html_dump = os.path.join(path, "page.pkl")
-                    debug("saving downloaded data to: %s", html_dump)
-                    return Tools.dump_pickle(html_dump, self._html)
+        if path is not None:
+            if os.path.isdir(path):
+                html_dump = os.path.join(path, "page.pkl")
+                debug("saving downloaded data to: %s", html_dump)
+                return Tools.dump_pickle(html_dump, self._html)
 
-                else:
-                    raise ValueError("path must be a folder") from None
             else:
-                return True
+                raise ValueError("path must be a folder") from None
+        else:
+            return True
 
     def _local_file(self, file_path):
         """Load html from local file"""
         try:
-            with open(file_path, encoding='utf-8') as file:
+            with open(file_path, encoding='utf-8') as file, \
+                    span("parse", cat="metadata", bytes=os.path.getsize(file_path)):
                 self._soup = BeautifulSoup(file, "html5lib")
                 self._test_soup()
                 return
@@ -157,7 +184,8 @@ class Metadata:
     def _create_soup(self):
         """Create a soup object by parsing html data"""
         if self._html is not None:
-            self._soup = BeautifulSoup(self._html, "html5lib")
+            with span("parse", cat="metadata", bytes=len(self._html)):
+                self._soup = BeautifulSoup(self._html, "html5lib")
             self._test_soup()
         return
 
@@ -271,6 +299,12 @@ class Metadata:
             self._series_tuple = None
             return
 
+    def _series_url(self):
+        series = self._soup.find('div', {'class': 'adbl-series-link'})
+        if series and series.a and series.a.get('href'):
+            return urllib.parse.urljoin(self._url or "http://www.audible.com/", series.a['href'])
+        return None
+
 ########    METHODS THAT EXTRAT RUNTIME DATA    ####
     def _set_runtime(self):
         runtime = self._soup.find('span', {'class': 'adbl-run-time'})
@@ -282,33 +316,8 @@ class Metadata:
         if self._runtime is None:
             self._set_runtime()
 
-        #match string like:
-        #    23 hrs 45 mins
-        #    15 hrs
-        #returns an iterator of matches in sequence
-        exp = re.compile(r'^(\d+)|\s(\d+)')
-        match = re.findall(exp, self._runtime)
-
-        #filter through tuples for actual results producing a list of either one or two entries:
-        runtime_match_results = [l[0] or l[1] for l in match if l]
-        debug("runtime_match_results: %s", runtime_match_results)
-
-        if runtime_match_results:
-            if len(runtime_match_results) == 1:  # only hrs
-                hrs = int(runtime_match_results[0])
-
-                self._runtime_sec = hrs * 60 * 60
-                return
-            elif len(runtime_match_results) == 2:  # both hrs and mins
-                hrs = int(runtime_match_results[0])
-                mins = int(runtime_match_results[1])
-
-                self._runtime_sec = (hrs * 60 * 60) + (mins * 60)
-                return
-            else:
-                raise RegExException("could not convert runtime string into secconds")
-        else:
-            raise RegExException("could not parse runtime string")
+        self._runtime_sec = runtime_to_sec(self._runtime)
+        return
 
 ########    METHODS THAT EXTRACT RELEASE DATE DATA  ####
     def _set_date_span(self):
@@ -374,15 +383,17 @@ class Metadata:
         self._soup = None
         return
 
-    def http_page(self, url, path=None):
+    def http_page(self, url, path=None, cancelled=None):
         """
         Method that downloads all contents from a web page.
 
-        url:    has to start with "http://www.audible.com/pd/"
-        path:   optional path to save and load backups of data,
-                it can be a file or folder
+        url:        has to start with "http://www.audible.com/pd/"
+        path:       optional path to save and load backups of data,
+                    it can be a file or folder
+        cancelled:  optional callable, the download stops once it returns True
         """
         if self.is_url_valid(url):
+            self._url = url
             #no soup object exists:
             if self._soup is None:
                 #a path was provided and loading from pickle worked:
@@ -391,7 +402,7 @@ class Metadata:
                 else:
                     #no data available so it has to be downloaded
                     #if path is provided a backup will be done:
-                    if self._http_download(url, path):
+                    if self._http_download(url, path, cancelled):
                         pass
                     else:
                         raise HTTPException("could not load html data from {}".format(path))
@@ -438,6 +449,11 @@ class Metadata:
             self._set_series_tuple()
         return self._series_tuple
 
+    @property
+    def series_url(self):
+        """Url of the listing of the series the book belongs to, None if there is none."""
+        return self._series_url()
+
     @property
     def runtime_string(self):
         self._set_runtime()
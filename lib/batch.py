@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+
+from PyQt5 import QtCore
+
+from config import Config
+from lib.tree import Parse
+from lib.pipeline import Pipeline, tag_data
+from lib import sidecar
+from lib import embedded
+from lib import catalog
+from lib import cover
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+info = logger.info
+warn = logger.warning
+
+
+def book_folders(folder):
+    """Returns folder if it holds audio files, otherwise all its subfolders that do."""
+    if Parse(folder).audio_files:
+        return [folder]
+    folders = []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if os.path.isdir(path) and Parse(path).audio_files:
+            folders.append(path)
+    return folders
+
+
+def _harvest(fields, books):
+    """Loads the listing of the series of a fetched book into books, once per series."""
+    series_url = fields.get("series_url")
+    if not series_url or books.harvested(series_url):
+        return
+    from lib import series
+    from lib.abparse import HTTPException, URLException, BS4Exception
+    series_title = (fields.get("series") or ("", ""))[0] or None
+    try:
+        count = series.harvest(series_url, books, series_title)
+    except (HTTPException, URLException, BS4Exception) as err:
+        warn("could not load series %s: %s", series_url, err.msg)
+    else:
+        info("added %s books of %s to the catalog", count, series_title or series_url)
+
+
+def resolve(folder, base, url=None, books=None):
+    """
+    Creates the Config of one book.
+
+    The metadata comes from the first of:
+        the sidecar in folder,
+        the tags of the first part, if they are complete,
+        the Catalog books, matching the folder name and the
+        length of the parts,
+        url, fetched from the network (the result is kept
+        in a sidecar and the catalog for the next run, together
+        with the other books of its series)
+
+    A catalog match that only came from a series listing gives
+    the url, its description and copyright are fetched.
+
+    Returns (config, source) with source one of "sidecar",
+    "tags", "catalog" or "network", or (config, None) if
+    nothing was found.
+    """
+    config = Config()
+    config.mp4box = base.mp4box
+    config.input_folder = folder
+
+    files = Parse(folder)
+    config.audio_files = files.audio_files
+    config.cover = base.cover if base.cover is not None else files.cover
+
+    path = sidecar.find(folder)
+    if path is not None:
+        try:
+            if sidecar.load(path, config):
+                return config, "sidecar"
+        except sidecar.SidecarError as err:
+            warn("ignoring sidecar: %s", err.msg)
+
+    data = embedded.read(config.audio_files[0])
+    if embedded.complete(data):
+        sidecar.apply(data, config)
+        return config, "tags"
+
+    if books is not None and url is None:
+        data = books.resolve(os.path.basename(folder), catalog.duration(config.audio_files))
+        if data is not None and embedded.complete(data):
+            sidecar.apply(data, config)
+            try:
+                sidecar.write(os.path.join(folder, sidecar.SIDECAR), data)
+            except OSError as err:
+                warn("could not write sidecar: %s", err)
+            return config, "catalog"
+        elif data is not None:
+            #known from a series listing only, the product page has the rest:
+            url = data["url"]
+
+    if url is not None:
+        #only needed here, keeps batch runs from importing bs4 otherwise:
+        from lib import fetch
+        from lib.abparse import HTTPException, URLException, BS4Exception
+        try:
+            fields = fetch.fetch(url)
+        except (HTTPException, URLException, BS4Exception) as err:
+            warn("could not fetch %s: %s", url, err.msg)
+        else:
+            sidecar.export(folder, fields, url)
+            if books is not None:
+                books.add(url, fields)
+                _harvest(fields, books)
+            sidecar.apply(sidecar.from_fields(fields, url), config)
+            return config, "network"
+
+    return config, None
+
+
+class Batch(QtCore.QObject):
+    """
+    Tags a list of book folders one after the other without
+    the wizard, see resolve for where the metadata comes from.
+    Books without metadata are skipped.
+
+    results:    list of (folder, source) with source None for
+                skipped books
+    """
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, config, folders, parent=None):
+        super().__init__(parent)
+        debug("initialized Batch")
+
+        self._config = config
+        self._folders = list(folders)
+        self._catalog = catalog.load()
+        self._covers = {}
+        self.results = []
+
+        self._pipeline = Pipeline(config.mp4box)
+        self._pipeline.message.connect(self._receive_message)
+        self._pipeline.error.connect(self._receive_error)
+        self._pipeline.finished.connect(self._next_book)
+
+    @property
+    def failed(self):
+        return [folder for folder, source in self.results if source is None]
+
+    @QtCore.pyqtSlot()
+    def start(self):
+        info("tagging %s books", len(self._folders))
+        #covers of all books are normalized up front, in parallel:
+        covers = [self._config.cover] + [Parse(folder).cover for folder in self._folders]
+        self._covers = cover.normalize_all(covers)
+        self._next_book()
+
+    @QtCore.pyqtSlot()
+    def _next_book(self):
+        while self._folders:
+            folder = self._folders.pop(0)
+            #a url on the command line only makes sense for a single book:
+            url = self._config.url if len(self.results) == 0 and not self._folders else None
+
+            config, source = resolve(folder, self._config, url, self._catalog)
+            self.results.append((folder, source))
+            if source is None:
+                warn("no metadata for %s, skipped", folder)
+                continue
+
+            info("%s: metadata from %s", os.path.basename(folder), source)
+            config.cover = self._covers.get(config.cover, config.cover)
+            self._pipeline.remux_all(config.audio_files)
+            self._pipeline.tag_all(tag_data(config))
+            return
+
+        info("finished, %s books skipped", len(self.failed))
+        self.finished.emit()
+
+    @QtCore.pyqtSlot(str)
+    def _receive_message(self, msg):
+        debug(msg)
+
+    @QtCore.pyqtSlot(str)
+    def _receive_error(self, msg):
+        logger.error(msg)
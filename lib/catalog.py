@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import math
+import time
+import sqlite3
+import logging
+
+try:
+    from mutagenx.mp4 import MP4
+    from lib.embedded import ATOMS
+except ImportError:
+    MP4 = None
+
+from lib.trace import span
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+
+#default location, shared by all runs of the user:
+CATALOG = os.path.join(os.path.expanduser("~"), ".abtag", "catalog.db")
+
+#product urls end with the ASIN, optionally followed by /ref=... or ?...:
+ASIN_RE = re.compile(r"/([A-Z0-9]{10})(?:[/?]|$)")
+TOKEN_RE = re.compile(r"[^\W_]+")
+#words in folder names that say nothing about the book:
+STOPWORDS = {"the", "a", "an", "of", "and", "part", "parts", "book", "unabridged",
+             "abridged", "audiobook", "audio", "m4a", "m4b", "aac", "mp3", "cd", "disc"}
+
+#candidates taken from the full text index before scoring:
+CANDIDATES = 50
+#runtimes on audible are rounded to the minute, allow that plus 2%:
+RUNTIME_SLACK = 60
+RUNTIME_SHARE = 0.02
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    asin TEXT UNIQUE,
+    url TEXT,
+    title TEXT,
+    authors TEXT,
+    narrators TEXT,
+    series_title TEXT,
+    series_no INTEGER,
+    runtime INTEGER,
+    date TEXT,
+    description TEXT,
+    copyright TEXT
+);
+CREATE INDEX IF NOT EXISTS books_runtime ON books(runtime);
+CREATE TABLE IF NOT EXISTS series (
+    url TEXT PRIMARY KEY,
+    harvested REAL
+);
+"""
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, authors, narrators, series_title,
+    content='books', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS books_ai AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts(rowid, title, authors, narrators, series_title)
+    VALUES (new.id, new.title, new.authors, new.narrators, new.series_title);
+END;
+CREATE TRIGGER IF NOT EXISTS books_ad AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, title, authors, narrators, series_title)
+    VALUES ('delete', old.id, old.title, old.authors, old.narrators, old.series_title);
+END;
+CREATE TRIGGER IF NOT EXISTS books_au AFTER UPDATE ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, title, authors, narrators, series_title)
+    VALUES ('delete', old.id, old.title, old.authors, old.narrators, old.series_title);
+    INSERT INTO books_fts(rowid, title, authors, narrators, series_title)
+    VALUES (new.id, new.title, new.authors, new.narrators, new.series_title);
+END;
+"""
+COLUMNS = ("asin", "url", "title", "authors", "narrators", "series_title", "series_no",
+           "runtime", "date", "description", "copyright")
+
+
+def asin(url):
+    """Returns the ASIN of a product url or None."""
+    match = ASIN_RE.search(url or "")
+    return match.group(1) if match else None
+
+
+def tokens(text):
+    return [token for token in TOKEN_RE.findall(text.lower())
+            if token not in STOPWORDS and len(token) > 1]
+
+
+def duration(files):
+    """Summed length of files in seconds, None if any of them cannot be read."""
+    if MP4 is None:
+        return None
+    total = 0.0
+    for file in files:
+        try:
+            total += MP4(file, store=ATOMS).info.length
+        except Exception as err:  # corrupt or not an mp4 file
+            debug("could not read length of %s: %s", file, err)
+            return None
+    return total
+
+
+class Catalog:
+    """
+    Local catalog of every book whose metadata was fetched,
+    used to find the product page of a folder without asking
+    anybody.
+
+    add(url, fields):       store the fields of a Fetch
+    match(name, duration):  best candidates for a folder name and
+                            the summed length of its parts
+    resolve(name, duration): the sidecar dict of the best match
+                            if it is good enough, else None
+    """
+
+    def __init__(self, path=CATALOG):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+        try:
+            self._db.executescript(FTS_SCHEMA)
+            self._fts = True
+        except sqlite3.OperationalError as err:
+            #sqlite built without fts5, fall back to scanning titles:
+            debug("no full text search: %s", err)
+            self._fts = False
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT count(*) FROM books").fetchone()[0]
+
+    def add(self, url, fields):
+        """Stores the fields of a Fetch (see lib.fetch.FIELDS), returns False without an ASIN."""
+        key = asin(url)
+        if key is None or not fields.get("title"):
+            return False
+        series_title, series_no = fields.get("series") or (None, None)
+        row = (key, url, fields.get("title"), fields.get("authors"),
+               fields.get("narrators"), series_title or None, series_no or None,
+               fields.get("runtime"), fields.get("date"), fields.get("description"),
+               fields.get("copyright"))
+        self.add_rows([row])
+        return True
+
+    def add_rows(self, rows):
+        """Stores tuples in COLUMNS order, None values keep what a known book already has."""
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO books ({}) VALUES ({}) "
+                "ON CONFLICT(asin) DO UPDATE SET {}".format(
+                    ", ".join(COLUMNS), ", ".join("?" * len(COLUMNS)),
+                    ", ".join("{0}=coalesce(excluded.{0}, {0})".format(column)
+                              for column in COLUMNS[1:])),
+                rows)
+
+    def harvested(self, url):
+        """True if the listing of a series was already loaded."""
+        return self._db.execute("SELECT 1 FROM series WHERE url = ?", (url,)).fetchone() is not None
+
+    def mark_harvested(self, url):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO series (url, harvested) VALUES (?, ?)",
+                             (url, time.time()))
+
+    def get(self, key):
+        """Returns the row of an ASIN or url, None if unknown."""
+        key = asin(key) or key
+        return self._db.execute("SELECT * FROM books WHERE asin = ?", (key,)).fetchone()
+
+    def _candidates(self, words, runtimes=None):
+        #books with a runtime outside of runtimes are left out before
+        #ranking, so bm25 only scores the ones that can still match:
+        where, args = "", []
+        if runtimes is not None:
+            where = " AND (books.runtime BETWEEN ? AND ? OR books.runtime IS NULL)"
+            args = list(runtimes)
+        if self._fts:
+            query = " OR ".join('"{}"'.format(word) for word in words)
+            return self._db.execute(
+                "SELECT books.* FROM books_fts JOIN books ON books.id = books_fts.rowid "
+                "WHERE books_fts MATCH ?{} ORDER BY bm25(books_fts) LIMIT ?".format(where),
+                [query] + args + [CANDIDATES]).fetchall()
+        return self._db.execute(
+            "SELECT * FROM books WHERE ({}){} LIMIT ?".format(
+                " OR ".join(["books.title LIKE ?"] * len(words)), where),
+            ["%{}%".format(word) for word in words] + args + [CANDIDATES]).fetchall()
+
+    def match(self, name, length=None, limit=5, floor=0.0):
+        """
+        Returns up to limit (score, row) pairs, best first.
+
+        The score is the share of the words of name found in the
+        title, authors, narrators or series of a book, times how
+        close its runtime is to length (in seconds) when known.
+        Books whose runtime alone keeps them below floor are not
+        looked at.
+        """
+        words = set(tokens(name))
+        if not words:
+            return []
+
+        runtimes = None
+        if length and floor > 0:
+            #abs(runtime - length) <= reach * (RUNTIME_SLACK + RUNTIME_SHARE * runtime):
+            reach = -math.log(floor)
+            runtimes = ((length - reach * RUNTIME_SLACK) / (1 + reach * RUNTIME_SHARE),
+                        (length + reach * RUNTIME_SLACK) / max(1 - reach * RUNTIME_SHARE, 1e-9))
+
+        with span("match", cat="catalog", folder=name) as match:
+            scored = []
+            for row in self._candidates(sorted(words), runtimes):
+                text = set(tokens(" ".join(row[column] or "" for column in
+                                           ("title", "authors", "narrators", "series_title"))))
+                score = len(words & text) / len(words)
+                if length and row["runtime"]:
+                    slack = RUNTIME_SLACK + RUNTIME_SHARE * row["runtime"]
+                    score *= math.exp(-abs(row["runtime"] - length) / slack)
+                scored.append((score, row))
+            scored.sort(key=lambda pair: pair[0], reverse=True)
+            match.set(candidates=len(scored))
+        return scored[:limit]
+
+    def resolve(self, name, length=None, threshold=0.6, margin=0.1):
+        """Returns the sidecar dict of the best match, None if it is not clearly the best."""
+        #a book below threshold - margin can neither match nor
+        #come close enough to the best match to make it ambiguous:
+        matches = self.match(name, length, limit=2, floor=threshold - margin)
+        if not matches or matches[0][0] < threshold:
+            return None
+        if len(matches) > 1 and matches[0][0] - matches[1][0] < margin:
+            debug("ambiguous match for %s: %s", name, [row["title"] for score, row in matches])
+            return None
+
+        row = matches[0][1]
+        debug("%s matched %s (%.2f)", name, row["url"], matches[0][0])
+        return to_data(row)
+
+
+def to_data(row):
+    """Converts a catalog row into a sidecar dict, see lib.sidecar.read."""
+    data = {"title": row["title"],
+            "authors": [name for name in (row["authors"] or "").split(", ") if name],
+            "narrators": [name for name in (row["narrators"] or "").split(", ") if name],
+            "url": row["url"]}
+    if row["series_title"]:
+        data["series_title"] = row["series_title"]
+        data["series_no"] = row["series_no"]
+    for key in ("runtime", "date", "description", "copyright"):
+        if row[key] is not None:
+            data[key] = row[key]
+    return data
+
+
+def load(path=CATALOG):
+    """Opens the catalog, None if it cannot be opened (read-only home etc.)."""
+    try:
+        return Catalog(path)
+    except (OSError, sqlite3.Error) as err:
+        logger.warning("catalog %s not available: %s", path, err)
+        return None
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import logging
+import concurrent.futures
+
+from PyQt5 import QtCore
+from PyQt5 import QtGui
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+warn = logger.warning
+
+#longest side of an embedded cover in pixels and its jpeg quality:
+MAX_SIZE = 800
+QUALITY = 85
+
+#normalized covers, named after the hash of the source and the settings:
+CACHE = os.path.join(os.path.expanduser("~"), ".abtag", "covers")
+
+
+class CoverError(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.msg = msg
+
+
+def key(data, size=MAX_SIZE, quality=QUALITY):
+    digest = hashlib.blake2b(data, digest_size=20)
+    digest.update("{}:{}".format(size, quality).encode("ascii"))
+    return digest.hexdigest()
+
+
+def _encode(data, size, quality):
+    """Returns the jpeg of image data scaled to fit size."""
+    image = QtGui.QImage()
+    if not image.loadFromData(data):
+        raise CoverError("not an image")
+
+    is_jpeg = data[:3] == b"\xff\xd8\xff"
+    if is_jpeg and max(image.width(), image.height()) <= size:
+        #recompressing would only lose quality:
+        return data
+
+    if max(image.width(), image.height()) > size:
+        image = image.scaled(size, size, QtCore.Qt.KeepAspectRatio,
+                             QtCore.Qt.SmoothTransformation)
+    #jpeg has no alpha channel:
+    image = image.convertToFormat(QtGui.QImage.Format_RGB888)
+
+    array = QtCore.QByteArray()
+    buffer = QtCore.QBuffer(array)
+    buffer.open(QtCore.QIODevice.WriteOnly)
+    if not image.save(buffer, "JPEG", quality):
+        raise CoverError("could not encode jpeg")
+    buffer.close()
+    return bytes(array)
+
+
+def normalize(path, size=MAX_SIZE, quality=QUALITY, cache=CACHE):
+    """
+    Returns the path of a jpeg of the image at path whose
+    longest side is at most size pixels.
+
+    The result is stored in cache under the hash of the
+    source and the settings, so every cover is decoded and
+    encoded once no matter how many parts or runs use it.
+    """
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(cache):
+        return path
+
+    try:
+        with open(path, mode='rb') as file:
+            data = file.read()
+    except OSError as err:
+        raise CoverError("cannot read {}: {}".format(path, err)) from None
+
+    target = os.path.join(cache, key(data, size, quality) + ".jpg")
+    if os.path.exists(target):
+        debug("cover %s cached as %s", path, target)
+        return target
+
+    jpeg = _encode(data, size, quality)
+    try:
+        os.makedirs(cache, exist_ok=True)
+        with open(target + ".tmp", mode='wb') as file:
+            file.write(jpeg)
+        os.replace(target + ".tmp", target)
+    except OSError as err:
+        raise CoverError("cannot write {}: {}".format(target, err)) from None
+
+    debug("cover %s: %s -> %s bytes", path, len(data), len(jpeg))
+    return target
+
+
+def normalize_or_keep(path, size=MAX_SIZE, quality=QUALITY, cache=CACHE):
+    """Like normalize, but returns path itself if it cannot be normalized."""
+    if path is None:
+        return None
+    try:
+        return normalize(path, size, quality, cache)
+    except CoverError as err:
+        warn("using cover %s as is: %s", path, err.msg)
+        return path
+
+
+def normalize_all(paths, size=MAX_SIZE, quality=QUALITY, cache=CACHE, workers=None):
+    """
+    Normalizes the covers of many books in a process pool.
+
+    Returns a dict that maps every path to its normalized
+    cover, or to itself if it could not be normalized.
+    """
+    paths = sorted(set(path for path in paths if path is not None))
+    if len(paths) < 2:
+        return {path: normalize_or_keep(path, size, quality, cache) for path in paths}
+
+    covers = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {pool.submit(normalize_or_keep, path, size, quality, cache): path
+                for path in paths}
+        for job in concurrent.futures.as_completed(jobs):
+            covers[jobs[job]] = job.result()
+    return covers
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import struct
+import logging
+
+try:
+    from mutagenx.mp4 import Atom, Atoms, AtomIndex, SampleTable, MP4MetadataError, MP4StreamInfoError
+except ImportError:
+    raise ImportError("Unable to import mutagenx") from None
+
+from lib.embedded import ATOMS
+from lib.trace import span
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+
+#atoms of stbl that are copied as they are, the sample tables
+#are rebuilt for the range and the rest (ctts, sgpd, sbgp, ...)
+#is left out:
+STBL_COPIED = (b"stsd", )
+
+#default range of listening_samples, in seconds:
+SAMPLE_START = 300.0
+SAMPLE_LENGTH = 60.0
+
+
+class CutError(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.msg = msg
+
+
+def _raw(buf, atom):
+    return buf[atom.offset:atom.offset + atom.length]
+
+
+def _full(name, version_flags, data):
+    return Atom.render(name, struct.pack(">I", version_flags) + data)
+
+
+def _set_duration(raw, duration, v0, v1):
+    """raw with its duration replaced, at offset v0 (32 bit) or v1 (64 bit) depending on the version."""
+    raw = bytearray(raw)
+    if raw[8] == 0:
+        struct.pack_into(">I", raw, v0, min(duration, 0xFFFFFFFF))
+    else:
+        struct.pack_into(">Q", raw, v1, duration)
+    return bytes(raw)
+
+
+def _uint(raw, v0, v1):
+    """The 32 bit field at offset v0 or v1 depending on the version of raw."""
+    return struct.unpack_from(">I", raw, v0 if raw[8] == 0 else v1)[0]
+
+
+def _copy_ways():
+    """The kernel copies the platform has, the first is tried first."""
+    return [way for way in ("copy_file_range", "sendfile") if hasattr(os, way)]
+
+
+def _copy_range(src, dst, offset, length, ways=None):
+    """Copies length bytes at offset of the file descriptor src to the position of dst,
+    in the kernel if the platform allows it.
+
+    A way that fails (different file systems, no sendfile to files, ...)
+    is dropped from ways, pass the same list for every range of a pair
+    of files so it is not tried again; copying through Python is last."""
+    if ways is None:
+        ways = _copy_ways()
+    while length > 0:
+        way = ways[0] if ways else None
+        try:
+            if way == "copy_file_range":
+                copied = os.copy_file_range(src, dst, length, offset)
+            elif way == "sendfile":
+                copied = os.sendfile(dst, src, offset, length)
+            else:
+                copied = os.write(dst, os.pread(src, min(length, 2**20), offset))
+        except OSError:
+            if way is None:
+                raise
+            debug("%s failed, falling back", way)
+            ways.pop(0)
+            continue
+        if not copied:
+            raise CutError("source ends before offset {}".format(offset))
+        offset += copied
+        length -= copied
+
+
+class Cut:
+    """
+    The part of an MP4 file between two times, cut at sample
+    boundaries without decoding.
+
+    The output has the ftyp of the source, a moov with only its
+    audio track, the sample tables cut down to the range and the
+    tags of the source (chapters are left out, their times no
+    longer fit) and one mdat with the audio of the range, which
+    is copied chunk by chunk without passing through Python.
+
+    The range starts with the sample playing at start and ends
+    with the sample playing just before end (the end of the
+    source if None), so it never loses audio but may be up to a
+    sample (about 23 ms of AAC) longer.
+    """
+
+    def __init__(self, in_file, start=0.0, end=None, store=ATOMS):
+        self.in_file = in_file
+        with open(in_file, mode='rb') as src:
+            try:
+                atoms = AtomIndex.for_file(in_file, store=store).atoms([b"moov", b"moof"])
+                self.table = SampleTable(atoms, src)
+                moov = atoms[b"moov"]
+                ftyp = atoms[b"ftyp"]
+            except (MP4MetadataError, MP4StreamInfoError, KeyError, struct.error) as err:
+                raise CutError("cannot read atoms of {}: {}".format(in_file, err)) from None
+            src.seek(ftyp.offset)
+            self.ftyp = src.read(ftyp.length)
+            src.seek(moov.offset)
+            self.moov = src.read(moov.length)
+
+        table = self.table
+        if not len(table):
+            raise CutError("{} has no samples".format(in_file))
+        if start >= table.duration:
+            raise CutError("{} ends before {} s".format(in_file, start))
+        if end is None:
+            end = table.duration
+        if end <= start:
+            raise CutError("nothing to cut between {} and {} s".format(start, end))
+        last = table.sample_at(end)
+        stop = last + (table.time_of(last) < end)
+        if stop <= table.sample_at(start):
+            raise CutError("nothing to cut between {} and {} s".format(start, end))
+        self.select(table.sample_at(start), stop)
+
+    def select(self, start, stop):
+        """Cuts the samples start to stop - 1 instead, so one source can be cut many times."""
+        table = self.table
+        self.start = start
+        self.stop = stop
+        self.extents = list(table.extents(start, stop))
+        self.length = table.span(start, stop)
+        #in time scale units:
+        self.duration = sum(count * delta for count, delta in table.runs(start, stop))
+        debug("cut of %s: samples %s to %s, %s bytes", self.in_file, start, stop, self.length)
+
+    def write(self, out_file, meta=None, udta=()):
+        """
+        Writes the cut to out_file, returns its size.
+
+        meta replaces the meta atom (the tags) of the source,
+        the atoms in udta (say a chpl) are added to its udta.
+        """
+        large = self.length + 16 > 0xFFFFFFFF
+        mdat_header = struct.pack(">I4sQ", 1, b"mdat", self.length + 16) if large else \
+            struct.pack(">I4s", self.length + 8, b"mdat")
+        #the offsets of the chunks depend on the size of the moov,
+        #which only depends on whether they need 64 bits:
+        co64 = large
+        moov = self._moov(0, co64, meta, udta)
+        data_offset = len(self.ftyp) + len(moov) + len(mdat_header)
+        if not co64 and data_offset + self.length > 0xFFFFFFFF:
+            co64 = True
+            data_offset += 4 * len(self.extents)
+        moov = self._moov(data_offset, co64, meta, udta)
+
+        with span("cut", cat="mux", bytes=self.length):
+            try:
+                with open(self.in_file, mode='rb') as src, open(out_file, mode='wb') as dst:
+                    dst.write(self.ftyp + moov + mdat_header)
+                    dst.flush()
+                    offset, length = self.extents[0][2], 0
+                    ways = _copy_ways()
+                    #neighbouring chunks are copied in one go:
+                    for first, count, chunk_offset, chunk_length in self.extents:
+                        if chunk_offset != offset + length:
+                            _copy_range(src.fileno(), dst.fileno(), offset, length, ways)
+                            offset, length = chunk_offset, 0
+                        length += chunk_length
+                    _copy_range(src.fileno(), dst.fileno(), offset, length, ways)
+                    dst.seek(0, 2)
+                    size = dst.tell()
+            except BaseException:
+                _remove(out_file)
+                raise
+
+        debug("wrote %s bytes to %s", size, out_file)
+        return size
+
+    def _moov(self, data_offset, co64, meta, udta):
+        buf = self.moov
+        root = Atoms(io.BytesIO(buf))[b"moov"]
+        mvhd = root[b"mvhd", ]
+        movie_scale = _uint(_raw(buf, mvhd), 20, 28)
+        media_scale = self.table.timescale
+        movie_duration = self.duration * movie_scale // media_scale
+
+        children = []
+        has_udta = False
+        for child in root.children:
+            raw = _raw(buf, child)
+            if child.name == b"mvhd":
+                raw = _set_duration(raw, movie_duration, 24, 32)
+            elif child.name == b"trak":
+                if _uint(_raw(buf, child[b"tkhd", ]), 20, 28) != self.table.track_id:
+                    continue
+                raw = self._trak(buf, child, movie_duration, data_offset, co64)
+            elif child.name == b"mvex":
+                #the output is not fragmented
+                continue
+            elif child.name == b"udta":
+                has_udta = True
+                raw = self._udta(buf, child, meta, udta)
+            children.append(raw)
+        if not has_udta and (meta is not None or udta):
+            children.append(Atom.render(b"udta", (meta or b"") + b"".join(udta)))
+        return Atom.render(b"moov", b"".join(children))
+
+    def _udta(self, buf, atom, meta, extra):
+        children = []
+        for child in atom.children:
+            if child.name == b"chpl":
+                continue
+            if child.name == b"meta" and meta is not None:
+                continue
+            children.append(_raw(buf, child))
+        if meta is not None:
+            children.append(meta)
+        children.extend(extra)
+        return Atom.render(b"udta", b"".join(children))
+
+    def _trak(self, buf, trak, movie_duration, data_offset, co64):
+        children = []
+        for child in trak.children:
+            raw = _raw(buf, child)
+            if child.name == b"tkhd":
+                raw = _set_duration(raw, movie_duration, 28, 36)
+            elif child.name in (b"edts", b"tref"):
+                #edit lists and chapter references are about the whole source
+                continue
+            elif child.name == b"mdia":
+                raw = self._mdia(buf, child, data_offset, co64)
+            children.append(raw)
+        return Atom.render(b"trak", b"".join(children))
+
+    def _mdia(self, buf, mdia, data_offset, co64):
+        children = []
+        for child in mdia.children:
+            raw = _raw(buf, child)
+            if child.name == b"mdhd":
+                raw = _set_duration(raw, self.duration, 24, 32)
+            elif child.name == b"minf":
+                raw = Atom.render(b"minf", b"".join(
+                    self._stbl(buf, atom, data_offset, co64) if atom.name == b"stbl" else _raw(buf, atom)
+                    for atom in child.children))
+            children.append(raw)
+        return Atom.render(b"mdia", b"".join(children))
+
+    def _stbl(self, buf, stbl, data_offset, co64):
+        table = self.table
+        children = [_raw(buf, child) for child in stbl.children if child.name in STBL_COPIED]
+
+        runs = list(table.runs(self.start, self.stop))
+        children.append(_full(b"stts", 0, struct.pack(">I", len(runs)) +
+                              b"".join(struct.pack(">2I", count, delta) for count, delta in runs)))
+
+        #runs of chunks with the same number of samples:
+        entries = []
+        for number, (first, count, offset, length) in enumerate(self.extents, 1):
+            if not entries or entries[-1][1] != count:
+                entries.append((number, count))
+        children.append(_full(b"stsc", 0, struct.pack(">I", len(entries)) +
+                              b"".join(struct.pack(">3I", number, count, 1) for number, count in entries)))
+
+        sizes = table.sizes(self.start, self.stop)
+        if sizes and sizes.count(sizes[0]) == len(sizes):
+            children.append(_full(b"stsz", 0, struct.pack(">2I", sizes[0], len(sizes))))
+        else:
+            if sys.byteorder == "little":
+                sizes.byteswap()
+            children.append(_full(b"stsz", 0, struct.pack(">2I", 0, len(sizes)) + sizes.tobytes()))
+
+        offsets = []
+        for first, count, offset, length in self.extents:
+            offsets.append(data_offset)
+            data_offset += length
+        fmt = ">{}Q" if co64 else ">{}I"
+        children.append(_full(b"co64" if co64 else b"stco", 0, struct.pack(">I", len(offsets)) +
+                              struct.pack(fmt.format(len(offsets)), *offsets)))
+
+        try:
+            stss = _raw(buf, stbl[b"stss", ])
+        except KeyError:
+            pass
+        else:
+            count = struct.unpack_from(">I", stss, 12)[0]
+            syncs = [number - self.start for number in struct.unpack_from(">{}I".format(count), stss, 16)
+                     if self.start < number <= self.stop]
+            children.append(_full(b"stss", 0, struct.pack(">I", len(syncs)) +
+                                  struct.pack(">{}I".format(len(syncs)), *syncs)))
+        return Atom.render(b"stbl", b"".join(children))
+
+
+def extract(in_file, out_file, start, end, meta=None, udta=(), store=ATOMS):
+    """
+    Writes the audio of in_file between start and end seconds
+    to out_file, see Cut. Returns the size of out_file.
+    """
+    return Cut(in_file, start, end, store).write(out_file, meta, udta)
+
+
+def listening_samples(paths, folder, start=SAMPLE_START, length=SAMPLE_LENGTH):
+    """
+    Cuts length seconds from start (or from the beginning
+    of shorter files) of every file in paths into folder,
+    keeping the file names.
+
+    Yields (path, out_file, error message or None) per file,
+    one failing file does not stop the rest.
+    """
+    for path in paths:
+        out_file = os.path.join(folder, os.path.basename(path))
+        try:
+            try:
+                cut = Cut(path, start, start + length)
+            except CutError:
+                cut = Cut(path, 0.0, length)
+            cut.write(out_file)
+        except (OSError, CutError) as err:
+            yield path, out_file, str(err)
+            continue
+        yield path, out_file, None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
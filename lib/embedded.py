@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import logging
+
+try:
+    from mutagenx.mp4 import AtomIndex, MP4Tags, MP4MetadataError
+except ImportError:
+    raise ImportError("Unable to import mutagenx") from None
+
+from lib.trace import span
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+
+#atom layouts of files already read, so scanning a folder again
+#does not walk every file again:
+ATOMS = os.path.join(os.path.expanduser("~"), ".abtag", "atoms")
+
+#fields that have to be present to tag without looking anything up:
+REQUIRED = ("title", "authors", "narrators", "description", "copyright")
+
+#the formats written by ProcessingPage, see Config.title_full:
+TITLE_RE = re.compile(r"^Book (\d+): (.+?)(?:, Part \d+)?$")
+ARTIST_RE = re.compile(r"^(.+) \(read by (.+)\)$")
+
+
+def _first(tags, key):
+    try:
+        value = tags[key][0]
+    except (KeyError, IndexError):
+        return ""
+    return str(value).strip()
+
+
+def _names(value):
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def tags(path, store=ATOMS):
+    """Returns the MP4Tags of a file or None if it has none."""
+    atoms = AtomIndex.for_file(path, store=store).atoms([b"moov"])
+    with open(path, mode='rb') as file:
+        try:
+            return MP4Tags(atoms, file)
+        except MP4MetadataError:
+            return None
+
+
+def read(path):
+    """
+    Reads the iTunes tags of an audio file into a dict with
+    the same keys as lib.sidecar.read, anything not tagged is
+    left out.
+
+    Files tagged by ABTag are recognized and split back up:
+    the series number from the title, the narrators from the
+    artist.
+    """
+    with span("embedded", cat="metadata", file=path):
+        ilst = tags(path)
+    if ilst is None:
+        debug("%s has no tags", path)
+        return {}
+
+    data = {}
+    title = _first(ilst, b"\xa9nam")
+    album = _first(ilst, b"\xa9alb")
+    artist = _first(ilst, b"\xa9ART")
+    album_artist = _first(ilst, b"aART")
+    narrators = _first(ilst, b"\xa9nrt")
+
+    match = TITLE_RE.match(title)
+    if match:
+        data["series_no"] = int(match.group(1))
+        data["title"] = match.group(2)
+        if album and album != data["title"]:
+            data["series_title"] = album
+    elif album or title:
+        #in ripped parts the album holds the book title:
+        data["title"] = album or title
+
+    match = ARTIST_RE.match(artist)
+    if match:
+        artist, narrators = match.group(1), narrators or match.group(2)
+    authors = album_artist or artist
+    if authors:
+        data["authors"] = _names(authors)
+    if narrators:
+        data["narrators"] = _names(narrators)
+
+    disk = ilst.get(b"disk")
+    if disk and "series_no" not in data and "series_title" in data:
+        data["series_no"] = disk[0][0]
+
+    description = _first(ilst, b"ldes") or _first(ilst, b"desc")
+    if description:
+        data["description"] = description
+    for key, atom in (("copyright", b"cprt"), ("date", b"\xa9day")):
+        value = _first(ilst, atom)
+        if value:
+            data[key] = value
+
+    debug("embedded tags of %s: %s", path, data)
+    return data
+
+
+def complete(data):
+    """True if data has everything needed to tag without a lookup."""
+    return all(data.get(key) for key in REQUIRED)
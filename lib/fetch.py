@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from PyQt5 import QtCore
+
+from lib.abparse import Metadata, HTTPException, URLException, BS4Exception, RegExException
+from lib.trace import span
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+warn = logger.warning
+
+#fields in the order they are extracted and emitted:
+FIELDS = ("title", "authors", "narrators", "series", "date", "description", "copyright", "runtime",
+          "series_url")
+
+
+def _series(metadata):
+    series = metadata.series()
+    if series is None:
+        return ("", "")
+    return series
+
+
+EXTRACTORS = {"title": lambda metadata: metadata.title,
+              "authors": lambda metadata: metadata.authors,
+              "narrators": lambda metadata: metadata.narrators,
+              "series": _series,
+              "date": lambda metadata: metadata.date_utc,
+              "description": lambda metadata: metadata.description,
+              "copyright": lambda metadata: metadata.copyright,
+              "runtime": lambda metadata: metadata.runtime_sec,
+              "series_url": lambda metadata: metadata.series_url}
+
+
+def extract(metadata):
+    """Yields (name, value) for every field of a parsed Metadata, None if it is missing."""
+    for name in FIELDS:
+        try:
+            value = EXTRACTORS[name](metadata)
+        except (AttributeError, ValueError, IndexError, RegExException) as err:
+            warn("could not extract %s: %s", name, err)
+            value = None
+        yield name, value
+
+
+def fetch(url, path=None):
+    """Downloads and extracts all fields of url without a thread, for batch runs."""
+    metadata = Metadata()
+    metadata.http_page(url, path)
+    with span("extract", cat="metadata", url=url):
+        return dict(extract(metadata))
+
+
+class Fetcher(QtCore.QThread):
+    """
+    Downloads, parses and extracts the metadata of one url.
+
+    Every signal carries the generation the fetch was started
+    with, so the receiver can tell stale results apart.
+    """
+    field = QtCore.pyqtSignal(int, str, object)
+    error = QtCore.pyqtSignal(int, str)
+    done = QtCore.pyqtSignal(int)
+
+    def __init__(self, url, generation, path=None, parent=None):
+        super().__init__(parent)
+        debug("initialized Fetcher for %s", url)
+
+        self._url = url
+        self._generation = generation
+        self._path = path
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def run(self):
+        metadata = Metadata()
+        try:
+            #a cancelled fetch stops downloading, not just emitting:
+            metadata.http_page(self._url, self._path, self.isInterruptionRequested)
+        except (HTTPException, URLException, BS4Exception) as err:
+            self.error.emit(self._generation, err.msg)
+            return
+
+        with span("extract", cat="metadata", url=self._url):
+            for name, value in extract(metadata):
+                #the url changed in the meantime, nobody wants the rest:
+                if self.isInterruptionRequested():
+                    debug("fetch of %s cancelled", self._url)
+                    return
+                self.field.emit(self._generation, name, value)
+
+        self.done.emit(self._generation)
+
+
+class Fetch(QtCore.QObject):
+    """
+    Runs one Fetcher at a time on behalf of the gui.
+
+    fetch(url) cancels whatever is running and starts over,
+    only signals of the latest fetch are passed on. Asking
+    again for the url that is already being fetched does not
+    start over, the fields known so far are replayed and the
+    rest follows as usual, so a fetch started early (see
+    prefetch) is picked up where it is.
+    """
+    field = QtCore.pyqtSignal(str, object)
+    error = QtCore.pyqtSignal(str)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self._generation = 0
+        self._url = None
+        self._fields = {}
+        self._error = None
+        self._done = False
+        #threads are kept alive until they actually stop:
+        self._threads = set()
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def fields(self):
+        return dict(self._fields)
+
+    @property
+    def running(self):
+        return any(thread.generation == self._generation for thread in self._threads)
+
+    def prefetch(self, url, path=None):
+        """Start fetching a url nobody asked for yet, if it looks valid."""
+        if url is None or not Metadata.is_url_valid(url):
+            return
+        if url != self._url:
+            debug("prefetching %s", url)
+            self.fetch(url, path)
+
+    def fetch(self, url, path=None, force=False):
+        #a failed fetch is always retried:
+        if url == self._url and self._error is None and not force:
+            debug("reusing fetch of %s", url)
+            self._replay()
+            return
+
+        self.cancel()
+        self._url = url
+
+        thread = Fetcher(url, self._generation, path)
+        thread.field.connect(self._receive_field)
+        thread.error.connect(self._receive_error)
+        thread.done.connect(self._receive_done)
+        thread.finished.connect(self._thread_finished)
+        self._threads.add(thread)
+        thread.start()
+
+    def cancel(self):
+        self._generation += 1
+        self._url = None
+        self._fields = {}
+        self._error = None
+        self._done = False
+        for thread in self._threads:
+            thread.requestInterruption()
+
+    def _replay(self):
+        for name in FIELDS:
+            if name in self._fields:
+                self.field.emit(name, self._fields[name])
+        if self._error is not None:
+            self.error.emit(self._error)
+        if self._done:
+            self.finished.emit()
+
+    @QtCore.pyqtSlot(int, str, object)
+    def _receive_field(self, generation, name, value):
+        if generation == self._generation:
+            self._fields[name] = value
+            self.field.emit(name, value)
+
+    @QtCore.pyqtSlot(int, str)
+    def _receive_error(self, generation, msg):
+        if generation == self._generation:
+            self._error = msg
+            self.error.emit(msg)
+        else:
+            debug("dropped stale error: %s", msg)
+
+    @QtCore.pyqtSlot(int)
+    def _receive_done(self, generation):
+        if generation == self._generation:
+            self._done = True
+            self.finished.emit()
+
+    @QtCore.pyqtSlot()
+    def _thread_finished(self):
+        thread = self.sender()
+        self._threads.discard(thread)
+        thread.deleteLater()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import logging
+import collections
+
+#level for messages logged from hot loops (one per line of
+#subprocess output etc.), below DEBUG so they cost one cached
+#level check unless explicitly asked for:
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+LEVELS = {"trace": TRACE,
+          "debug": logging.DEBUG,
+          "info": logging.INFO,
+          "warning": logging.WARNING,
+          "error": logging.ERROR}
+
+FORMAT = "%(lineno)d: %(funcName)s, %(module)s.py, %(levelname)s: %(message)s"
+SHORT_FORMAT = "%(levelname)s: %(message)s"
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    Keeps the last capacity records in memory and writes them
+    out only when a record of flush_level or above comes in,
+    so the context leading to an error is never lost while
+    normal runs stay quiet.
+
+    Records at or above console_level were already printed
+    and are not repeated in the dump.
+    """
+
+    def __init__(self, capacity=2000, flush_level=logging.ERROR,
+                 console_level=logging.WARNING, stream=None):
+        super().__init__()
+        self._buffer = collections.deque(maxlen=capacity)
+        self.flush_level = flush_level
+        self.console_level = console_level
+        self.stream = stream if stream is not None else sys.stderr
+
+    def emit(self, record):
+        self._buffer.append(record)
+        if record.levelno >= self.flush_level:
+            self.dump()
+
+    def dump(self):
+        self.acquire()
+        try:
+            records = [record for record in self._buffer
+                       if record.levelno < self.console_level]
+            self._buffer.clear()
+            if not records:
+                return
+            self.stream.write("---- last {} log records ----\n".format(len(records)))
+            for record in records:
+                self.stream.write(self.format(record) + "\n")
+            self.stream.write("----\n")
+            self.stream.flush()
+        finally:
+            self.release()
+
+
+_handlers = []
+
+
+def setup(level=logging.WARNING, ring_size=2000, ring_level=logging.DEBUG, stream=None):
+    """
+    Configure logging for the whole application.
+
+    level:      level printed to the console
+    ring_size:  number of records kept in memory and dumped
+                on error, 0 disables the buffer
+    ring_level: lowest level kept in the buffer, which is only
+                set up if that is below level; every call at this
+                level then builds a record, which is why messages
+                from hot loops go to TRACE
+    """
+    root = logging.getLogger()
+    for handler in _handlers:
+        root.removeHandler(handler)
+    _handlers.clear()
+
+    if level <= logging.DEBUG:
+        fmt = logging.Formatter(FORMAT)
+    else:
+        fmt = logging.Formatter(SHORT_FORMAT)
+
+    console = logging.StreamHandler(stream)
+    console.setLevel(level)
+    console.setFormatter(fmt)
+    _handlers.append(console)
+
+    lowest = level
+    if ring_size > 0 and ring_level < level:
+        ring = RingBufferHandler(ring_size, console_level=level, stream=console.stream)
+        ring.setLevel(ring_level)
+        ring.setFormatter(logging.Formatter(FORMAT))
+        #the context goes out before the error itself:
+        _handlers.insert(0, ring)
+        lowest = ring_level
+
+    for handler in _handlers:
+        root.addHandler(handler)
+    root.setLevel(lowest)
+
+
+def dump():
+    """Write out the ring buffer, e.g. from an exception handler."""
+    for handler in _handlers:
+        if isinstance(handler, RingBufferHandler):
+            handler.dump()
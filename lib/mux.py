@@ -9,20 +9,10 @@ import subprocess
 from PyQt5 import QtCore
 
 from lib.tree import Tools
+from lib.trace import span, file_size
+from lib.log import TRACE
 
-DEBUG = True
-
-#logging is enabled only for debugging
 logger = logging.getLogger(__name__)
-if DEBUG:
-    logger.setLevel(logging.DEBUG)
-    log_format = "%(lineno)d: %(funcName)s, %(module)s.py, %(levelname)s: %(message)s"
-    fmt = logging.Formatter(log_format)
-    stream = logging.StreamHandler()
-    stream.setFormatter(fmt)
-else:
-    stream = logging.NullHandler()
-logger.addHandler(stream)
 debug = logger.debug
 
 
@@ -73,6 +63,8 @@ class Demux(QtCore.QThread):
         self._bin_path = bin_path
         self._cmd = []
         self._job_cache = []
+        self._file = ""
+        self._aac_file = ""
 
     def _emit_job(self, job):
         #check if the job has already been emitted:
@@ -85,6 +77,8 @@ class Demux(QtCore.QThread):
 
     def demux(self, file, aac_file):
         self._cmd = [self._bin_path, "-raw", "1", file, "-out", aac_file]
+        self._file = file
+        self._aac_file = aac_file
 
         Muxer.delete(aac_file)
 
@@ -99,11 +93,17 @@ class Demux(QtCore.QThread):
             self.error.emit(err)
 
     def run(self):
+        with span("demux", cat="mux", file=self._file, bytes=file_size(self._file)) as demux:
+            self._run()
+            demux.set(out_bytes=file_size(self._aac_file))
+
+    def _run(self):
         debug("running cmd: %s", self._cmd)
 
         for line in self._subproc():
             if line:
-                debug("demux current line: %s", line)
+                if logger.isEnabledFor(TRACE):
+                    logger.log(TRACE, "demux current line: %s", line)
 
                 self._emit_job("Media Export")
 
@@ -132,12 +132,15 @@ class Remux(QtCore.QThread):
 
         self._job_cache = []
         self._bin_path = bin_path
+        self._aac_file = ""
         self._m4b_file = ""
         self._cmd = []
 
     def remux(self, aac_file, m4b_file, part_no):
         self._cmd = [self._bin_path, "-brand", "M4B ", "-ab", "mp71", "-ipod", "-add",
                      "{}:name=Part {}:lang=eng".format(aac_file, part_no), m4b_file]
+        self._aac_file = aac_file
+        self._m4b_file = m4b_file
 
         Muxer.delete(m4b_file)
 
@@ -161,11 +164,17 @@ class Remux(QtCore.QThread):
             self.error.emit(err)
 
     def run(self):
+        with span("remux", cat="mux", file=self._aac_file, bytes=file_size(self._aac_file)) as remux:
+            self._run()
+            remux.set(out_bytes=file_size(self._m4b_file))
+
+    def _run(self):
         debug("running cmd: %s", self._cmd)
 
         for line in self._subproc():
             if line:
-                debug("remux current line: %s", line)
+                if logger.isEnabledFor(TRACE):
+                    logger.log(TRACE, "remux current line: %s", line)
 
                 #first operation:
                 if "Importing AAC" in line:
@@ -377,7 +386,8 @@ class Muxer(QtCore.QObject):
         #perform the final cleanups and emit the main
         #finished signal for this module:
         self.message.emit("Created file: {}".format(self._m4b_file))
-        self.delete(self._aac_file)
+        with span("cleanup", cat="mux", bytes=file_size(self._aac_file)):
+            self.delete(self._aac_file)
 
         self.message.emit("Done!")
         self.finished.emit()
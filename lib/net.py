@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import zlib
+import gzip
+import socket
+import hashlib
+import logging
+import threading
+import http.client
+import urllib.parse
+
+from lib.trace import span
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+
+#seconds to wait for the server before giving up:
+TIMEOUT = 15
+#attempts after the first one and the delay before the first retry,
+#doubled for every further one:
+RETRIES = 3
+BACKOFF = 0.5
+#idle connections kept per host:
+POOL_SIZE = 2
+MAX_REDIRECTS = 5
+#statuses that are worth asking again for:
+RETRY_STATUS = {429, 500, 502, 503, 504}
+#bytes read between two checks whether a request was cancelled,
+#and seconds slept between two checks during a backoff:
+READ_SIZE = 2**16
+CANCEL_POLL = 0.1
+
+#pages are revalidated against these copies, shared by all runs of the user:
+CACHE = os.path.join(os.path.expanduser("~"), ".abtag", "http")
+
+USER_AGENT = "ABTag"
+
+
+class StatusError(Exception):
+    def __init__(self, msg, status):
+        super().__init__(msg)
+        self.msg = msg
+        self.status = status
+
+
+class RequestError(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.msg = msg
+
+
+class Cancelled(RequestError):
+    pass
+
+
+def decode(body, encoding):
+    """Undoes the Content-Encoding of a response body."""
+    encoding = (encoding or "identity").strip().lower()
+    if encoding in ("gzip", "x-gzip"):
+        return gzip.decompress(body)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            #some servers send raw deflate without the zlib header:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    if encoding != "identity":
+        raise RequestError("unsupported content encoding: {}".format(encoding))
+    return body
+
+
+class Cache:
+    """
+    Copies of downloaded pages with the validators the server
+    sent (ETag, Last-Modified), stored as a body and a json file
+    named after the hash of the url.
+    """
+
+    def __init__(self, path=CACHE):
+        self.path = path
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.path, key[:2], key)
+        return base + ".json", base + ".body"
+
+    def get(self, url):
+        """Returns (validators, body) of url or None."""
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            with open(body_path, "rb") as file:
+                body = file.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url:
+            return None
+        return meta, body
+
+    def put(self, url, validators, body):
+        meta_path, body_path = self._paths(url)
+        meta = dict(validators, url=url, stored=time.time())
+        try:
+            os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+            #the body goes first, a meta file always has its body:
+            for path, mode, data in ((body_path, "wb", body),
+                                     (meta_path, "w", json.dumps(meta))):
+                with open(path + ".tmp", mode) as file:
+                    file.write(data)
+                os.replace(path + ".tmp", path)
+        except OSError as err:
+            logger.warning("could not cache %s: %s", url, err)
+        return
+
+
+class Response:
+    """
+    A finished request.
+
+    url:        the url after redirects
+    status:     the status of the last response, 304 if the
+                body came from the cache
+    body:       the decoded body
+    cached:     True if the server confirmed the cached copy
+    """
+
+    def __init__(self, url, status, headers, body, cached=False):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.cached = cached
+
+
+class Client:
+    """
+    Downloads pages over persistent connections.
+
+    Idle connections are kept per host (POOL_SIZE) and reused by
+    the next request, so a lookup that needs several pages pays
+    the TCP and TLS setup once. Bodies are requested compressed
+    and revalidated with If-None-Match/If-Modified-Since against
+    the cache, a 304 answer costs a few hundred bytes. Failed
+    connections and RETRY_STATUS answers are retried with an
+    exponential backoff. A request given a cancelled callable
+    checks it between blocks of the body and during backoffs
+    and raises Cancelled once it returns True.
+
+    Safe to share between threads, a connection is only used by
+    one request at a time.
+    """
+
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF,
+                 pool_size=POOL_SIZE, cache=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.cache = cache
+        self._pool = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, {}
+        for connections in pool.values():
+            for connection in connections:
+                connection.close()
+        return
+
+    def _connect(self, key):
+        with self._lock:
+            idle = self._pool.get(key)
+            if idle:
+                return idle.pop(), True
+
+        scheme, host, port = key
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        return connection, False
+
+    def _release(self, key, connection):
+        with self._lock:
+            idle = self._pool.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+        return
+
+    def _request(self, url, headers, cancelled=None):
+        """One request on a pooled connection, returns (status, headers, raw body)."""
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise RequestError("not a http url: {}".format(url))
+        key = (parts.scheme, parts.hostname, parts.port)
+        target = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+
+        headers = dict(headers, Host=parts.netloc)
+        connection, reused = self._connect(key)
+        try:
+            connection.request("GET", target, headers=headers)
+            response = connection.getresponse()
+            body = _read(response, cancelled)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            connection.close()
+            if not reused:
+                raise
+            #the server closed an idle connection, this is not a failure:
+            debug("pooled connection to %s was closed, reconnecting", parts.hostname)
+            return self._request(url, headers, cancelled)
+        except BaseException:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+        return response.status, response.headers, body
+
+    def get(self, url, cancelled=None):
+        """Returns the Response of url, raises StatusError or RequestError
+        (Cancelled if cancelled returned True on the way)."""
+        cached = self.cache.get(url) if self.cache is not None else None
+        headers = {"Accept-Encoding": "gzip, deflate",
+                   "Connection": "keep-alive",
+                   "User-Agent": USER_AGENT}
+        if cached is not None:
+            validators, body = cached
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        with span("http", cat="metadata", url=url) as request:
+            location = url
+            for redirect in range(MAX_REDIRECTS + 1):
+                status, response_headers, raw = self._retry(location, headers, cancelled)
+                if status in (301, 302, 303, 307, 308) and response_headers.get("Location"):
+                    location = urllib.parse.urljoin(location, response_headers["Location"])
+                    debug("redirected to %s", location)
+                    continue
+                break
+            else:
+                raise RequestError("too many redirects for {}".format(url))
+            request.set(status=status, bytes=len(raw))
+
+        if status == 304 and cached is not None:
+            debug("%s not modified", url)
+            return Response(location, status, response_headers, cached[1], cached=True)
+        if status >= 400:
+            raise StatusError("the server couldn't fulfill the request, "
+                              "reason: {}".format(status), status)
+
+        try:
+            body = decode(raw, response_headers.get("Content-Encoding"))
+        except (OSError, EOFError, zlib.error) as err:
+            raise RequestError("could not decode response: {}".format(err)) from None
+
+        validators = {"etag": response_headers.get("ETag"),
+                      "last_modified": response_headers.get("Last-Modified")}
+        if self.cache is not None and status == 200 and any(validators.values()):
+            self.cache.put(url, validators, body)
+        return Response(location, status, response_headers, body)
+
+    def _retry(self, url, headers, cancelled=None):
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                status, response_headers, body = self._request(url, headers, cancelled)
+            except socket.timeout:
+                if last:
+                    raise RequestError("server did not answer within {} seconds"
+                                       .format(self.timeout)) from None
+                reason = "timeout"
+            except (OSError, http.client.HTTPException) as err:
+                if last:
+                    raise RequestError("failed to reach server, reason: {}".format(err)) from None
+                reason = err
+            else:
+                if status not in RETRY_STATUS or last:
+                    return status, response_headers, body
+                reason = status
+                #the server may say how long to wait, longer than a
+                #request may take is as good as a refusal:
+                retry_after = response_headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    if int(retry_after) > self.timeout:
+                        debug("not retrying %s, asked to wait %ss", url, retry_after)
+                        return status, response_headers, body
+                    delay = max(delay, int(retry_after))
+
+            debug("retrying %s in %.1fs (%s)", url, delay, reason)
+            _sleep(delay, cancelled)
+            delay *= 2
+        return
+
+
+def _read(response, cancelled):
+    """The body of response, read in blocks if it can be cancelled."""
+    if cancelled is None:
+        return response.read()
+    blocks = []
+    while True:
+        if cancelled():
+            raise Cancelled("request cancelled")
+        block = response.read(READ_SIZE)
+        if not block:
+            return b"".join(blocks)
+        blocks.append(block)
+
+
+def _sleep(delay, cancelled):
+    if cancelled is None:
+        time.sleep(delay)
+        return
+    end = time.monotonic() + delay
+    while True:
+        if cancelled():
+            raise Cancelled("request cancelled")
+        left = end - time.monotonic()
+        if left <= 0:
+            return
+        time.sleep(min(left, CANCEL_POLL))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def client():
+    """The Client shared by all downloads of a run, with the default cache."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client(cache=Cache())
+        return _client
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from PyQt5 import QtCore
+
+from lib.mux import Muxer
+from lib.tag import Tag
+from lib.template import TagTemplate, TemplateError
+from lib.cover import normalize_or_keep
+from lib.schedule import JobQueue
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+
+
+def tag_data(config):
+    """Creates a dict that maps every audio file in config
+    to the data it is tagged with."""
+
+    #create/reset database:
+    database = {}
+
+    current_track_no = 0
+    for audio_file in config.audio_files:
+        debug("parsing through metadata for file: %s", audio_file)
+
+        audio_file_data = {}
+
+        audio_file_data["file"] = audio_file
+
+        audio_file_data["cover"] = config.cover
+
+        current_track_no += 1
+        audio_file_data["track no"] = current_track_no
+
+        audio_file_data["tot tracks"] = len(config.audio_files)
+
+        audio_file_data["disk no"] = config.series_no
+
+        audio_file_data["title"] = config.title_full(current_track_no)
+
+        audio_file_data["sort title"] = config.title_sort
+
+        artist_string = "{} (read by {})".format(config.authors_string,
+                                                 config.narrators_string)
+        audio_file_data["artist"] = artist_string
+
+        audio_file_data["album artist"] = config.authors_string
+
+        if config.series_title is not None:
+            audio_file_data["album"] = config.series_title
+        else:
+            audio_file_data["album"] = config.title
+
+        audio_file_data["description"] = config.description
+
+        audio_file_data["copyright"] = config.copyright
+
+        audio_file_data["date"] = config.date
+
+        debug("audio_file_data: %s", audio_file_data)
+
+        database.update({audio_file: audio_file_data})
+    return database
+
+
+class Pipeline(QtCore.QObject):
+    """
+    Runs remuxing and tagging of all parts as two queues.
+
+    Remuxing needs nothing but the part number, so it starts
+    as soon as the list of files is known (remux_all) and runs
+    while the metadata is still being entered. Tagging waits
+    for the metadata (tag_all), every part is tagged as soon as
+    both its data and its remuxed file are there.
+
+    progress is the share of all remux and tag work done,
+    finished is emitted once every part is tagged or failed,
+    stopped once stop has dropped all work.
+    """
+    progress = QtCore.pyqtSignal(int)
+    message = QtCore.pyqtSignal(str)
+    error = QtCore.pyqtSignal(str)
+    finished = QtCore.pyqtSignal()
+    stopped = QtCore.pyqtSignal()
+
+    def __init__(self, mp4box, parent=None):
+        super().__init__(parent)
+        debug("initialized Pipeline")
+
+        self._mp4box = mp4box
+        self._muxer = None
+        self._tagger = None
+        self._create_muxer()
+        self._create_tagger()
+
+        self._files = []
+        self._data = {}
+        self._template = None
+        self._remux_queue = JobQueue()
+        self._tag_queue = JobQueue()
+        self._remuxed = set()
+        self._queued = set()
+        self._tagged = set()
+        self._failed = set()
+        self._remuxing = None
+        self._tagging = None
+        self._remux_progress = 0
+        self._tag_progress = 0
+
+    def _create_muxer(self):
+        self._muxer = Muxer(self._mp4box)
+        self._muxer.progress.connect(self._receive_remux_progress)
+        self._muxer.message.connect(self.message)
+        self._muxer.error.connect(self.error)
+        self._muxer.finished.connect(self._remux_finished)
+
+    def _create_tagger(self):
+        self._tagger = Tag()
+        self._tagger.progress.connect(self._receive_tag_progress)
+        self._tagger.message.connect(self.message)
+        self._tagger.error.connect(self.error)
+        self._tagger.finished.connect(self._tag_finished)
+        self._tagger.failed.connect(self._tag_failed)
+
+    @property
+    def files(self):
+        return list(self._files)
+
+    @property
+    def done(self):
+        return bool(self._files) and len(self._tagged) == len(self._files)
+
+    def eta(self):
+        return self._remux_queue.eta() + self._tag_queue.eta()
+
+    def remux_all(self, files):
+        """Start remuxing files in the background, numbered in the given order."""
+        files = list(files)
+        if files == self._files:
+            debug("files did not change, remuxing continues")
+            return
+
+        self._clear()
+        self._files = files
+        for part_no, file in enumerate(files, start=1):
+            self._remux_queue.push({"file": file, "track no": part_no})
+        self._next_remux()
+
+    def tag_all(self, database):
+        """Hand over the tagging data of every file, parts already remuxed start right away."""
+        self._data = dict(database)
+        #everything but title and numbers is the same for all parts,
+        #so the tags (and cover) are rendered once for the book:
+        if self._data:
+            shared = dict(next(iter(self._data.values())))
+            shared["cover"] = normalize_or_keep(shared.get("cover"))
+            try:
+                self._template = TagTemplate(shared)
+            except TemplateError as err:
+                self.error.emit(err.msg)
+                return
+        else:
+            self._template = None
+        for file in self._files:
+            self._queue_tag(file)
+        self._next_tag()
+
+    def stop(self):
+        """Drops all remux and tag work, unfinished outputs are removed."""
+        self._clear()
+        self.stopped.emit()
+
+    def _clear(self):
+        if self._remuxing is not None:
+            self._remuxing = None
+            self._muxer.exit_thread()
+            #the muxer drops its threads when interrupted:
+            self._muxer.disconnect()
+            self._create_muxer()
+        if self._tagging is not None:
+            self._tagging = None
+            self._tagger.exit_thread()
+            #so does the tagger:
+            self._tagger.disconnect()
+            self._create_tagger()
+
+        self._files = []
+        self._data = {}
+        self._template = None
+        self._remux_queue.clear()
+        self._tag_queue.clear()
+        self._remuxed = set()
+        self._queued = set()
+        self._tagged = set()
+        self._failed = set()
+        self._remux_progress = 0
+        self._tag_progress = 0
+
+    def _next_remux(self):
+        if self._remuxing is not None or len(self._remux_queue) == 0:
+            return
+        job = self._remux_queue.pop()
+        self._remuxing = job["file"]
+        self._remux_progress = 0
+        debug("remuxing part %s: %s", job["track no"], job["file"])
+
+        self._muxer.reset()
+        self._muxer.remux(job["file"], job["track no"])
+
+    def _queue_tag(self, file):
+        if file in self._data and file in self._remuxed and file not in self._queued:
+            self._tag_queue.push(self._data[file])
+            self._queued.add(file)
+
+    def _next_tag(self):
+        if self._tagging is not None or len(self._tag_queue) == 0:
+            return
+        data = self._tag_queue.pop()
+        self._tagging = data["file"]
+        self._tag_progress = 0
+        debug("tagging: %s", data["file"])
+
+        self._tagger.reset()
+        self._tagger.tag(data, self._template)
+
+    def _emit_progress(self):
+        if not self._files:
+            return
+        done = (len(self._remuxed) + len(self._tagged) + len(self._failed)) * 100
+        if self._remuxing is not None:
+            done += self._remux_progress
+        if self._tagging is not None:
+            done += self._tag_progress
+        self.progress.emit(done // (len(self._files) * 2))
+
+    @QtCore.pyqtSlot(int)
+    def _receive_remux_progress(self, value):
+        self._remux_progress = value
+        self._emit_progress()
+
+    @QtCore.pyqtSlot(int)
+    def _receive_tag_progress(self, value):
+        self._tag_progress = value
+        self._emit_progress()
+
+    @QtCore.pyqtSlot()
+    def _remux_finished(self):
+        if self._remuxing is None:
+            #stopped in the meantime:
+            return
+        self._remux_queue.done()
+        self._remuxed.add(self._remuxing)
+        self._queue_tag(self._remuxing)
+        self._remuxing = None
+
+        self._emit_progress()
+        self._next_remux()
+        self._next_tag()
+
+    @QtCore.pyqtSlot()
+    def _tag_finished(self):
+        if self._tagging is None:
+            return
+        self._tag_queue.done()
+        self._tagged.add(self._tagging)
+        self._tagging = None
+        self._tag_next_or_finish()
+
+    @QtCore.pyqtSlot()
+    def _tag_failed(self):
+        if self._tagging is None:
+            return
+        self._tag_queue.done()
+        self._failed.add(self._tagging)
+        self._tagging = None
+        self._tag_next_or_finish()
+
+    def _tag_next_or_finish(self):
+        self._emit_progress()
+        if len(self._tagged) + len(self._failed) == len(self._files):
+            debug("Finished processing files, %s failed", len(self._failed))
+            self.finished.emit()
+        else:
+            self._next_tag()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import logging
+import concurrent.futures
+
+try:
+    from mutagenx.mp4 import MP4
+    from lib.embedded import ATOMS
+except ImportError:
+    MP4 = None
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+info = logger.info
+
+
+def format_eta(seconds):
+    """Formats a number of seconds as h:mm:ss."""
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(round(max(seconds, 0)))
+    hrs, seconds = divmod(seconds, 3600)
+    mins, seconds = divmod(seconds, 60)
+    return "{}:{:02d}:{:02d}".format(hrs, mins, seconds)
+
+
+class Cost:
+    """
+    The two features used to predict how long a part takes to process.
+
+    size:       size of the file in MB
+    length:     duration of the audio in minutes,
+                0 if it could not be read
+    """
+
+    def __init__(self, size=0.0, length=0.0):
+        self.size = size
+        self.length = length
+
+    def __repr__(self):
+        return "<Cost size={:.1f}MB length={:.1f}min>".format(self.size, self.length)
+
+    @classmethod
+    def from_file(cls, path):
+        try:
+            size = os.path.getsize(path) / 2**20
+        except OSError:
+            size = 0.0
+
+        length = 0.0
+        if MP4 is not None:
+            try:
+                length = MP4(path, store=ATOMS).info.length / 60
+            except Exception as err:  # corrupt or not an mp4 file
+                debug("could not read length of %s: %s", path, err)
+        return cls(size, length)
+
+
+class Throughput:
+    """
+    Online model of how long processing takes, fitted with
+    recursive least squares on:
+
+        seconds = a * size + b * length
+
+    The prior assumes processing is bound by disk io,
+    every finished job refines the weights and older
+    observations fade out with the forgetting factor.
+    """
+
+    def __init__(self, sec_per_mb=0.15, sec_per_min=0.0, forget=0.9):
+        self._theta = [sec_per_mb, sec_per_min]
+        #covariance of the weights, large values adapt faster:
+        self._p = [[1.0, 0.0], [0.0, 1.0]]
+        self._forget = forget
+        self.observations = 0
+
+    def estimate(self, cost):
+        seconds = self._theta[0] * cost.size + self._theta[1] * cost.length
+        #a negative weight can show up after a few noisy jobs,
+        #fall back to the io term alone in that case:
+        if seconds <= 0:
+            seconds = max(self._theta[0], 0.01) * cost.size
+        return seconds
+
+    def update(self, cost, seconds):
+        x = (cost.size, cost.length)
+        p = self._p
+
+        px = (p[0][0] * x[0] + p[0][1] * x[1],
+              p[1][0] * x[0] + p[1][1] * x[1])
+        denom = self._forget + x[0] * px[0] + x[1] * px[1]
+        gain = (px[0] / denom, px[1] / denom)
+
+        err = seconds - (self._theta[0] * x[0] + self._theta[1] * x[1])
+        self._theta = [self._theta[0] + gain[0] * err,
+                       self._theta[1] + gain[1] * err]
+
+        self._p = [[(p[i][j] - gain[i] * px[j]) / self._forget
+                    for j in range(2)] for i in range(2)]
+
+        self.observations += 1
+        debug("model after %s jobs: %s", self.observations, self._theta)
+
+
+class JobQueue:
+    """
+    Queue of parts run one at a time in the order they were
+    pushed, with the time left predicted by the model.
+
+    The parts are not reordered longest-first: with a single
+    worker that only moves the same total around, so the model
+    is used for the estimate and not for the order.
+
+    The cost of a job is read in a background thread, parsing
+    the mp4 file is kept off the thread pushing (the GUI); until
+    it is there the job is estimated by its size alone.
+
+    push(data):     add a dict with at least a "file" key
+    pop():          return the first remaining job and start its timer
+    done():         stop the timer of the current job and feed
+                    the measurement back to the model
+    eta():          seconds left for the current and all queued jobs
+    """
+
+    _reader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def __init__(self, model=None):
+        self._jobs = []
+        self._model = model if model is not None else Throughput()
+        self._current = None
+        self._started = None
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def push(self, data):
+        self._jobs.append((self._reader.submit(Cost.from_file, data["file"]), data))
+
+    def pop(self):
+        self._current = self._jobs.pop(0)
+        self._started = time.monotonic()
+        return self._current[1]
+
+    def done(self):
+        if self._current is None:
+            return
+        elapsed = time.monotonic() - self._started
+        future, data = self._current
+        #a job takes far longer than reading its cost, so this hardly waits:
+        cost = future.result()
+        debug("%s: %s in %.1fs", data["file"], cost, elapsed)
+        self._model.update(cost, elapsed)
+        self._current = None
+        self._started = None
+
+        info("ETA: %s", format_eta(self.eta()))
+
+    def clear(self):
+        for future, data in self._jobs:
+            future.cancel()
+        self._jobs = []
+        self._current = None
+        self._started = None
+
+    def _estimate(self, future, data):
+        if future.done():
+            return self._model.estimate(future.result())
+        try:
+            size = os.path.getsize(data["file"]) / 2**20
+        except OSError:
+            size = 0.0
+        return self._model.estimate(Cost(size))
+
+    def eta(self):
+        remaining = sum(self._estimate(*job) for job in self._jobs)
+        if self._current is not None:
+            expected = self._estimate(*self._current)
+            remaining += max(expected - (time.monotonic() - self._started), 0)
+        return remaining
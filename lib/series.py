@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import logging
+import urllib.parse
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    raise ImportError("Unable to import BeautifulSoup") from None
+
+from lib.abparse import download, runtime_to_sec, BS4Exception, RegExException
+from lib.trace import span
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+
+#listings longer than this are cut, no series has that many books:
+MAX_PAGES = 20
+
+BOOK_RE = re.compile(r"(\d+)\s*$")
+TITLE_RE = re.compile(r"^([\w\s']+)")
+
+
+def _text(tag):
+    return tag.text.strip() if tag is not None else ""
+
+
+def _names(row):
+    """Comma separated names of an author or narrator row, as Metadata returns them."""
+    if row is None:
+        return None
+    names = row.find('span', {'class': 'adbl-prod-author'})
+    if names is None:
+        return None
+    return ', '.join(s.strip() for s in names.text.strip().split(','))
+
+
+class SeriesListing:
+    """
+    Listing of all books of a series on its series page.
+
+    One request (or one per page of the listing) gives the
+    title, authors, narrators, position, runtime, release date
+    and url of every book, the fields the product pages would
+    give minus description and copyright.
+
+    books:  list of dicts with the keys of lib.fetch.FIELDS
+            that the listing has plus "url"
+    """
+
+    def __init__(self, url, series_title=None):
+        self._url = url
+        self._series_title = series_title
+        self.books = []
+
+    def load(self):
+        url = self._url
+        pages = 0
+        while url is not None and pages < MAX_PAGES:
+            html = download(url)
+            with span("parse", cat="series", bytes=len(html)):
+                soup = BeautifulSoup(html, "html5lib")
+            if soup.body is None:
+                raise BS4Exception("cannot parse document structure")
+
+            if self._series_title is None:
+                self._series_title = _text(soup.find('h1', {'class': 'adbl-series-title'}))
+
+            for item in soup.find_all('div', {'class': 'adbl-result-item'}):
+                book = self._book(item, url)
+                if book is not None:
+                    self.books.append(book)
+
+            next_page = soup.find('a', {'class': 'adbl-page-next'})
+            if next_page is not None and next_page.get('href'):
+                url = urllib.parse.urljoin(url, next_page['href'])
+            else:
+                url = None
+            pages += 1
+
+        debug("series %s: %s books", self._series_title, len(self.books))
+        return self.books
+
+    def _book(self, item, page_url):
+        title = item.find('div', {'class': 'adbl-prod-title'})
+        if title is None or title.a is None or not title.a.get('href'):
+            return None
+
+        raw = title.a.text.strip()
+        match = TITLE_RE.search(raw)
+        book = {"title": match.group(1).strip() if match else raw,
+                "url": urllib.parse.urljoin(page_url, title.a['href']),
+                "authors": _names(item.find('li', {'class': 'adbl-author-row'})),
+                "narrators": _names(item.find('li', {'class': 'adbl-narrator-row'}))}
+
+        match = BOOK_RE.search(_text(item.find('span', {'class': 'adbl-label'})))
+        if match:
+            book["series"] = (self._series_title, int(match.group(1)))
+
+        try:
+            book["runtime"] = runtime_to_sec(_text(item.find('span', {'class': 'adbl-run-time'})))
+        except RegExException:
+            pass
+
+        date = _text(item.find('span', {'class': 'adbl-release-date'}))
+        try:
+            book["date"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.strptime(date, "%m-%d-%y"))
+        except ValueError:
+            pass
+
+        return book
+
+
+def harvest(url, books, series_title=None):
+    """
+    Loads a series listing into the Catalog books, fields a
+    book already has are kept. Returns the number of books.
+    """
+    listing = SeriesListing(url, series_title)
+    with span("harvest", cat="series", url=url) as harvest:
+        for book in listing.load():
+            books.add(book["url"], book)
+        books.mark_harvested(url)
+        harvest.set(books=len(listing.books))
+    return len(listing.books)
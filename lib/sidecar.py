@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+import xml.etree.ElementTree as ET
+
+from lib.tree import Parse
+from lib.trace import span
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+
+#name of the sidecar written next to the audio files:
+SIDECAR = "metadata.xml"
+
+#element path -> key, for elements with a single value:
+TEXT = {"audiobook/title": "title",
+        "audiobook/series/title": "series_title",
+        "audiobook/series/position": "series_no",
+        "audiobook/runtime": "runtime",
+        "audiobook/date": "date",
+        "audiobook/description": "description",
+        "audiobook/copyright": "copyright",
+        "audiobook/url": "url"}
+#element path -> key, for elements that repeat:
+LISTS = {"audiobook/authors/name": "authors",
+         "audiobook/narrators/name": "narrators"}
+
+
+class SidecarError(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.msg = msg
+
+
+def find(folder):
+    """Returns the path of the sidecar in folder or None."""
+    if folder is None:
+        return None
+    path = os.path.join(folder, SIDECAR)
+    if os.path.isfile(path):
+        return path
+    try:
+        return Parse(folder).xml
+    except FileNotFoundError:
+        return None
+
+
+def read(path):
+    """
+    Reads an <audiobook> sidecar into a dict.
+
+    title, description etc. are strings, authors and narrators
+    lists, series_no and runtime ints; missing elements are
+    left out.
+    """
+    data = {"authors": [], "narrators": []}
+    stack = []
+    try:
+        with span("sidecar", cat="metadata", file=path):
+            for event, elem in ET.iterparse(path, events=("start", "end")):
+                if event == "start":
+                    if not stack and elem.tag != "audiobook":
+                        raise SidecarError("{} is not an audiobook sidecar".format(path))
+                    stack.append(elem.tag)
+                    continue
+
+                tag = "/".join(stack)
+                stack.pop()
+                text = (elem.text or "").strip()
+                if tag in TEXT:
+                    data[TEXT[tag]] = text
+                elif tag in LISTS:
+                    data[LISTS[tag]].append(text)
+                elem.clear()
+    except ET.ParseError as err:
+        raise SidecarError("could not parse {}: {}".format(path, err)) from None
+
+    for key in ("series_no", "runtime"):
+        try:
+            data[key] = int(data[key])
+        except KeyError:
+            pass
+        except ValueError:
+            del data[key]
+
+    debug("sidecar %s: %s", path, data)
+    return data
+
+
+def load(path, config):
+    """Populates config from a sidecar, returns False if it has no title."""
+    return apply(read(path), config)
+
+
+def apply(data, config):
+    """Populates config from a dict as returned by read, returns False if it has no title."""
+    if not data.get("title"):
+        return False
+
+    config.title = data["title"]
+    config.authors = data.get("authors", [])
+    config.narrators = data.get("narrators", [])
+    if data.get("series_title"):
+        config.series_title = data["series_title"]
+    config.series_no = data.get("series_no", 0)
+    config.runtime = data.get("runtime")
+    config.date = data.get("date", "")
+    config.description = data.get("description", "")
+    config.copyright = data.get("copyright", "")
+    if data.get("url"):
+        config.url = data["url"]
+    return True
+
+
+def _add(parent, tag, text):
+    elem = ET.SubElement(parent, tag)
+    elem.text = str(text)
+    return elem
+
+
+def write(path, data):
+    """Writes a dict as returned by read back to a sidecar."""
+    root = ET.Element("audiobook")
+    _add(root, "title", data["title"])
+    for key in ("authors", "narrators"):
+        names = ET.SubElement(root, key)
+        for name in data.get(key, []):
+            _add(names, "name", name)
+    if data.get("series_title"):
+        series = ET.SubElement(root, "series")
+        _add(series, "title", data["series_title"])
+        _add(series, "position", data.get("series_no", 0))
+    for key in ("runtime", "date", "description", "copyright", "url"):
+        if data.get(key) is not None:
+            _add(root, key, data[key])
+
+    #never leave a half written sidecar behind:
+    temp = "{}.tmp".format(path)
+    ET.ElementTree(root).write(temp, encoding="utf-8", xml_declaration=True)
+    os.replace(temp, path)
+    debug("wrote sidecar %s", path)
+
+
+def from_fields(fields, url=None):
+    """Converts the fields of a Fetch into a sidecar dict."""
+    series_title, series_no = fields.get("series") or ("", "")
+    data = {"title": fields.get("title") or "",
+            "authors": [name for name in (fields.get("authors") or "").split(", ") if name],
+            "narrators": [name for name in (fields.get("narrators") or "").split(", ") if name],
+            "series_title": series_title,
+            "series_no": series_no,
+            "runtime": fields.get("runtime"),
+            "date": fields.get("date"),
+            "description": fields.get("description"),
+            "copyright": fields.get("copyright"),
+            "url": url}
+    return data
+
+
+def export(folder, fields, url=None):
+    """Writes the sidecar of a successful fetch into folder."""
+    if folder is None or not fields.get("title"):
+        return None
+    path = os.path.join(folder, SIDECAR)
+    try:
+        write(path, from_fields(fields, url))
+    except OSError as err:
+        logger.warning("could not write sidecar %s: %s", path, err)
+        return None
+    return path
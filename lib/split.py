@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import math
+import bisect
+import struct
+import logging
+
+try:
+    from mutagenx.mp4 import Atom, Atoms
+except ImportError:
+    raise ImportError("Unable to import mutagenx") from None
+
+from lib.cut import Cut, CutError
+from lib.embedded import ATOMS
+from lib.template import HDLR
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+
+#many devices cannot play files of 2 GB and more:
+MAX_SIZE = 2**31 - 1
+#room left in every part for tags and chapters on top of the
+#ftyp and moov of the source:
+HEADROOM = 2**16
+#chpl times are in units of 100 ns:
+CHPL_UNITS = 10**7
+
+
+def chapters(moov):
+    """(start in seconds, title) of the chapters in the chpl atom of moov, sorted by start."""
+    root = Atoms(io.BytesIO(moov))[b"moov"]
+    try:
+        chpl = root[b"udta", b"chpl"]
+    except KeyError:
+        return []
+    data = moov[chpl.offset + 8:chpl.offset + chpl.length]
+    #version 1 has 4 more bytes before the count:
+    pos = 8 if data[0] == 1 else 4
+    if pos >= len(data):
+        return []
+    count = data[pos]
+    pos += 1
+    result = []
+    for _ in range(count):
+        if pos + 9 > len(data):
+            break
+        start, size = struct.unpack_from(">QB", data, pos)
+        title = data[pos + 9:pos + 9 + size].decode("utf-8", "replace")
+        result.append((start / CHPL_UNITS, title))
+        pos += 9 + size
+    return sorted(result)
+
+
+def render_chapters(chapters):
+    """A chpl atom of (start in seconds, title), it can hold up to 255 chapters."""
+    if len(chapters) > 255:
+        debug("dropping %s chapters after the 255th", len(chapters) - 255)
+    entries = []
+    for start, title in chapters[:255]:
+        title = title.encode("utf-8")[:255].decode("utf-8", "ignore").encode("utf-8")
+        entries.append(struct.pack(">QB", round(start * CHPL_UNITS), len(title)) + title)
+    return Atom.render(b"chpl", struct.pack(">B3xIB", 1, 0, len(entries)) + b"".join(entries))
+
+
+def _part_chapters(table, marks, start, stop):
+    """The chapters of the samples start to stop - 1 from (first sample, title),
+    a part starting inside a chapter starts with that chapter."""
+    result = []
+    for mark, title in marks:
+        if mark >= stop:
+            break
+        if mark <= start:
+            result = [(0.0, title)]
+        else:
+            result.append((table.time_of(mark) - table.time_of(start), title))
+    return result
+
+
+def _meta(moov, number, total):
+    """The meta atom of moov with trkn set to number/total."""
+    trkn = Atom.render(b"trkn", Atom.render(b"data", struct.pack(">2I4H", 0, 0, 0, number, total, 0)))
+    root = Atoms(io.BytesIO(moov))[b"moov"]
+    try:
+        meta = root[b"udta", b"meta"]
+    except KeyError:
+        return Atom.render(b"meta", b"\x00" * 4 + HDLR + Atom.render(b"ilst", trkn))
+
+    children = []
+    has_ilst = False
+    for child in meta.children:
+        raw = moov[child.offset:child.offset + child.length]
+        if child.name == b"ilst":
+            has_ilst = True
+            raw = Atom.render(b"ilst", b"".join(
+                moov[item.offset:item.offset + item.length]
+                for item in child.children if item.name != b"trkn") + trkn)
+        children.append(raw)
+    if not has_ilst:
+        children.append(Atom.render(b"ilst", trkn))
+    return Atom.render(b"meta", moov[meta.offset + 8:meta.offset + 12] + b"".join(children))
+
+
+def _nearest_time(table, time):
+    """The sample boundaries at or before and after time seconds, the closest first."""
+    sample = table.sample_at(time)
+    if abs(table.time_of(sample + 1) - time) < abs(table.time_of(sample) - time):
+        return sample + 1, sample
+    return sample, sample + 1
+
+
+def _nearest_byte(table, position):
+    """The sample boundaries at or before and after byte position of the audio, the closest first."""
+    sample = table.sample_at_byte(position)
+    if table.span(0, sample + 1) - position < position - table.span(0, sample):
+        return sample + 1, sample
+    return sample, sample + 1
+
+
+def plan(table, max_size=None, max_duration=None, overhead=0, marks=(), align=0.0):
+    """
+    The first sample of every part and len(table) at the end,
+    for as few parts as possible of at most max_size bytes (of
+    which overhead are headers) and max_duration seconds.
+
+    The parts are cut at the sample boundaries closest to equal
+    shares of what is left, measured in the limit that needs the
+    most parts; at the boundary before the share if the closest
+    one would make the part too big. With marks (sorted sample numbers, say the chapter
+    starts) a cut moves to the closest mark if that is at most
+    align of a part away.
+    """
+    total = len(table)
+    audio = table.span(0, total)
+    if max_size is not None and max_size <= overhead:
+        raise CutError("parts of {} bytes cannot hold the headers".format(max_size))
+
+    def fits(start, stop, parts=1):
+        return ((max_size is None or table.span(start, stop) + parts * overhead <= parts * max_size) and
+                (max_duration is None or table.time_of(stop) - table.time_of(start) <= parts * max_duration))
+
+    by_size = math.ceil(audio / (max_size - overhead)) if max_size is not None else 1
+    by_duration = math.ceil(table.duration / max_duration) if max_duration is not None else 1
+    count = max(by_size, by_duration, 1)
+    while count <= total:
+        bounds = [0]
+        for part in range(1, count):
+            left = count - part + 1
+            if by_size >= by_duration:
+                done = table.span(0, bounds[-1])
+                closest, other = _nearest_byte(table, done + (audio - done) // left)
+            else:
+                done = table.time_of(bounds[-1])
+                closest, other = _nearest_time(table, done + (table.duration - done) / left)
+            target = closest
+            if not fits(bounds[-1], closest):
+                target = min(closest, other)
+            index = bisect.bisect_left(marks, target)
+            near = [mark for mark in marks[max(index - 1, 0):index + 1]
+                    if abs(mark - target) <= align * total / count]
+            if near:
+                mark = min(near, key=lambda mark: abs(mark - target))
+                #the rest has to fit into the parts that are left:
+                if bounds[-1] < mark and fits(bounds[-1], mark) and fits(mark, total, count - part):
+                    target = mark
+            bounds.append(min(max(target, bounds[-1] + 1), total))
+        bounds.append(total)
+        if all(start < stop and fits(start, stop) for start, stop in zip(bounds, bounds[1:])):
+            return bounds
+        #variable bitrate or the marks made a part too big:
+        count += 1
+    raise CutError("cannot split into parts of at most {} bytes and {} s".format(max_size, max_duration))
+
+
+def split(in_file, folder=None, max_size=MAX_SIZE, max_duration=None, align=0.0, store=ATOMS):
+    """
+    Splits in_file into as few parts as possible that are at
+    most max_size bytes and max_duration seconds (None for no
+    limit), cut at sample (AAC frame) boundaries without
+    decoding; see plan for where, align the share of a part a
+    cut may move to start a part with a chapter instead.
+
+    Every part gets the tags of in_file with its own trkn
+    (part/parts) and the chapters that fall into it. The parts
+    are named after in_file with ", Part n" added and written
+    to folder, or next to in_file if None.
+
+    Returns the paths of the parts, [in_file] if it needs no split.
+    """
+    cut = Cut(in_file, store=store)
+    table = cut.table
+    overhead = len(cut.ftyp) + len(cut.moov) + HEADROOM
+    #chapters by the sample they start at:
+    source_chapters = [(_nearest_time(table, start)[0], title) for start, title in chapters(cut.moov)]
+    marks = sorted({mark for mark, title in source_chapters})
+    bounds = plan(table, max_size, max_duration, overhead, marks, align)
+    parts = len(bounds) - 1
+    if parts == 1:
+        debug("%s needs no split", in_file)
+        return [in_file]
+
+    if folder is None:
+        folder = os.path.dirname(in_file)
+    stem, ext = os.path.splitext(os.path.basename(in_file))
+    written = []
+    try:
+        for number, (start, stop) in enumerate(zip(bounds, bounds[1:]), 1):
+            out_file = os.path.join(folder, "{}, Part {}{}".format(stem, number, ext))
+            cut.select(start, stop)
+            udta = []
+            if source_chapters:
+                udta.append(render_chapters(_part_chapters(table, source_chapters, start, stop)))
+            written.append(out_file)
+            cut.write(out_file, _meta(cut.moov, number, parts), udta)
+    except BaseException:
+        for out_file in written:
+            _remove(out_file)
+        raise
+
+    debug("split %s into %s parts", in_file, parts)
+    return written
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import time
+import struct
+import logging
+
+try:
+    from mutagenx.mp4 import Atom, Atoms, AtomIndex, MP4MetadataError
+    from mutagenx.padding import PaddingInfo, choose, reserve
+except ImportError:
+    raise ImportError("Unable to import mutagenx") from None
+
+from lib.embedded import ATOMS
+
+from lib.verify import HashingWriter, BUFFER_SIZE
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+
+#flags of the data atoms:
+UTF8 = 1
+JPEG = 13
+PNG = 14
+INTEGER = 21
+
+#the parts are tagged for the first time, so room is reserved for
+#tags added later (a cover, a longer description) to go in place:
+PADDING = reserve(share=0.001, minimum=2**16, maximum=2**20)
+
+HDLR = Atom.render(b"hdlr", b"\x00" * 8 + b"mdirappl" + b"\x00" * 9)
+
+
+class TemplateError(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.msg = msg
+
+
+def _data(key, flags, value):
+    return Atom.render(key, Atom.render(b"data", struct.pack(">2I", flags, 0) + value))
+
+
+def _text(key, value):
+    return _data(key, UTF8, value.encode("utf-8"))
+
+
+def _pair(key, number, total, trailing=True):
+    if not (0 <= number < 1 << 16 and 0 <= total < 1 << 16):
+        raise TemplateError("invalid number {}/{}".format(number, total))
+    if trailing:
+        return _data(key, 0, struct.pack(">4H", 0, number, total, 0))
+    return _data(key, 0, struct.pack(">3H", 0, number, total))
+
+
+def _cover(path):
+    with open(path, mode='rb') as file:
+        image = file.read()
+    flags = PNG if image[:8] == b"\x89PNG\r\n\x1a\n" else JPEG
+    return _data(b"covr", flags, image)
+
+
+def _number(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class TagTemplate:
+    """
+    The ilst of a book, rendered once.
+
+    All parts of a book share everything but the title, track
+    and disk number, so those atoms (including the cover) are
+    rendered when the template is created and every part only
+    renders its ©nam, trkn and disk in front of them.
+
+    data:   one entry of lib.pipeline.tag_data, any part will do
+    """
+
+    def __init__(self, data):
+        atoms = []
+        for key, name in ((b"\xa9ART", "artist"),
+                          (b"aART", "album artist"),
+                          (b"sonm", "sort title"),
+                          (b"\xa9alb", "album"),
+                          (b"\xa9day", "date"),
+                          (b"cprt", "copyright"),
+                          (b"desc", "description"),
+                          (b"ldes", "description"),
+                          (b"sdes", "description")):
+            if data.get(name):
+                atoms.append(_text(key, str(data[name])))
+
+        atoms.append(_text(b"\xa9gen", "Audiobooks"))
+        atoms.append(_data(b"stik", INTEGER, b"\x02"))
+        atoms.append(_text(b"purd", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())))
+
+        if data.get("cover") is not None:
+            try:
+                atoms.append(_cover(data["cover"]))
+            except OSError as err:
+                raise TemplateError("cannot read cover: {}".format(err)) from None
+
+        self.shared = b"".join(atoms)
+        debug("rendered template with %s atoms, %s bytes", len(atoms), len(self.shared))
+
+    def ilst(self, data):
+        """The ilst of one part."""
+        return Atom.render(b"ilst",
+                           _text(b"\xa9nam", str(data["title"])) +
+                           _pair(b"trkn", data["track no"], data["tot tracks"]) +
+                           _pair(b"disk", _number(data.get("disk no")), 0, trailing=False) +
+                           self.shared)
+
+    def meta(self, data, size=0):
+        """The meta atom of one part of size bytes, padded for later edits."""
+        ilst = self.ilst(data)
+        padding = choose(PaddingInfo(-1, size, new=True), PADDING)
+        return Atom.render(b"meta", b"\x00" * 4 + HDLR + ilst +
+                           Atom.render(b"free", b"\x00" * padding))
+
+    def write(self, data, in_file, out_file, progress=None, cancelled=None):
+        """
+        Copies in_file to out_file with the tags of data, the
+        audio is streamed and never parsed.
+
+        progress is called with the share of bytes written, the
+        copy stops (and out_file is removed) once cancelled()
+        returns True.
+
+        Returns (hexdigest, size, moov) of out_file, moov being
+        the new moov atom followed by the moof atoms (as
+        lib.verify.result expects them), or None if cancelled.
+        """
+        with open(in_file, mode='rb') as src:
+            try:
+                #the input was most likely read by a scan already:
+                atoms = AtomIndex.for_file(in_file, store=ATOMS).atoms([b"moov"])
+                moov = atoms[b"moov"]
+            except (MP4MetadataError, KeyError, struct.error) as err:
+                raise TemplateError("cannot read atoms of {}: {}".format(in_file, err)) from None
+
+            src.seek(moov.offset)
+            size = os.path.getsize(in_file)
+            try:
+                new_moov = self._moov(src.read(moov.length), self.meta(data, size), moov.offset)
+            except (MP4MetadataError, KeyError, struct.error) as err:
+                raise TemplateError("cannot rewrite moov of {}: {}".format(in_file, err)) from None
+            moofs = [atom for atom in atoms.atoms if atom.name == b"moof"]
+            total = size - moov.length + len(new_moov)
+
+            try:
+                with open(out_file, mode='wb') as dst:
+                    writer = HashingWriter(dst)
+                    #the moov (and moof) atoms of the output for lib.verify.result:
+                    headers = [new_moov]
+                    delta = len(new_moov) - moov.length
+                    src.seek(0)
+                    copied = self._copy(src, writer, moov.offset, total, progress, cancelled)
+                    if copied:
+                        writer.write(new_moov)
+                        src.seek(moov.offset + moov.length)
+                        #fragments after the moov move with it:
+                        for moof in moofs:
+                            if moof.offset < moov.offset:
+                                continue
+                            copied = self._copy(src, writer, moof.offset - src.tell(),
+                                                total, progress, cancelled)
+                            if not copied:
+                                break
+                            fragment = _shift_moof(src.read(moof.length), delta, moov.offset)
+                            writer.write(fragment)
+                            headers.append(fragment)
+                        if copied:
+                            copied = self._copy(src, writer, None, total, progress, cancelled)
+            except (MP4MetadataError, KeyError, struct.error) as err:
+                _remove(out_file)
+                raise TemplateError("cannot move fragments of {}: {}".format(in_file, err)) from None
+            except BaseException:
+                _remove(out_file)
+                raise
+
+        if not copied:
+            _remove(out_file)
+            return None
+        return writer.hexdigest(), writer.bytes_written, b"".join(headers)
+
+    @staticmethod
+    def _copy(src, writer, length, total, progress, cancelled):
+        """Copies length bytes (all if None), returns False if cancelled."""
+        while length is None or length > 0:
+            if cancelled is not None and cancelled():
+                return False
+            size = BUFFER_SIZE if length is None else min(BUFFER_SIZE, length)
+            buf = src.read(size)
+            if not buf:
+                break
+            writer.write(buf)
+            if length is not None:
+                length -= len(buf)
+            if progress is not None:
+                progress(writer.bytes_written / total if total else 1.0)
+        return True
+
+    @staticmethod
+    def _moov(moov, meta, moov_offset):
+        """moov with meta as its only meta atom and chunk offsets moved by the size change."""
+        atoms = Atoms(io.BytesIO(moov))
+        root = atoms[b"moov"]
+        children = []
+        has_udta = False
+        for child in root.children:
+            raw = moov[child.offset:child.offset + child.length]
+            if child.name == b"udta":
+                has_udta = True
+                raw = Atom.render(b"udta", b"".join(
+                    moov[atom.offset:atom.offset + atom.length]
+                    for atom in child.children if atom.name != b"meta") + meta)
+            children.append(raw)
+        if not has_udta:
+            children.append(Atom.render(b"udta", meta))
+
+        new_moov = bytearray(Atom.render(b"moov", b"".join(children)))
+        delta = len(new_moov) - len(moov)
+        if delta:
+            root = Atoms(io.BytesIO(new_moov))[b"moov"]
+            for fmt, name in ((">{}I", b"stco"), (">{}Q", b"co64")):
+                for table in root.findall(name, True):
+                    _shift_table(new_moov, table, fmt, delta, moov_offset)
+        return bytes(new_moov)
+
+
+def _shift_table(buf, table, fmt, delta, after):
+    count = struct.unpack_from(">I", buf, table.offset + 12)[0]
+    fmt = fmt.format(count)
+    offsets = struct.unpack_from(fmt, buf, table.offset + 16)
+    struct.pack_into(fmt, buf, table.offset + 16,
+                     *(offset + delta if offset > after else offset for offset in offsets))
+    return
+
+
+def _shift_moof(moof, delta, after):
+    """Moves the explicit base data offsets of the fragment, if it has any."""
+    if not delta:
+        return moof
+    buf = bytearray(moof)
+    root = Atoms(io.BytesIO(buf))[b"moof"]
+    for tfhd in root.findall(b"tfhd", True):
+        flags = struct.unpack_from(">I", buf, tfhd.offset + 8)[0] & 0xffffff
+        if flags & 1:
+            offset = struct.unpack_from(">Q", buf, tfhd.offset + 16)[0]
+            if offset > after:
+                struct.pack_into(">Q", buf, tfhd.offset + 16, offset + delta)
+    return bytes(buf)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
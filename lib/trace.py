@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import threading
+
+
+class _NullSpan:
+    """Returned while tracing is disabled, every call is a no-op."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+    def end(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """
+    A timed section of the pipeline.
+
+    Can be used as a context manager or, when the section starts
+    and ends in different slots, by calling end() explicitly.
+    Extra arguments (file sizes, byte counts) can be attached
+    at any time with set().
+    """
+
+    def __init__(self, tracer, name, cat, args):
+        self._tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.tid = threading.get_ident()
+        self.start = time.perf_counter()
+        self._done = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.end()
+        return False
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def end(self, **args):
+        if self._done:
+            return
+        self._done = True
+        self.args.update(args)
+        self._tracer._record(self, time.perf_counter())
+
+
+class Tracer:
+    """
+    Collects spans and exports them as Chrome trace_event json
+    (load it in chrome://tracing or https://ui.perfetto.dev)
+    and as a plain text summary.
+
+    Tracing is disabled by default, span() then returns a shared
+    no-op object so instrumented code costs one attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._events = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def enable(self):
+        self._origin = time.perf_counter()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._events = []
+
+    def span(self, name, cat="pipeline", **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, cat, args)
+
+    def _record(self, span, stop):
+        event = {"name": span.name,
+                 "cat": span.cat,
+                 "ph": "X",
+                 "ts": (span.start - self._origin) * 1e6,
+                 "dur": (stop - span.start) * 1e6,
+                 "pid": os.getpid(),
+                 "tid": span.tid,
+                 "args": span.args}
+        with self._lock:
+            self._events.append(event)
+
+    @property
+    def events(self):
+        with self._lock:
+            return list(self._events)
+
+    def write_chrome_trace(self, path):
+        """Write all recorded spans as a Chrome trace_event file."""
+        with open(path, mode='w', encoding='utf-8') as file:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, file)
+
+    def summary(self):
+        """Return a table with total and mean time and throughput per span name."""
+        stats = {}
+        for event in self.events:
+            stat = stats.setdefault(event["name"], [0, 0.0, 0])
+            stat[0] += 1
+            stat[1] += event["dur"] / 1e3
+            stat[2] += event["args"].get("bytes", 0)
+
+        lines = ["{:<20} {:>6} {:>12} {:>10} {:>12} {:>9}".format(
+            "span", "count", "total ms", "mean ms", "bytes", "MB/s")]
+        for name, (count, total, size) in sorted(stats.items(), key=lambda s: -s[1][1]):
+            rate = (size / 2**20) / (total / 1e3) if total and size else 0
+            lines.append("{:<20} {:>6} {:>12.1f} {:>10.1f} {:>12} {:>9.1f}".format(
+                name, count, total, total / count, size, rate))
+        return "\n".join(lines)
+
+
+def file_size(path):
+    """Size of a file in bytes or 0 if it does not exist."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+#tracer shared by the whole application:
+tracer = Tracer()
+span = tracer.span
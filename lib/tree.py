@@ -4,20 +4,9 @@
 import os
 import logging
 from lib.util import Tools
+from lib.trace import span
 
-DEBUG = True
-
-#logging is enabled only for debugging
 logger = logging.getLogger(__name__)
-if DEBUG:
-    logger.setLevel(logging.DEBUG)
-    log_format = "%(lineno)d: %(funcName)s, %(module)s.py, %(levelname)s: %(message)s"
-    fmt = logging.Formatter(log_format, datefmt="%d/%m-%H:%M")
-    stream = logging.StreamHandler()
-    stream.setFormatter(fmt)
-else:
-    stream = logging.NullHandler()
-logger.addHandler(stream)
 debug = logger.debug
 
 
@@ -101,10 +90,12 @@ class Parse:
         debug("_xml: %s", self._xml)
 
     def _parse(self):
-        #get folder contents:
-        self._glob_folder()
-        #sort the list of files alphabetically:
-        self._file_list.sort()
+        with span("scan", cat="parse", folder=self._folder) as scan:
+            #get folder contents:
+            self._glob_folder()
+            #sort the list of files alphabetically:
+            self._file_list.sort()
+            scan.set(files=len(self._file_list))
 
     @property
     def audio_files(self):
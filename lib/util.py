@@ -4,19 +4,7 @@ import os
 import pickle
 import logging
 
-DEBUG = True
-
-#logging is enabled only for debugging
 logger = logging.getLogger(__name__)
-if DEBUG:
-    logger.setLevel(logging.DEBUG)
-    log_format = "%(lineno)d: %(funcName)s, %(module)s.py, %(levelname)s: %(message)s"
-    fmt = logging.Formatter(log_format, datefmt="%d/%m-%H:%M")
-    stream = logging.StreamHandler()
-    stream.setFormatter(fmt)
-else:
-    stream = logging.NullHandler()
-logger.addHandler(stream)
 debug = logger.debug
 
 
@@ -29,30 +17,23 @@ class Tools:
         It also uses a cache so all the conversions
         are done only once."""
 
-        debug("current cache: %s", self._cache)
-
         #save path in argument
         arg_path = path
         try:
             #try to return whats in cache:
-            debug("trying to access %s path in cache", arg_path)
             return self._cache[arg_path]
         except KeyError:
-            debug("%s not found in cache", arg_path)
             #normalize path:
             path = os.path.expanduser(path)
             path = os.path.expandvars(path)
             path = os.path.normpath(path)
             #save the result in the cache:
             self._cache[arg_path] = path
-            debug("stored %s in cache", self._cache[arg_path])
+            debug("normalized %s to %s", arg_path, path)
             return path
 
     def path_exists(self, path):
-        debug("checking existance of path %s", path)
-
         path = self._abs_path(path)
-        debug("absolute path: %s", path)
 
         exists = os.path.exists(path)
         if exists:
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import json
+import time
+import struct
+import hashlib
+import logging
+
+try:
+    from mutagenx.mp4 import Atoms, MP4Info
+except ImportError:
+    raise ImportError("Unable to import mutagenx") from None
+
+logger = logging.getLogger(__name__)
+debug = logger.debug
+
+HASH = "blake2b"
+BUFFER_SIZE = 2**20
+#allowed difference in duration between source and output:
+TOLERANCE = 0.1
+
+
+class VerifyError(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.msg = msg
+
+
+class HashingWriter:
+    """
+    Wraps a file object opened for writing and hashes
+    everything written through it, so the digest of an
+    output is known the moment it is closed.
+    """
+
+    def __init__(self, fileobj, algorithm=HASH):
+        self._fileobj = fileobj
+        self._digest = hashlib.new(algorithm)
+        self.algorithm = algorithm
+        self.bytes_written = 0
+
+    def write(self, data):
+        self._digest.update(data)
+        self.bytes_written += len(data)
+        return self._fileobj.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+
+
+def _audio_trak(atoms, fileobj):
+    for trak in atoms[b"moov"].findall(b"trak"):
+        hdlr = trak[b"mdia", b"hdlr"]
+        fileobj.seek(hdlr.offset)
+        if fileobj.read(hdlr.length)[16:20] == b"soun":
+            return trak
+    raise VerifyError("no audio track")
+
+
+def sample_count(atoms, fileobj):
+    """Number of audio samples in the sample table or, for fragmented files, the trun atoms."""
+    trak = _audio_trak(atoms, fileobj)
+    stsz = trak[b"mdia", b"minf", b"stbl", b"stsz"]
+    fileobj.seek(stsz.offset + 16)
+    count = struct.unpack(">I", fileobj.read(4))[0]
+    if count:
+        return count
+
+    for atom in atoms.atoms:
+        if atom.name == b"moof":
+            for trun in atom.findall(b"trun", True):
+                fileobj.seek(trun.offset + 12)
+                count += struct.unpack(">I", fileobj.read(4))[0]
+    return count
+
+
+def describe(path):
+    """Duration and sample count of a file, reading its headers only."""
+    with open(path, mode='rb') as file:
+        atoms = Atoms(file)
+        return MP4Info(atoms, file).length, sample_count(atoms, file)
+
+
+def _describe_moov(moov):
+    file = io.BytesIO(moov)
+    atoms = Atoms(file)
+    return MP4Info(atoms, file).length, sample_count(atoms, file)
+
+
+def result(path, digest, size, moov, truncated, source=None, algorithm=HASH):
+    """
+    Build the audit record of an output file.
+
+    moov holds the raw moov (and moof) atoms of the output, source the path
+    of the file it was made from (only its headers are read).
+    """
+    record = {"file": path,
+              "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+              "bytes": size,
+              algorithm: digest,
+              "errors": []}
+
+    if truncated:
+        record["errors"].append("file is truncated")
+
+    if moov is None:
+        record["errors"].append("no moov atom")
+    else:
+        try:
+            record["duration"], record["samples"] = _describe_moov(moov)
+        except Exception as err:  # anything mutagenx chokes on is a broken file
+            record["errors"].append("unreadable moov: {}".format(err))
+
+    if source is not None and "duration" in record:
+        record["source"] = source
+        try:
+            record["source_duration"], record["source_samples"] = describe(source)
+        except Exception as err:  # anything mutagenx chokes on is a broken file
+            record["errors"].append("unreadable source: {}".format(err))
+
+    if "source_duration" in record:
+        if abs(record["duration"] - record["source_duration"]) > TOLERANCE:
+            record["errors"].append("duration {:.3f}s differs from source {:.3f}s".format(
+                record["duration"], record["source_duration"]))
+        if record["samples"] != record["source_samples"]:
+            record["errors"].append("{} samples, source has {}".format(
+                record["samples"], record["source_samples"]))
+
+    record["ok"] = not record["errors"]
+    debug("verification of %s: %s", path, record)
+    return record
+
+
+class AuditLog:
+    """Appends verification records as json lines."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, record):
+        with open(self.path, mode='a', encoding='utf-8') as file:
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def records(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding='utf-8') as file:
+            return [json.loads(line) for line in file if line.strip()]
@@ -7,32 +7,34 @@ import logging
 from argparse import ArgumentParser
 
 from PyQt5 import QtWidgets
+from PyQt5 import QtCore
+
+#bundled libraries:
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "tools", "mutagen", "lib"))
 
 from config import Config
 from lib.util import Tools
+from lib.trace import tracer
+from lib import log
+from lib.batch import Batch, book_folders
 from gui.resources import Icons
 from gui.wizard import Wizard
 
 
-DEBUG = True
 VERSION = 0.1
 
 
 logger = logging.getLogger(__name__)
-if DEBUG:
-    logger.setLevel(logging.DEBUG)
-    log_format = logging.Formatter("%(lineno)d: %(funcName)s, %(module)s.py, %(levelname)s: %(message)s")
-else:
-    logger.setLevel(logging.ERROR)
-    log_format = logging.Formatter("%(levelname)s: %(message)s")
-stream = logging.StreamHandler()
-stream.setFormatter(log_format)
-logger.addHandler(stream)
 debug = logger.debug
 error = logger.error
 warn = logger.warning
 
 
+def excepthook(exc_type, exc, tb):
+    #logging an error prints the buffered records that led to it:
+    logger.error("unhandled exception", exc_info=(exc_type, exc, tb))
+
+
 def parse_args():
     parser = ArgumentParser()
     parser.add_argument('-v', '--verbose', dest='verbose', action='store_true',
@@ -46,6 +48,21 @@ def parse_args():
 
     parser.add_argument('-c', '--cover', dest='input_cover', metavar='<cover image path>', action='store',
                         help="Path to a cover image. [default: None]")
+    parser.add_argument('-l', '--log-level', dest='log_level', action='store', default='info',
+                        choices=sorted(log.LEVELS, key=log.LEVELS.get),
+                        help="Level of messages printed to the console. [default: %(default)s]")
+    parser.add_argument('--log-buffer', dest='log_buffer', action='store', default='debug',
+                        choices=sorted(log.LEVELS, key=log.LEVELS.get),
+                        help="Lowest level of records kept in memory and printed only when "
+                             "an error occurs, below the console level. [default: %(default)s]")
+    parser.add_argument('--log-buffer-size', dest='log_buffer_size', metavar='<records>', action='store',
+                        type=int, default=2000,
+                        help="Number of records kept in memory, 0 to disable. [default: %(default)s]")
+    parser.add_argument('-b', '--batch', dest='batch', action='store_true',
+                        help="Tag every book in the input folder without the gui, using "
+                             "sidecars or the tags already in the files. [default: %(default)s]")
+    parser.add_argument('-t', '--trace', dest='trace', metavar='<trace path>', action='store',
+                        help="Record timings of every stage and write them as a Chrome trace. [default: None]")
     parser.add_argument('-V', '--version', action='version', version=str(VERSION))
 
     args = parser.parse_args()
@@ -54,19 +71,25 @@ def parse_args():
 
 
 def main():
-    debug("argv: %s", sys.argv)
-    debug("path: %s", sys.path)
-    debug("current path: %s", os.getcwd())
-
     args = parse_args()
-    debug("args: %s", args)
 
     config = Config()
     util = Tools()
 
+    level = log.LEVELS[args.log_level]
     if args.verbose:
-        logger.setLevel(logging.DEBUG)
+        level = min(level, logging.DEBUG)
         config.verbose = True
+    log.setup(level, ring_size=args.log_buffer_size, ring_level=log.LEVELS[args.log_buffer])
+    sys.excepthook = excepthook
+
+    debug("argv: %s", sys.argv)
+    debug("path: %s", sys.path)
+    debug("current path: %s", os.getcwd())
+    debug("args: %s", args)
+
+    if args.trace is not None:
+        tracer.enable()
 
     script_path = util.real_path(os.path.split(__file__)[0])
     debug("script_path %s", script_path)
@@ -76,14 +99,11 @@ def main():
     if platform.system() == "Windows":
         tools_path = os.path.join(script_path, "tools\win")
         config.mp4box = os.path.join(tools_path, "mp4box.exe")
-        config.atomicparsley = os.path.join(tools_path, "AtomicParsley.exe")
     else:
         tools_path = os.path.join(script_path, "tools/mac")
         config.mp4box = os.path.join(tools_path, "mp4box")
-        config.atomicparsley = os.path.join(tools_path, "AtomicParsley")
     debug("tools_path: %s", tools_path)
     debug("mp4box: %s", config.mp4box)
-    debug("atomicparsley: %s", config.atomicparsley)
 
     if args.input_folder is not None:
         debug("checking %s", args.input_folder)
@@ -118,12 +138,30 @@ def main():
 
     debug("config after argparse: %s", config)
 
-    #start gui:
-    app = QtWidgets.QApplication([])
-    Icons()
-    wizard = Wizard(config)
-    wizard.show()
-    app.exec_()
+    status = 0
+    if args.batch:
+        if config.input_folder is None:
+            raise SystemExit("--batch needs an input folder")
+
+        app = QtCore.QCoreApplication([])
+        batch = Batch(config, book_folders(config.input_folder))
+        batch.finished.connect(app.quit)
+        QtCore.QTimer.singleShot(0, batch.start)
+        app.exec_()
+        status = 1 if batch.failed else 0
+    else:
+        #start gui:
+        app = QtWidgets.QApplication([])
+        Icons()
+        wizard = Wizard(config)
+        wizard.show()
+        app.exec_()
+
+    if args.trace is not None:
+        tracer.write_chrome_trace(args.trace)
+        print(tracer.summary())
+
+    return status
 
 if __name__ == "__main__":
     import platform
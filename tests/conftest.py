@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+#the package and the vendored mutagenx, wherever pytest is run from:
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "tools", "mutagen", "lib")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from mutagenx.mp4 import SampleTable
+
+from bench.corpus import write_mp4
+from lib.cut import Cut, CutError, _copy_range, _copy_ways
+
+
+def _audio(path, start=0, stop=None):
+    """The sample table of path and the bytes of the samples start to stop - 1."""
+    table = SampleTable.from_file(path)
+    if stop is None:
+        stop = len(table)
+    with open(path, "rb") as file:
+        data = []
+        for first, count, offset, length in table.extents(start, stop):
+            file.seek(offset)
+            data.append(file.read(length))
+    return table, b"".join(data)
+
+
+class CutTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.out_file = os.path.join(self.folder, "out.m4b")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _source(self, fragmented):
+        path = os.path.join(self.folder, "source.m4b")
+        write_mp4(path, duration=60.0, chunks=12, fragmented=fragmented)
+        return path
+
+    def _round_trip(self, fragmented):
+        source = self._source(fragmented)
+        table, audio = _audio(source)
+        size = Cut(source, store=None).write(self.out_file)
+        self.assertEqual(size, os.path.getsize(self.out_file))
+        cut_table, cut_audio = _audio(self.out_file)
+        self.assertEqual(len(cut_table), len(table))
+        self.assertEqual(cut_audio, audio)
+
+        cut = Cut(source, 10.0, 20.0, store=None)
+        cut.write(self.out_file)
+        cut_table, cut_audio = _audio(self.out_file)
+        self.assertEqual(len(cut_table), cut.stop - cut.start)
+        self.assertEqual(cut_audio, _audio(source, cut.start, cut.stop)[1])
+        self.assertAlmostEqual(cut_table.duration, 10.0, delta=0.05)
+
+    def test_plain(self):
+        self._round_trip(False)
+
+    def test_fragmented(self):
+        self._round_trip(True)
+
+    def test_empty_range(self):
+        source = self._source(False)
+        with self.assertRaises(CutError):
+            Cut(source, 50.0, 50.0, store=None)
+        with self.assertRaises(CutError):
+            Cut(source, 50.0, 40.0, store=None)
+
+
+class CopyRangeTest(unittest.TestCase):
+    def test_fallback_latched(self):
+        data = os.urandom(3 * 2**20)
+        failing = mock.Mock(side_effect=OSError(18, "Invalid cross-device link"))
+        with tempfile.TemporaryFile() as src, tempfile.TemporaryFile() as dst:
+            src.write(data)
+            src.flush()
+            with mock.patch("os.copy_file_range", failing, create=True), \
+                    mock.patch("os.sendfile", failing, create=True):
+                ways = _copy_ways()
+                for offset in range(0, len(data), 2**20):
+                    _copy_range(src.fileno(), dst.fileno(), offset, 2**20, ways)
+            dst.seek(0)
+            self.assertEqual(dst.read(), data)
+        #every way fails once, not once per range:
+        self.assertEqual(failing.call_count, 2)
+        self.assertEqual(ways, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
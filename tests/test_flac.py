@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from mutagenx.flac import FLAC, Padding
+from mutagenx.padding import fixed
+
+from bench.flac import flac_file
+
+AUDIO = 2**16
+
+
+class FLACTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        #the cover is larger than the 64 KiB read buffer:
+        self.path = flac_file(os.path.join(self.folder, "test.flac"), seconds=600, comments=40,
+                              cover=200000, padding=8192, audio=AUDIO)
+        with open(self.path, "rb") as file:
+            self.audio = file.read()[-AUDIO:]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _audio(self, path):
+        with open(path, "rb") as file:
+            return file.read()[-AUDIO:]
+
+    def test_load(self):
+        flac = FLAC(self.path)
+        self.assertEqual(flac.info.sample_rate, 44100)
+        self.assertAlmostEqual(flac.info.length, 600.0)
+        self.assertEqual(len(flac.tags), 40)
+        self.assertEqual(flac["tag39"], ["value " * 8])
+        self.assertEqual(len(flac.pictures[0].data), 200000)
+        self.assertEqual(len(flac.seektable.seekpoints), 60)
+
+    def test_info_only(self):
+        flac = FLAC(self.path, info_only=True)
+        self.assertAlmostEqual(flac.info.length, 600.0)
+        self.assertIsNone(flac.tags)
+        self.assertEqual(flac.pictures, [])
+
+    def test_save_in_place(self):
+        size = os.path.getsize(self.path)
+        flac = FLAC(self.path)
+        flac["title"] = "A Title"
+        flac.save()
+        #the new tag went into the padding:
+        self.assertEqual(os.path.getsize(self.path), size)
+        flac = FLAC(self.path)
+        self.assertEqual(flac["title"], ["A Title"])
+        self.assertEqual(len(flac.pictures[0].data), 200000)
+        self.assertEqual(self._audio(self.path), self.audio)
+
+    def test_shrink(self):
+        size = os.path.getsize(self.path)
+        flac = FLAC(self.path)
+        for number in range(1, 40):
+            del flac["tag{}".format(number)]
+        flac.clear_pictures()
+        flac.save(padding=fixed(1024, limit=1024))
+        self.assertLess(os.path.getsize(self.path), size - 200000)
+        flac = FLAC(self.path)
+        self.assertEqual(list(flac.keys()), ["tag0"])
+        self.assertEqual(flac.pictures, [])
+        self.assertEqual([block.length for block in flac.metadata_blocks
+                          if isinstance(block, Padding)], [1024])
+        self.assertEqual(self._audio(self.path), self.audio)
+
+    def test_file_object(self):
+        with open(self.path, "rb") as file:
+            fileobj = io.BytesIO(file.read())
+        flac = FLAC(fileobj)
+        self.assertEqual(len(flac.pictures[0].data), 200000)
+        flac["title"] = "In Memory"
+        flac.clear_pictures()
+        flac.save(fileobj)
+        flac = FLAC(fileobj)
+        self.assertEqual(flac["title"], ["In Memory"])
+        self.assertEqual(flac.pictures, [])
+        self.assertEqual(fileobj.getvalue()[-AUDIO:], self.audio)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+import io
+import logging
+import unittest
+
+from lib import log
+
+
+class SetupTest(unittest.TestCase):
+    def tearDown(self):
+        root = logging.getLogger()
+        for handler in log._handlers:
+            root.removeHandler(handler)
+        log._handlers.clear()
+        root.setLevel(logging.WARNING)
+
+    def test_context_dumped_on_error(self):
+        stream = io.StringIO()
+        log.setup(logging.INFO, stream=stream)
+        logger = logging.getLogger("test")
+        logger.debug("context")
+        logger.info("shown")
+        self.assertEqual(stream.getvalue(), "INFO: shown\n")
+        logger.error("failed")
+        output = stream.getvalue()
+        self.assertIn("DEBUG: context", output)
+        self.assertLess(output.index("context"), output.index("ERROR: failed"))
+        #records already printed are not repeated:
+        self.assertEqual(output.count("shown"), 1)
+
+    def test_no_buffer(self):
+        log.setup(logging.INFO, ring_size=0, stream=io.StringIO())
+        self.assertEqual(logging.getLogger().level, logging.INFO)
+
+
+if __name__ == "__main__":
+    unittest.main()
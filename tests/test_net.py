@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import shutil
+import tempfile
+import threading
+import unittest
+import http.server
+
+from lib import net
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    #keep-alive, so connections can be reused:
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path == "/cached":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self._send(304, headers=[("ETag", '"v1"')])
+            else:
+                self._send(200, b"cached page", [("ETag", '"v1"')])
+        elif self.path == "/busy":
+            self.server.busy += 1
+            if self.server.busy < 3:
+                self._send(503, b"busy")
+            else:
+                self._send(200, b"finally")
+        elif self.path == "/later":
+            self._send(503, b"busy", [("Retry-After", "3600")])
+        elif self.path == "/gzip":
+            self._send(200, gzip.compress(b"compressed page"), [("Content-Encoding", "gzip")])
+        else:
+            self._send(200, b"page " + self.path.encode("ascii"))
+
+
+class ClientTest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.connections = 0
+        self.server.busy = 0
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.folder = tempfile.mkdtemp()
+        self.client = net.Client(timeout=5, backoff=0.01, cache=net.Cache(self.folder))
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.folder)
+
+    def url(self, path):
+        return "http://127.0.0.1:{}{}".format(self.server.server_address[1], path)
+
+    def test_not_modified_from_cache(self):
+        first = self.client.get(self.url("/cached"))
+        self.assertEqual((first.status, first.body, first.cached), (200, b"cached page", False))
+        second = self.client.get(self.url("/cached"))
+        self.assertEqual((second.status, second.body, second.cached), (304, b"cached page", True))
+        self.assertEqual(self.server.requests[-1][1].get("If-None-Match"), '"v1"')
+
+    def test_retry_unavailable(self):
+        response = self.client.get(self.url("/busy"))
+        self.assertEqual((response.status, response.body), (200, b"finally"))
+        self.assertEqual(self.server.busy, 3)
+
+    def test_retry_after_too_long(self):
+        with self.assertRaises(net.StatusError) as caught:
+            self.client.get(self.url("/later"))
+        self.assertEqual(caught.exception.status, 503)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_cancelled(self):
+        client = net.Client(timeout=5, backoff=10)
+        try:
+            with self.assertRaises(net.Cancelled):
+                client.get(self.url("/busy"), cancelled=lambda: self.server.busy > 0)
+        finally:
+            client.close()
+        self.assertEqual(self.server.busy, 1)
+
+    def test_gzip(self):
+        response = self.client.get(self.url("/gzip"))
+        self.assertEqual(response.body, b"compressed page")
+        self.assertIn("gzip", self.server.requests[-1][1].get("Accept-Encoding"))
+
+    def test_connection_reused(self):
+        for number in range(3):
+            self.assertEqual(self.client.get(self.url("/{}".format(number))).body,
+                             "page /{}".format(number).encode("ascii"))
+        self.assertEqual(self.server.connections, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import io
+import unittest
+
+from mutagenx.ogg import OggPage, OggIndex
+
+
+def _page(serial, sequence, position, size, last=False):
+    page = OggPage()
+    page.serial = serial
+    page.sequence = sequence
+    page.position = position
+    page.packets = [b"\x00" * size]
+    page.last = last
+    return page.write()
+
+
+def _muxed(run, pages=60):
+    """A stream (serial 1) of pages granule positions 1000 apart, every
+    one followed by run pages of 60 KB of another stream (serial 2)."""
+    data = []
+    other = 0
+    for number in range(pages):
+        data.append(_page(1, number, (number + 1) * 1000, 100, last=number == pages - 1))
+        for _ in range(run):
+            data.append(_page(2, other, other, 60000))
+            other += 1
+    return io.BytesIO(b"".join(data))
+
+
+class FindLastTest(unittest.TestCase):
+    def test_interleaved(self):
+        #more than 256 KB between two pages of the stream:
+        for run in (5, 8, 12):
+            fileobj = _muxed(run)
+            page = OggPage.find_last(fileobj, 1)
+            self.assertEqual((page.serial, page.position), (1, 60000), run)
+
+    def test_index(self):
+        fileobj = _muxed(12)
+        index = OggIndex.build(fileobj)
+        self.assertEqual(OggPage.find_last(fileobj, 1, index).position, 60000)
+        self.assertEqual(index.length(1), 60000)
+
+    def test_not_muxed(self):
+        fileobj = _muxed(0)
+        self.assertEqual(OggPage.find_last(fileobj, 1).position, 60000)
+
+
+if __name__ == "__main__":
+    unittest.main()
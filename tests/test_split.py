@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import io
+import struct
+import unittest
+
+from mutagenx.mp4 import Atom, Atoms, SampleTable
+
+from lib.split import plan
+
+
+def _full(name, data):
+    return Atom.render(name, b"\x00" * 4 + data)
+
+
+def _table(count, size=300, delta=1024, scale=44100, per_chunk=20, last=None):
+    """SampleTable of an audio track of count samples of the same duration,
+    but for the last one if last is given, and size (or a list of sizes)."""
+    sizes = size if isinstance(size, list) else [size] * count
+    chunks = -(-count // per_chunk)
+    offsets = [1000 + sum(sizes[:first]) for first in range(0, count, per_chunk)]
+    if last is None:
+        stts = struct.pack(">3I", 1, count, delta)
+    else:
+        stts = struct.pack(">5I", 2, count - 1, delta, 1, last)
+    stbl = Atom.render(b"stbl",
+                       _full(b"stts", stts) +
+                       _full(b"stsc", struct.pack(">4I", 1, 1, per_chunk, 1)) +
+                       _full(b"stsz", struct.pack(">2I", size, count) if size is not sizes else
+                             struct.pack(">2I{}I".format(count), 0, count, *sizes)) +
+                       _full(b"stco", struct.pack(">I{}I".format(chunks), chunks, *offsets)))
+    trak = Atom.render(b"trak",
+                       _full(b"tkhd", struct.pack(">3I", 0, 0, 1) + b"\x00" * 68) +
+                       Atom.render(b"mdia",
+                                   _full(b"mdhd", struct.pack(">4I", 0, 0, scale, 0) + b"\x00" * 4) +
+                                   _full(b"hdlr", b"\x00" * 4 + b"soun" + b"\x00" * 12) +
+                                   Atom.render(b"minf", stbl)))
+    fileobj = io.BytesIO(Atom.render(b"ftyp", b"M4A " + b"\x00" * 4) + Atom.render(b"moov", trak))
+    return SampleTable(Atoms(fileobj), fileobj)
+
+
+class PlanTest(unittest.TestCase):
+    def _check(self, table, bounds, max_size=None, max_duration=None):
+        self.assertEqual(bounds[0], 0)
+        self.assertEqual(bounds[-1], len(table))
+        for start, stop in zip(bounds, bounds[1:]):
+            self.assertLess(start, stop)
+            if max_duration is not None:
+                self.assertLessEqual(table.time_of(stop) - table.time_of(start), max_duration)
+            if max_size is not None:
+                self.assertLessEqual(table.span(start, stop), max_size)
+
+    def test_duration_just_under_a_multiple(self):
+        #299.96 s, 4306 samples make 99.99 s:
+        table = _table(12918)
+        self.assertLess(table.duration, 300)
+        self.assertGreater(table.duration, 299.95)
+        bounds = plan(table, max_duration=100)
+        self.assertEqual(len(bounds) - 1, 3)
+        self._check(table, bounds, max_duration=100)
+
+    def test_size_just_under_a_multiple(self):
+        table = _table(3000, size=301)
+        max_size = table.span(0, 1000) + 150
+        bounds = plan(table, max_size=max_size)
+        self.assertEqual(len(bounds) - 1, 3)
+        self._check(table, bounds, max_size=max_size)
+
+    def test_variable_bitrate(self):
+        #the boundary closest to a fourth of the audio (875 bytes)
+        #makes a first part of 1300 bytes:
+        table = _table(7, size=[100, 300, 900, 100, 300, 900, 900])
+        bounds = plan(table, max_size=1241)
+        self.assertEqual(len(bounds) - 1, 4)
+        self._check(table, bounds, max_size=1241)
+
+    def test_no_split_needed(self):
+        table = _table(100)
+        self.assertEqual(plan(table, max_duration=100), [0, 100])
+
+    def test_aligned_to_marks(self):
+        table = _table(3000)
+        bounds = plan(table, max_duration=40, marks=[1400], align=0.2)
+        self.assertEqual(bounds, [0, 1400, 3000])
+        #too far from the middle:
+        bounds = plan(table, max_duration=40, marks=[1000], align=0.2)
+        self.assertEqual(bounds, [0, 1500, 3000])
+
+
+if __name__ == "__main__":
+    unittest.main()
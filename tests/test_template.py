@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from bench.corpus import write_mp4
+from lib.template import TagTemplate, TemplateError
+
+DATA = {"title": "Part", "track no": 1, "tot tracks": 2, "artist": "Author"}
+
+
+class WriteTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.in_file = os.path.join(self.folder, "in.m4b")
+        self.out_file = os.path.join(self.folder, "out.m4b")
+        write_mp4(self.in_file, duration=30.0, chunks=10)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_write(self):
+        digest, size, moov = TagTemplate(DATA).write(DATA, self.in_file, self.out_file)
+        self.assertEqual(size, os.path.getsize(self.out_file))
+
+    def test_malformed_moov(self):
+        #an stco claiming far more entries than it has:
+        with open(self.in_file, "rb") as file:
+            buf = bytearray(file.read())
+        struct.pack_into(">I", buf, buf.index(b"stco") + 8, 10**6)
+        with open(self.in_file, "wb") as file:
+            file.write(buf)
+
+        with self.assertRaises(TemplateError):
+            TagTemplate(DATA).write(DATA, self.in_file, self.out_file)
+        self.assertFalse(os.path.exists(self.out_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
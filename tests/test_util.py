@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import mmap
+import shutil
+import tempfile
+import unittest
+
+from mutagenx._util import openfile, BufferFile
+
+
+class OpenFileTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "file")
+        with open(self.path, "wb") as file:
+            file.write(b"0123456789")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_filename(self):
+        with openfile(self.path) as file:
+            self.assertIsInstance(file, io.BufferedReader)
+            file.seek(-3, 2)
+            self.assertEqual(file.read(), b"789")
+        self.assertTrue(file.closed)
+
+    def test_buffers(self):
+        with open(self.path, "rb") as file:
+            file_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for buffer in (b"0123456789", bytearray(b"0123456789"), file_map):
+                with openfile(buffer) as file:
+                    file.seek(4)
+                    self.assertEqual(file.read(3), b"456")
+                    self.assertEqual(file.tell(), 7)
+        finally:
+            file_map.close()
+        with openfile(b"0123") as file:
+            self.assertIsInstance(file, BufferFile)
+
+    def test_file_object_left_open(self):
+        fileobj = io.BytesIO(b"0123456789")
+        fileobj.seek(5)
+        with openfile(fileobj) as file:
+            self.assertEqual(file.read(2), b"01")
+        self.assertFalse(fileobj.closed)
+
+    def test_buffer_not_writable(self):
+        with self.assertRaises(TypeError):
+            with openfile(b"0123", writable=True):
+                pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from bench.corpus import write_mp4
+from lib.template import TagTemplate
+from lib.verify import result
+
+DATA = {"title": "Part", "track no": 1, "tot tracks": 1}
+
+
+class ResultTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.source = os.path.join(self.folder, "source.m4b")
+        self.out_file = os.path.join(self.folder, "out.m4b")
+        write_mp4(self.source, duration=30.0, chunks=10)
+        self.written = TagTemplate(DATA).write(DATA, self.source, self.out_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_ok(self):
+        record = result(self.out_file, *self.written, False, self.source)
+        self.assertTrue(record["ok"], record["errors"])
+        self.assertEqual(record["samples"], record["source_samples"])
+
+    def test_unreadable_source(self):
+        with open(self.source, "wb") as file:
+            file.write(b"\x00\x00\x00\x08junk")
+        record = result(self.out_file, *self.written, False, self.source)
+        self.assertFalse(record["ok"])
+        self.assertTrue(record["errors"][0].startswith("unreadable source"))
+
+
+if __name__ == "__main__":
+    unittest.main()
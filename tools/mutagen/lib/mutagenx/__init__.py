@@ -65,6 +65,8 @@ class FileType(MutableMapping):
 
     * info -- stream information (length, bitrate, sample rate)
     * tags -- metadata tags, if any
+    * filename -- what the file was loaded from: a filename, a file
+      object or a buffer
 
     Each file format has different potential tags and stream
     information.
@@ -216,6 +218,10 @@ def File(filename, options=None, easy=False):
     bytes (which usually contains a file type identifier), the
     filename extension, and the presence of existing tags.
 
+    filename can also be a seekable file object or a buffer (bytes,
+    bytearray, mmap); the MP4, FLAC, Ogg and ID3 based types load
+    from those too.
+
     If no appropriate type could be found, None is returned.
 
     :param options: Sequence of :class:`FileType` implementations, defaults to
@@ -262,16 +268,16 @@ def File(filename, options=None, easy=False):
     if not options:
         return None
 
-    fileobj = open(filename, "rb")
-    try:
+    from mutagenx._util import openfile, filename_of
+
+    with openfile(filename) as fileobj:
         header = fileobj.read(128)
         # Sort by name after score. Otherwise import order affects
         # Kind sort order, which affects treatment of things with
         # equals scores.
-        results = [(Kind.score(filename, fileobj, header), Kind.__name__)
+        name = filename_of(filename)
+        results = [(Kind.score(name, fileobj, header), Kind.__name__)
                    for Kind in options]
-    finally:
-        fileobj.close()
     results = sorted(zip(results, options))
     (score, name), Kind = results[-1]
     if score > 0:
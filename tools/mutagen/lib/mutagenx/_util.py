@@ -14,8 +14,11 @@ You should not rely on the interfaces here being stable. They are
 intended for internal use in Mutagen only.
 """
 
+import os
+import errno
 import struct
 
+from contextlib import contextmanager
 from fnmatch import fnmatchcase
 
 from collections import OrderedDict
@@ -265,6 +268,116 @@ def delete_bytes(fobj, size, offset, BUFFER_SIZE=2**16):
             unlock(fobj)
 
 
+class BufferFile(object):
+    """A read-only, seekable file object over a buffer.
+
+    Anything supporting the buffer protocol works: bytes, bytearray,
+    memoryview or a mmap of a file. Every read copies the bytes it
+    returns out of the buffer, but a mapped file is read without a
+    system call per read.
+    """
+
+    def __init__(self, buffer, name=None):
+        self._view = memoryview(buffer).cast("B")
+        self._pos = 0
+        self.name = "<buffer>" if name is None else name
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = len(self._view)
+        else:
+            end = self._pos + size
+        data = self._view[self._pos:end].tobytes()
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += len(self._view)
+        elif whence != 0:
+            raise ValueError("invalid whence (%r)" % whence)
+        if offset < 0:
+            # the same error a real file gives
+            raise IOError(errno.EINVAL, "Invalid argument")
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def close(self):
+        self._view.release()
+
+
+def filename_of(filething):
+    """The file name of a filename or file object, '' if it has none."""
+
+    if isinstance(filething, (str, os.PathLike)):
+        return os.fspath(filething)
+    name = getattr(filething, "name", "")
+    return name if isinstance(name, str) else ""
+
+
+@contextmanager
+def openfile(filething, writable=False, create=False):
+    """Yields a seekable file object for a filename, file object or buffer.
+
+    * filething -- a filename (str or path-like), an open seekable file
+      object, or a buffer (bytes, bytearray, memoryview, mmap)
+    * writable -- the file object is opened for reading and writing;
+      buffers are read-only and raise TypeError
+    * create -- a missing file is created (only with writable)
+
+    Filenames are opened and closed here. File objects are rewound
+    to the start and left open. A caller that wants a file read
+    through a mapping passes the mmap as a buffer, and with it the
+    risk of a SIGBUS if the file is truncated while mapped.
+    """
+
+    if isinstance(filething, (str, os.PathLike)):
+        try:
+            fileobj = open(filething, "rb+" if writable else "rb")
+        except IOError as err:
+            if not (writable and create and err.errno == errno.ENOENT):
+                raise
+            open(filething, "ab").close()
+            fileobj = open(filething, "rb+")
+        try:
+            yield fileobj
+        finally:
+            fileobj.close()
+    elif hasattr(filething, "read"):
+        seekable = getattr(filething, "seekable", None)
+        if seekable is not None and not seekable():
+            raise ValueError("%r is not seekable" % filething)
+        filething.seek(0)
+        yield filething
+    else:
+        if writable:
+            raise TypeError("buffers are read-only, pass a filename or "
+                            "a file object to save")
+        try:
+            fileobj = BufferFile(filething)
+        except TypeError:
+            raise TypeError("expected a filename, file object or buffer, "
+                            "not %s" % type(filething).__name__) from None
+        try:
+            yield fileobj
+        finally:
+            fileobj.close()
+
+
 def utf8(data):
     """Converts anything resembling a string to UTF8-encoded bytes."""
 
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+"""Probe many files at once.
+
+probe() reads the stream information and a few tags of every file in
+a process pool and yields a small Record per file as soon as it is
+done, so a library of 100k files can be checked without keeping
+100k FileType objects (and their pictures) in memory::
+
+    from mutagenx.batch import probe, walk
+
+    for record in probe(walk(["/music"]), workers=8):
+        if record.error:
+            print(record.path, record.error)
+
+Run ``python -m mutagenx.batch <folder> ...`` for a health report of
+a whole library.
+"""
+
+__all__ = ["Record", "FIELDS", "probe", "probe_file", "walk", "Report"]
+
+import os
+import sys
+import json
+import argparse
+import itertools
+import concurrent.futures
+import concurrent.futures.process
+
+from mutagenx import File
+
+
+FIELDS = ("title", "artist", "album", "date", "genre", "tracknumber")
+"""Tags probe() collects unless told otherwise (easy interface keys)."""
+
+EXTENSIONS = (".mp3", ".m4a", ".m4b", ".mp4", ".flac", ".ogg", ".oga",
+              ".opus", ".spx", ".ogv", ".ape", ".wv", ".mpc", ".ofr",
+              ".ofs", ".tta", ".asf", ".wma", ".wmv")
+"""File extensions walk() picks up by default."""
+
+CHUNK_SIZE = 32
+"""Files a worker probes per task, to keep the number of messages low."""
+
+
+class Record(object):
+    """What probe() found out about one file.
+
+    Attributes:
+
+    * path -- the path that was probed
+    * format -- name of the FileType (MP4, FLAC, ...), None if the
+      file type is unknown or the file could not be read
+    * length -- length in seconds, as a float
+    * bitrate -- bitrate in bits per second, None if the format has none
+    * sample_rate -- sample rate in Hz, None if the format has none
+    * tags -- dict of the requested tags the file has, with lists of
+      strings as values; None if the file has no tags at all
+    * error -- "ExceptionName: message" if loading failed, else None
+    """
+
+    __slots__ = ("path", "format", "length", "bitrate", "sample_rate",
+                 "tags", "error")
+
+    def __init__(self, path, format=None, length=None, bitrate=None,
+                 sample_rate=None, tags=None, error=None):
+        self.path = path
+        self.format = format
+        self.length = length
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.tags = tags
+        self.error = error
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join(
+            "%s=%r" % (name, getattr(self, name)) for name in self.__slots__))
+
+    def __eq__(self, other):
+        if not isinstance(other, Record):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in self.__slots__)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def probe_file(path, fields=FIELDS):
+    """Probe a single file in this process, returns a Record.
+
+    Errors are never raised, they end up in Record.error.
+    """
+
+    try:
+        f = File(path, easy=True)
+    except KeyboardInterrupt:
+        raise
+    except Exception as err:
+        return Record(path, error="%s: %s" % (type(err).__name__, err))
+    if f is None:
+        return Record(path)
+
+    info = f.info
+    name = type(f).__name__
+    if name.startswith("Easy"):
+        name = name[4:]
+
+    tags = None
+    if f.tags is not None:
+        tags = {}
+        for field in fields:
+            try:
+                values = f.tags[field]
+            except (KeyError, ValueError):
+                continue
+            if not isinstance(values, list):
+                values = [values]
+            tags[field] = [str(value) for value in values]
+
+    return Record(path, name, getattr(info, "length", None),
+                  getattr(info, "bitrate", None),
+                  getattr(info, "sample_rate", None), tags)
+
+
+def _probe_chunk(paths, fields):
+    return [probe_file(path, fields) for path in paths]
+
+
+def _isolate(paths, fields):
+    """Probe paths one at a time in a pool of their own, a file its
+    worker dies on (a crash in a C extension, the OOM killer, ...)
+    gets an error Record and the pool is started again."""
+
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+    try:
+        for path in paths:
+            try:
+                records = pool.submit(_probe_chunk, [path], fields).result()
+            except concurrent.futures.process.BrokenProcessPool as err:
+                pool.shutdown(wait=False)
+                pool = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+                records = [Record(path, error="%s: %s" % (
+                    type(err).__name__, "the worker probing it died"))]
+            for record in records:
+                yield record
+    finally:
+        pool.shutdown()
+
+
+def probe(paths, fields=FIELDS, workers=None, chunk_size=CHUNK_SIZE):
+    """Probe paths in a process pool, yields a Record per file.
+
+    Records come back in the order files finish, not in the order of
+    paths. paths may be any iterable (see walk()); it is consumed
+    lazily, only a few chunks per worker are in flight at any time.
+
+    A worker that dies takes the pool and every chunk in it down;
+    the files of those chunks are probed again one at a time, the
+    ones that kill a worker again get an error Record, and the rest
+    continue in a new pool.
+
+    * fields -- tags to collect, as keys of the easy interfaces
+    * workers -- number of processes, os.cpu_count() if None; with
+      0 or 1 the files are probed in this process
+    """
+
+    fields = tuple(fields)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for path in paths:
+            yield probe_file(path, fields)
+        return
+
+    paths = iter(paths)
+    chunks = iter(lambda: list(itertools.islice(paths, chunk_size)), [])
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        # future -> its chunk
+        pending = {}
+        while True:
+            for chunk in itertools.islice(chunks, workers * 4 - len(pending)):
+                pending[pool.submit(_probe_chunk, chunk, fields)] = chunk
+            if not pending:
+                break
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            suspects = []
+            for future in done:
+                chunk = pending.pop(future)
+                try:
+                    records = future.result()
+                except concurrent.futures.process.BrokenProcessPool:
+                    suspects.extend(chunk)
+                    continue
+                for record in records:
+                    yield record
+            if suspects:
+                for chunk in pending.values():
+                    suspects.extend(chunk)
+                pending = {}
+                pool.shutdown(wait=False)
+                for record in _isolate(suspects, fields):
+                    yield record
+                pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers)
+    finally:
+        pool.shutdown()
+
+
+def walk(paths, extensions=EXTENSIONS):
+    """Yields the files in paths, descending into folders.
+
+    Files inside folders are only yielded if their extension is one
+    of extensions (all files if None); files given directly always are.
+    """
+
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if (extensions is None or
+                        os.path.splitext(name)[1].lower() in extensions):
+                    yield os.path.join(root, name)
+
+
+class Report(object):
+    """Summary of many Records, see add() and str()."""
+
+    def __init__(self, fields=FIELDS):
+        self.fields = tuple(fields)
+        self.files = 0
+        self.unknown = 0
+        self.untagged = 0
+        self.length = 0.0
+        self.formats = {}
+        self.exceptions = {}
+        self.missing = dict.fromkeys(self.fields, 0)
+        self.errors = []
+
+    def add(self, record):
+        self.files += 1
+        if record.error is not None:
+            kind = record.error.split(":", 1)[0]
+            self.exceptions[kind] = self.exceptions.get(kind, 0) + 1
+            self.errors.append((record.path, record.error))
+            return
+        if record.format is None:
+            self.unknown += 1
+            return
+
+        self.formats[record.format] = self.formats.get(record.format, 0) + 1
+        self.length += record.length or 0.0
+        if record.tags is None:
+            self.untagged += 1
+        for field in self.fields:
+            if not record.tags or field not in record.tags:
+                self.missing[field] += 1
+
+    def __str__(self):
+        if self.files == 0:
+            return "No files found."
+
+        loaded = sum(self.formats.values())
+        strings = ["Loaded %d/%d files (%d%%), %.1f hours" % (
+            loaded, self.files, loaded * 100 // self.files,
+            self.length / 3600)]
+        strings.append("%d files of unknown type." % self.unknown)
+        strings.append("%d files without tags." % self.untagged)
+
+        strings.append("\nFormats:")
+        for name, count in sorted(self.formats.items()):
+            strings.append("  %-20s\t%d" % (name, count))
+
+        if loaded:
+            strings.append("\nMissing tags:")
+            for field in self.fields:
+                strings.append("  %-20s\t%d" % (field, self.missing[field]))
+
+        if self.exceptions:
+            strings.append("\nExceptions:")
+            for name, count in sorted(self.exceptions.items()):
+                strings.append("  %-20s\t%d" % (name, count))
+            strings.append("\nERRORS:\n")
+            for path, error in self.errors:
+                strings.append("%s: %s" % (path, error))
+        else:
+            strings.append("\nNo errors!")
+
+        return "\n".join(strings)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="mutagen-probe",
+        description="Read every audio file below the given paths and "
+                    "report on the health of the library.")
+    parser.add_argument("paths", nargs="+", metavar="path",
+                        help="files or folders to probe")
+    parser.add_argument("-f", "--fields", default=",".join(FIELDS),
+                        help="comma separated tags to check "
+                             "(default: %(default)s)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="processes to use (default: one per CPU)")
+    parser.add_argument("--all-files", action="store_true",
+                        help="probe every file in folders, not just "
+                             "known audio extensions")
+    parser.add_argument("--json", action="store_true",
+                        help="print one JSON record per file instead "
+                             "of a report")
+    args = parser.parse_args(argv[1:])
+
+    fields = [field.strip() for field in args.fields.split(",")
+              if field.strip()]
+    paths = walk(args.paths, None if args.all_files else EXTENSIONS)
+    report = Report(fields)
+    for record in probe(paths, fields, args.workers):
+        report.add(record)
+        if args.json:
+            print(json.dumps(record.as_dict(), ensure_ascii=False))
+
+    if not args.json:
+        print(report)
+    return 1 if report.exceptions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
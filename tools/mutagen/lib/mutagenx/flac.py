@@ -28,8 +28,9 @@ import struct
 from io import BytesIO
 from mutagenx._vorbis import VComment
 from mutagenx import FileType
-from mutagenx._util import insert_bytes
+from mutagenx._util import insert_bytes, delete_bytes, openfile
 from mutagenx.id3 import BitPaddedInt
+from mutagenx.padding import PaddingInfo, choose
 
 from functools import reduce
 
@@ -72,6 +73,128 @@ class StrictFileObject(object):
         return self._fileobj.read(*args)
 
 
+class BufferedBlockReader(StrictFileObject):
+    """Reads the metadata blocks at the start of a file in as few
+    reads as possible.
+
+    The first read fetches BUFFER_SIZE bytes, which holds all the
+    blocks of most files. Reading past the buffer refills it with
+    one more read, and data larger than the buffer (pictures) is
+    read directly, so a file costs a few reads instead of several
+    small ones per block. Block headers are parsed from a memoryview
+    of the buffer; the file position of the wrapped object is
+    undefined afterwards.
+    """
+
+    def __init__(self, fileobj, BUFFER_SIZE=2**16):
+        self._fileobj = fileobj
+        self._buffer_size = BUFFER_SIZE
+        self.name = getattr(fileobj, "name", "<fileobj>")
+        self.__reset(fileobj.tell())
+
+    def __reset(self, offset):
+        self._start = offset
+        self._buffer = b""
+        self._view = memoryview(self._buffer)
+        self._pos = 0
+        self._eof = False
+
+    def __fill(self, size):
+        """Buffer size bytes after the current position, if there are.
+
+        A negative size buffers everything up to the end of the file.
+        """
+        available = len(self._buffer) - self._pos
+        if (0 <= size <= available) or self._eof:
+            return
+        self._fileobj.seek(self._start + len(self._buffer))
+        if size < 0:
+            data = self._fileobj.read()
+            self._eof = True
+        else:
+            amount = max(size - available, self._buffer_size)
+            data = self._fileobj.read(amount)
+            self._eof = len(data) < amount
+        # Drop what was read already, the buffer only ever moves on.
+        self._buffer = self._buffer[self._pos:] + data
+        self._view = memoryview(self._buffer)
+        self._start += self._pos
+        self._pos = 0
+
+    def tryread(self, size=-1):
+        if size is None:
+            size = -1
+        available = len(self._buffer) - self._pos
+        if size - available > self._buffer_size:
+            # Too large to buffer, like picture data: read it directly,
+            # joining it to the buffered part would copy it once more.
+            offset = self.tell()
+            self._fileobj.seek(offset)
+            data = self._fileobj.read(size)
+            self.__reset(offset + len(data))
+            return data
+        self.__fill(size)
+        end = len(self._buffer) if size < 0 else self._pos + size
+        data = self._buffer[self._pos:end]
+        self._pos += len(data)
+        return data
+
+    def read(self, size=-1):
+        data = self.tryread(size)
+        if size is not None and size >= 0 and len(data) != size:
+            raise error("file said %d bytes, read %d bytes" % (
+                        size, len(data)))
+        return data
+
+    def read_header(self):
+        """Return (code byte, size) of the next metadata block."""
+        self.__fill(4)
+        if len(self._buffer) - self._pos < 4:
+            raise error("unable to read block header at %d" % self.tell())
+        header = self._view[self._pos:self._pos + 4]
+        self._pos += 4
+        return header[0], int.from_bytes(header[1:], "big")
+
+    def parse(self, block_type, size):
+        """Parse a block whose size field can't be trusted.
+
+        The block is parsed from the buffer in memory and the reader
+        moved past what it actually used. Blocks larger than the
+        buffer (or larger than they claim) are read through self.
+        """
+        if size > self._buffer_size:
+            return block_type(self)
+        self.__fill(size)
+        data = BytesIO(self._buffer)
+        data.seek(self._pos)
+        try:
+            block = block_type(data)
+        except error:
+            if self._eof:
+                raise
+            return block_type(self)
+        self._pos = data.tell()
+        return block
+
+    def skip(self, size):
+        """Move past size bytes without reading them."""
+        self.seek(size, 1)
+
+    def tell(self):
+        return self._start + self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.tell()
+        elif whence == 2:
+            self._fileobj.seek(offset, 2)
+            offset = self._fileobj.tell()
+        if self._start <= offset <= self._start + len(self._buffer):
+            self._pos = offset - self._start
+        else:
+            self.__reset(offset)
+
+
 class MetadataBlock(object):
     """A generic block of FLAC metadata.
 
@@ -111,7 +234,7 @@ class MetadataBlock(object):
         codes = [[block.code, block.write()] for block in blocks]
         codes[-1][0] |= 128
         for byte, datum in codes:
-            if len(datum) > 2 ** 24:
+            if len(datum) > 2 ** 24 - 1:
                 raise error("block is too long to write")
             length = struct.pack(">I", len(datum))[-3:]
             data.append(bytes((byte,)) + length + datum)
@@ -623,8 +746,7 @@ class FLAC(FileType):
                 filename.lower().endswith(".flac") * 3)
 
     def __read_metadata_block(self, fileobj):
-        byte = fileobj.read(1)[0]
-        size = to_int_be(fileobj.read(3))
+        byte, size = fileobj.read_header()
         code = byte & 0x7F
         last_block = bool(byte & 0x80)
 
@@ -643,7 +765,7 @@ class FLAC(FileType):
             # http://code.google.com/p/mutagen/issues/detail?id=52
             # ..same for the Picture block:
             # http://code.google.com/p/mutagen/issues/detail?id=106
-            block = block_type(fileobj)
+            block = fileobj.parse(block_type, size)
         else:
             data = fileobj.read(size)
             block = block_type(data)
@@ -688,26 +810,31 @@ class FLAC(FileType):
             if isinstance(s, VCFLACDict):
                 self.metadata_blocks.remove(s)
                 self.tags = None
-                self.save()
+                self.save(filename)
                 break
 
     vc = property(lambda s: s.tags, doc="Alias for tags; don't use this.")
 
-    def load(self, filename):
-        """Load file information from a filename."""
+    def load(self, filename, info_only=False):
+        """Load file information from a filename, file object or buffer.
+
+        With info_only the stream information is read and all other
+        blocks (tags, pictures, ...) are skipped.
+        """
 
         self.metadata_blocks = []
         self.tags = None
         self.cuesheet = None
         self.seektable = None
         self.filename = filename
-        fileobj = StrictFileObject(open(filename, "rb"))
-        try:
+        # The stream info is the first block and 34 bytes long.
+        with openfile(filename) as fileobj:
+            fileobj = BufferedBlockReader(fileobj,
+                                          2**12 if info_only else 2**16)
             self.__check_header(fileobj)
             while self.__read_metadata_block(fileobj):
-                pass
-        finally:
-            fileobj.close()
+                if info_only:
+                    break
 
         try:
             self.metadata_blocks[0].length
@@ -732,51 +859,49 @@ class FLAC(FileType):
         """List of embedded pictures"""
         return [b for b in self.metadata_blocks if b.code == Picture.code]
 
-    def save(self, filename=None, deleteid3=False):
+    def save(self, filename=None, deleteid3=False, padding=None):
         """Save metadata blocks to a file.
 
         If no filename is given, the one most recently loaded is used.
+        A file object opened for reading and writing can be given too.
+
+        padding is the policy that decides the size of the padding
+        block, see mutagenx.padding.
         """
 
         if filename is None:
             filename = self.filename
-        f = open(filename, 'rb+')
-
-        try:
-            # Ensure we've got padding at the end, and only at the end.
-            # If adding makes it too large, we'll scale it down later.
-            self.metadata_blocks.append(Padding(b'\x00' * 1020))
-            MetadataBlock.group_padding(self.metadata_blocks)
+        with openfile(filename, writable=True) as f:
+            # Padding goes at the end, and only there; its size is up
+            # to the policy.
+            self.metadata_blocks = [b for b in self.metadata_blocks
+                                    if not isinstance(b, Padding)]
 
             header = self.__check_header(f)
             # "fLaC" and maybe ID3
-            available = self.__find_audio_offset(f) - header
-            data = MetadataBlock.writeblocks(self.metadata_blocks)
+            end, had_tags = self.__find_audio_offset(f)
+            available = end - header
 
             # Delete ID3v2
             if deleteid3 and header > 4:
                 available += header - 4
                 header = 4
 
-            if len(data) > available:
-                # If we have too much data, see if we can reduce padding.
-                padding = self.metadata_blocks[-1]
-                newlength = padding.length - (len(data) - available)
-                if newlength > 0:
-                    padding.length = newlength
-                    data = MetadataBlock.writeblocks(self.metadata_blocks)
-                    assert len(data) == available
+            f.seek(0, 2)
+            # the padding block header is 4 bytes
+            content = len(MetadataBlock.writeblocks(self.metadata_blocks)) + 4
+            info = PaddingInfo(available - content, f.tell(),
+                               new=not had_tags)
+            self.metadata_blocks.append(Padding())
+            # the block length has 24 bits, whatever the policy says
+            self.metadata_blocks[-1].length = min(choose(info, padding),
+                                                  2 ** 24 - 1)
+            data = MetadataBlock.writeblocks(self.metadata_blocks)
 
+            if len(data) > available:
+                insert_bytes(f, len(data) - available, header)
             elif len(data) < available:
-                # If we have too little data, increase padding.
-                self.metadata_blocks[-1].length += (available - len(data))
-                data = MetadataBlock.writeblocks(self.metadata_blocks)
-                assert len(data) == available
-
-            if len(data) != available:
-                # We couldn't reduce the padding enough.
-                diff = (len(data) - available)
-                insert_bytes(f, diff, header)
+                delete_bytes(f, available - len(data), header)
 
             f.seek(header - 4)
             f.write(b"fLaC" + data)
@@ -791,14 +916,15 @@ class FLAC(FileType):
                     if f.read(3) == b"TAG":
                         f.seek(-128, 2)
                         f.truncate()
-        finally:
-            f.close()
 
     def __find_audio_offset(self, fileobj):
+        """Offset of the audio and whether there was a Vorbis comment."""
+        fileobj = BufferedBlockReader(fileobj)
         byte = 0x00
+        had_tags = False
         while not (byte & 0x80):
-            byte = fileobj.read(1)[0]
-            size = to_int_be(fileobj.read(3))
+            byte, size = fileobj.read_header()
+            had_tags = had_tags or (byte & 0x7F) == VCFLACDict.code
             try:
                 block_type = self.METADATA_BLOCKS[byte & 0x7F]
             except IndexError:
@@ -807,10 +933,10 @@ class FLAC(FileType):
             if block_type and block_type._distrust_size:
                 # See comments in read_metadata_block; the size can't
                 # be trusted for Vorbis comment blocks and Picture block
-                block_type(fileobj)
+                fileobj.parse(block_type, size)
             else:
-                fileobj.read(size)
-        return fileobj.tell()
+                fileobj.skip(size)
+        return fileobj.tell(), had_tags
 
     def __check_header(self, fileobj):
         size = 4
@@ -824,7 +950,8 @@ class FLAC(FileType):
                     size = None
         if size is None:
             raise FLACNoHeaderError(
-                "%r is not a valid FLAC file" % fileobj.name)
+                "%r is not a valid FLAC file" %
+                getattr(fileobj, "name", "<fileobj>"))
         return size
 
 
@@ -44,7 +44,9 @@ import functools
 import os.path
 
 import mutagenx
-from mutagenx._util import insert_bytes, delete_bytes, DictProxy
+from mutagenx._util import insert_bytes, delete_bytes, DictProxy, openfile, \
+    filename_of
+from mutagenx.padding import PaddingInfo, choose
 
 from mutagenx._id3util import *
 from mutagenx._id3frames import *
@@ -87,7 +89,8 @@ class ID3(DictProxy, mutagenx.Metadata):
                 raise ValueError('Requested bytes (%s) less than zero' % size)
             if size > self.__filesize:
                 raise EOFError('Requested %#x of %#x (%s)' % (
-                    int(size), int(self.__filesize), self.filename))
+                    int(size), int(self.__filesize),
+                    filename_of(self.filename) or "<fileobj>"))
         except AttributeError:
             pass
         data = self.__fileobj.read(size)
@@ -101,7 +104,7 @@ class ID3(DictProxy, mutagenx.Metadata):
 
         Keyword arguments:
 
-        * filename -- filename to load tag data from
+        * filename -- filename, file object or buffer to load tag data from
         * known_frames -- dict mapping frame IDs to Frame objects
         * translate -- Update all tags to ID3v2.3/4 internally. If you
                        intend to save, this must be true or you have to
@@ -119,58 +122,58 @@ class ID3(DictProxy, mutagenx.Metadata):
         if not v2_version in (3, 4):
             raise ValueError("Only 3 and 4 possible for v2_version")
 
-        from os.path import getsize
-
         self.filename = filename
         self.__known_frames = known_frames
-        self.__fileobj = open(filename, 'rb')
-        self.__filesize = os.path.getsize(filename)
-        try:
+        with openfile(filename) as fileobj:
+            self.__fileobj = fileobj
+            fileobj.seek(0, 2)
+            self.__filesize = fileobj.tell()
+            fileobj.seek(0)
             try:
-                self.__load_header()
-            except EOFError:
-                self.size = 0
-                raise ID3NoHeaderError("%s: too small (%d bytes)" % (
-                    filename, self.__filesize))
-            except (ID3NoHeaderError, ID3UnsupportedVersionError) as err:
-                self.size = 0
-                import sys
-                stack = sys.exc_info()[2]
                 try:
-                    self.__fileobj.seek(-128, 2)
-                except EnvironmentError:
-                    raise err.with_traceback(stack)
-                else:
-                    frames = ParseID3v1(self.__fileobj.read(128))
-                    if frames is not None:
-                        self.version = self._V11
-                        for f in frames.values():
-                            self.add(f)
-                    else:
+                    self.__load_header()
+                except EOFError:
+                    self.size = 0
+                    raise ID3NoHeaderError("%s: too small (%d bytes)" % (
+                        filename_of(filename) or "<fileobj>", self.__filesize))
+                except (ID3NoHeaderError, ID3UnsupportedVersionError) as err:
+                    self.size = 0
+                    import sys
+                    stack = sys.exc_info()[2]
+                    try:
+                        self.__fileobj.seek(-128, 2)
+                    except EnvironmentError:
                         raise err.with_traceback(stack)
-            else:
-                frames = self.__known_frames
-                if frames is None:
-                    if self._V23 <= self.version:
-                        frames = Frames
-                    elif self._V22 <= self.version:
-                        frames = Frames_2_2
-                data = self.__fullread(self.size - 10)
-                for frame in self.__read_frames(data, frames=frames):
-                    if isinstance(frame, Frame):
-                        self.add(frame)
                     else:
-                        self.unknown_frames.append(frame)
-                self.__unknown_version = self.version
-        finally:
-            self.__fileobj.close()
-            del self.__fileobj
-            del self.__filesize
-            if translate:
-                if v2_version == 3:
-                    self.update_to_v23()
+                        frames = ParseID3v1(self.__fileobj.read(128))
+                        if frames is not None:
+                            self.version = self._V11
+                            for f in frames.values():
+                                self.add(f)
+                        else:
+                            raise err.with_traceback(stack)
                 else:
-                    self.update_to_v24()
+                    frames = self.__known_frames
+                    if frames is None:
+                        if self._V23 <= self.version:
+                            frames = Frames
+                        elif self._V22 <= self.version:
+                            frames = Frames_2_2
+                    data = self.__fullread(self.size - 10)
+                    for frame in self.__read_frames(data, frames=frames):
+                        if isinstance(frame, Frame):
+                            self.add(frame)
+                        else:
+                            self.unknown_frames.append(frame)
+                    self.__unknown_version = self.version
+            finally:
+                del self.__fileobj
+                del self.__filesize
+                if translate:
+                    if v2_version == 3:
+                        self.update_to_v23()
+                    else:
+                        self.update_to_v24()
 
     def getall(self, key):
         """Return all frames with a given name (the list may be empty).
@@ -237,7 +240,7 @@ class ID3(DictProxy, mutagenx.Metadata):
         return self.loaded_frame(frame)
 
     def __load_header(self):
-        fn = self.filename
+        fn = filename_of(self.filename) or "<fileobj>"
         data = self.__fullread(10)
         id3, vmaj, vrev, flags, size = unpack('>3sBBB4s', data)
         self.__flags = flags
@@ -410,7 +413,8 @@ class ID3(DictProxy, mutagenx.Metadata):
 
     #f_crc = property(lambda s: bool(s.__extflags & 0x8000))
 
-    def save(self, filename=None, v1=1, v2_version=4, v23_sep='/'):
+    def save(self, filename=None, v1=1, v2_version=4, v23_sep='/',
+             padding=None):
         """Save changes to a file.
 
         If no filename is given, the one most recently loaded is used.
@@ -427,6 +431,8 @@ class ID3(DictProxy, mutagenx.Metadata):
         v23_sep -- the separator used to join multiple text values
                    if v2_version == 3. Defaults to '/' but if it's None
                    will be the ID3v2v2.4 null separator.
+        padding -- policy deciding how much padding follows the frames,
+                   see mutagenx.padding.
 
         The lack of a way to update only an ID3v1 tag is intentional.
         """
@@ -467,15 +473,7 @@ class ID3(DictProxy, mutagenx.Metadata):
 
         if filename is None:
             filename = self.filename
-        try:
-            f = open(filename, 'rb+')
-        except IOError as err:
-            from errno import ENOENT
-            if err.errno != ENOENT:
-                raise
-            f = open(filename, 'ab')  # create, then reopen
-            f = open(filename, 'rb+')
-        try:
+        with openfile(filename, writable=True, create=True) as f:
             idata = f.read(10)
             try:
                 id3, vmaj, vrev, flags, insize = unpack('>3sBBB4s', idata)
@@ -483,13 +481,14 @@ class ID3(DictProxy, mutagenx.Metadata):
                 id3, insize = b'', 0
 
             insize = BitPaddedInt(insize)
-            if id3 != b'ID3':
+            new = id3 != b'ID3'
+            if new:
                 insize = -10
 
-            if insize >= framesize:
-                outsize = insize
-            else:
-                outsize = (framesize + 1023) & ~0x3FF
+            f.seek(0, 2)
+            info = PaddingInfo(-1 if new else insize - framesize, f.tell(),
+                               new=new)
+            outsize = framesize + choose(info, padding)
             framedata += b'\x00' * (outsize - framesize)
 
             framesize = BitPaddedInt.to_bytes(outsize, width=4)
@@ -499,6 +498,8 @@ class ID3(DictProxy, mutagenx.Metadata):
 
             if (insize < outsize):
                 insert_bytes(f, outsize-insize, insize+10)
+            elif (insize > outsize):
+                delete_bytes(f, insize-outsize, outsize+10)
             f.seek(0)
             f.write(data)
 
@@ -530,9 +531,6 @@ class ID3(DictProxy, mutagenx.Metadata):
             else:
                 f.truncate()
 
-        finally:
-            f.close()
-
     def delete(self, filename=None, delete_v1=True, delete_v2=True):
         """Remove tags from a file.
 
@@ -737,30 +735,29 @@ def delete(filename, delete_v1=True, delete_v2=True):
     * delete_v2 -- delete any ID3v2 tag
     """
 
-    f = open(filename, 'rb+')
-
-    if delete_v1:
-        try:
-            f.seek(-128, 2)
-        except IOError:
-            pass
-        else:
-            if f.read(3) == b'TAG':
+    with openfile(filename, writable=True) as f:
+        if delete_v1:
+            try:
                 f.seek(-128, 2)
-                f.truncate()
-
-    # technically an insize=0 tag is invalid, but we delete it anyway
-    # (primarily because we used to write it)
-    if delete_v2:
-        f.seek(0, 0)
-        idata = f.read(10)
-        try:
-            id3, vmaj, vrev, flags, insize = unpack('>3sBBB4s', idata)
-        except struct.error:
-            id3, insize = b'', -1
-        insize = BitPaddedInt(insize)
-        if id3 == b'ID3' and insize >= 0:
-            delete_bytes(f, insize + 10, 0)
+            except IOError:
+                pass
+            else:
+                if f.read(3) == b'TAG':
+                    f.seek(-128, 2)
+                    f.truncate()
+
+        # technically an insize=0 tag is invalid, but we delete it anyway
+        # (primarily because we used to write it)
+        if delete_v2:
+            f.seek(0, 0)
+            idata = f.read(10)
+            try:
+                id3, vmaj, vrev, flags, insize = unpack('>3sBBB4s', idata)
+            except struct.error:
+                id3, insize = b'', -1
+            insize = BitPaddedInt(insize)
+            if id3 == b'ID3' and insize >= 0:
+                delete_bytes(f, insize + 10, 0)
 
 
 # support open(filename) as interface
@@ -932,8 +929,5 @@ class ID3FileType(mutagenx.FileType):
                 offset = None
         else:
             offset = None
-        try:
-            fileobj = open(filename, "rb")
+        with openfile(filename) as fileobj:
             self.info = self._Info(fileobj, offset)
-        finally:
-            fileobj.close()
@@ -25,12 +25,19 @@ c041828_ISO_IEC_14496-12_2005(E).zip
 were all consulted.
 """
 
-import struct
+import os
 import sys
+import array
+import struct
+import bisect
+import itertools
+import operator
 
 from mutagenx import FileType, Metadata
 from mutagenx._constants import GENRES
-from mutagenx._util import cdata, insert_bytes, delete_bytes, DictProxy, utf8
+from mutagenx.padding import PaddingInfo, choose
+from mutagenx._util import cdata, insert_bytes, delete_bytes, DictProxy, utf8, \
+    openfile
 
 
 class error(IOError):
@@ -110,9 +117,10 @@ class Atom(object):
     This structure should only be used internally by Mutagen.
     """
 
-    children = None
+    __slots__ = ("children", "length", "name", "offset")
 
     def __init__(self, fileobj, level=0):
+        self.children = None
         self.offset = fileobj.tell()
         self.length, self.name = struct.unpack(">I4s", fileobj.read(8))
         if self.length == 1:
@@ -245,6 +253,222 @@ class Atoms(object):
         return '\n'.join(repr(child) for child in self.atoms)
 
 
+class AtomIndex(object):
+    """Name, offset, length and parent of every atom of a file.
+
+    A flat alternative to walking the file with Atoms: built in one
+    pass over the atom headers into arrays, saved and loaded again
+    as long as the file did not change (inode, size and mtime are
+    stored with it), and turned into an Atoms tree without reading
+    the file. Fragmented files with thousands of moof/mdat pairs
+    are opened again without another walk.
+
+    Attributes:
+
+    * inode, size, mtime -- of the indexed file, mtime in nanoseconds
+    * names, offsets, lengths, parents -- arrays, one entry per atom in
+      file order; names hold the four bytes as a big endian integer,
+      parents the number of the parent atom or -1 for top-level atoms
+    """
+
+    MAGIC = b"MP4I"
+    VERSION = 1
+    _HEADER = struct.Struct("<4sBQQQI")
+
+    def __init__(self, inode=0, size=0, mtime=0):
+        self.inode = inode
+        self.size = size
+        self.mtime = mtime
+        self.names = array.array("I")
+        self.offsets = array.array("Q")
+        self.lengths = array.array("Q")
+        self.parents = array.array("i")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def build(cls, fileobj, BUFFER_SIZE=2**16):
+        """Index every atom of fileobj, the same ones Atoms finds."""
+
+        fileobj.seek(0, 2)
+        index = cls(size=fileobj.tell())
+        try:
+            stat = os.fstat(fileobj.fileno())
+        except (AttributeError, OSError, ValueError):
+            pass
+        else:
+            index.inode = stat.st_ino
+            index.mtime = stat.st_mtime_ns
+
+        containers = set(cdata.uint_be(name) for name in _CONTAINERS)
+        skip = {cdata.uint_be(name): size for name, size in _SKIP_SIZE.items()}
+        data = b""
+        start = 0
+        offset = 0
+        # (number, end) of the containers offset is in
+        stack = []
+        while True:
+            while stack and offset >= stack[-1][1]:
+                stack.pop()
+            if not stack and offset + 8 > index.size:
+                break
+
+            if not (start <= offset and offset + 16 <= start + len(data)):
+                fileobj.seek(offset)
+                data = fileobj.read(BUFFER_SIZE)
+                start = offset
+            pos = offset - start
+            length, name = struct.unpack(">II", data[pos:pos + 8])
+            header = 8
+            if length == 1:
+                length, = struct.unpack(">Q", data[pos + 8:pos + 16])
+                header = 16
+                if length < 16:
+                    raise MP4MetadataError(
+                        "64 bit atom length can only be 16 and higher")
+            elif length == 0:
+                if stack:
+                    raise MP4MetadataError(
+                        "only a top-level atom can have zero length")
+                length = index.size - offset
+            elif length < 8:
+                raise MP4MetadataError(
+                    "atom length can only be 0, 1 or 8 and higher")
+
+            number = len(index)
+            index.names.append(name)
+            index.offsets.append(offset)
+            index.lengths.append(length)
+            index.parents.append(stack[-1][0] if stack else -1)
+            if name in containers:
+                stack.append((number, offset + length))
+                offset += header + skip.get(name, 0)
+            else:
+                offset += length
+        return index
+
+    def atoms(self, top=None):
+        """The Atoms tree of the indexed file.
+
+        With top, a list of names, only the top-level atoms with one
+        of those names get their children; the children of all other
+        top-level atoms (say a few thousand moof) are left out.
+        """
+
+        if top is not None:
+            top = set(top)
+        atoms = Atoms.__new__(Atoms)
+        atoms.atoms = []
+        # the Atom of every atom number, None for left out ones
+        nodes = []
+        for name, offset, length, parent in zip(
+                self.names, self.offsets, self.lengths, self.parents):
+            if parent >= 0 and nodes[parent] is None:
+                nodes.append(None)
+                continue
+            atom = Atom.__new__(Atom)
+            atom.name = name.to_bytes(4, "big")
+            atom.offset = offset
+            atom.length = length
+            atom.children = [] if atom.name in _CONTAINERS else None
+            if parent < 0:
+                atoms.atoms.append(atom)
+                if top is not None and atom.name not in top:
+                    nodes.append(None)
+                    continue
+            else:
+                nodes[parent].children.append(atom)
+            nodes.append(atom)
+        return atoms
+
+    def is_current(self, inode, size, mtime):
+        return (self.inode, self.size, self.mtime) == (inode, size, mtime)
+
+    def save(self, path):
+        """Write the index to path."""
+
+        columns = [self.names, self.offsets, self.lengths, self.parents]
+        if sys.byteorder != "little":
+            columns = [array.array(c.typecode, c) for c in columns]
+            for column in columns:
+                column.byteswap()
+        with open(path, "wb") as fileobj:
+            fileobj.write(self._HEADER.pack(self.MAGIC, self.VERSION,
+                                            self.inode, self.size,
+                                            self.mtime, len(self)))
+            for column in columns:
+                fileobj.write(column.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save, raises error if it is invalid."""
+
+        with open(path, "rb") as fileobj:
+            header = fileobj.read(cls._HEADER.size)
+            try:
+                magic, version, inode, size, mtime, count = \
+                    cls._HEADER.unpack(header)
+            except struct.error:
+                raise error("truncated index %r" % path)
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise error("%r is not an atom index" % path)
+            index = cls(inode, size, mtime)
+            for column in (index.names, index.offsets, index.lengths,
+                           index.parents):
+                data = fileobj.read(count * column.itemsize)
+                if len(data) != count * column.itemsize:
+                    raise error("truncated index %r" % path)
+                column.frombytes(data)
+                if sys.byteorder != "little":
+                    column.byteswap()
+        return index
+
+    @staticmethod
+    def store_path(store, stat):
+        """Where the index of a file with os.stat() result stat lives
+        in the directory store."""
+
+        return os.path.join(store, "%x-%x-%x-%x.atoms" % (
+            stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns))
+
+    @classmethod
+    def for_file(cls, filename, path=None, store=None):
+        """The index of filename, loaded from path if it is still
+        current, otherwise built (and saved to path if given).
+
+        Instead of a path a store directory shared by many files can
+        be given; indexes in it are named after the device, inode,
+        size and mtime of their file, so a changed file gets a new one.
+        """
+
+        stat = os.stat(filename)
+        if path is None and store is not None:
+            path = cls.store_path(store, stat)
+        if path is not None:
+            try:
+                index = cls.load(path)
+            except (IOError, error):
+                pass
+            else:
+                if index.is_current(stat.st_ino, stat.st_size,
+                                    stat.st_mtime_ns):
+                    return index
+        with openfile(filename) as fileobj:
+            index = cls.build(fileobj)
+        # What was read is what stat saw, not what the file is now.
+        index.inode = stat.st_ino
+        index.mtime = stat.st_mtime_ns
+        if path is not None:
+            try:
+                if store is not None:
+                    os.makedirs(store, exist_ok=True)
+                index.save(path)
+            except IOError:
+                pass
+        return index
+
+
 class MP4Tags(DictProxy, Metadata):
     r"""Dictionary containing Apple iTunes metadata list key/values.
 
@@ -359,8 +583,12 @@ class MP4Tags(DictProxy, Metadata):
         return (order.get(key[:4], last), length, v)
 
 
-    def save(self, filename):
-        """Save the metadata to the given filename."""
+    def save(self, filename, padding=None):
+        """Save the metadata to the given filename or file object.
+
+        padding is the policy that decides the size of the 'free'
+        atom after the ilst, see mutagenx.padding.
+        """
         values = []
         items = sorted(self.items(), key=MP4Tags.__get_sort_stats )
         for key, value in items:
@@ -372,27 +600,29 @@ class MP4Tags(DictProxy, Metadata):
         data = Atom.render(b"ilst", b"".join(values))
 
         # Find the old atoms.
-        fileobj = open(filename, "rb+")
-        try:
+        with openfile(filename, writable=True) as fileobj:
             atoms = Atoms(fileobj)
+            fileobj.seek(0, 2)
+            size = fileobj.tell()
             try:
                 path = atoms.path(b"moov", b"udta", b"meta", b"ilst")
             except KeyError:
-                self.__save_new(fileobj, atoms, data)
+                self.__save_new(fileobj, atoms, data, size, padding)
             else:
-                self.__save_existing(fileobj, atoms, path, data)
-        finally:
-            fileobj.close()
+                self.__save_existing(fileobj, atoms, path, data, size,
+                                     padding)
 
-    def __pad_ilst(self, data, length=None):
-        if length is None:
-            length = ((len(data) + 1023) & ~1023) - len(data)
+    def __pad_ilst(self, length):
+        """A 'free' atom with length bytes of padding, nothing if 0."""
+        if not length:
+            return b""
         return Atom.render(b"free", b"\x00" * length)
 
-    def __save_new(self, fileobj, atoms, ilst):
+    def __save_new(self, fileobj, atoms, ilst, size, padding):
         hdlr = Atom.render(b"hdlr", b"\x00" * 8 + b"mdirappl" + b"\x00" * 9)
+        length = choose(PaddingInfo(-1, size, new=True), padding)
         meta = Atom.render(
-            b"meta", b"\x00\x00\x00\x00" + hdlr + ilst + self.__pad_ilst(ilst))
+            b"meta", b"\x00\x00\x00\x00" + hdlr + ilst + self.__pad_ilst(length))
         try:
             path = atoms.path(b"moov", b"udta")
         except KeyError:
@@ -406,7 +636,7 @@ class MP4Tags(DictProxy, Metadata):
         self.__update_parents(fileobj, path, len(meta))
         self.__update_offsets(fileobj, atoms, len(meta), offset)
 
-    def __save_existing(self, fileobj, atoms, path, data):
+    def __save_existing(self, fileobj, atoms, path, data, size, padding):
         # Replace the old ilst atom.
         ilst = path.pop()
         offset = ilst.offset
@@ -429,14 +659,26 @@ class MP4Tags(DictProxy, Metadata):
         except IndexError:
             pass
 
+        # What is left in place has to be empty or a whole free atom.
+        space = length - len(data)
+        if space == 0:
+            available = 0
+        elif space >= 8:
+            available = space - 8
+        else:
+            available = -1
+        padding = choose(PaddingInfo(available, size), padding)
+        if padding == available and space >= 8:
+            # Even an empty free atom, that keeps the size.
+            data += Atom.render(b"free", b"\x00" * padding)
+        else:
+            data += self.__pad_ilst(padding)
+
         delta = len(data) - length
-        if delta > 0 or (delta < 0 and delta > -8):
-            data += self.__pad_ilst(data)
-            delta = len(data) - length
+        if delta > 0:
             insert_bytes(fileobj, delta, offset)
         elif delta < 0:
-            data += self.__pad_ilst(data, -delta - 8)
-            delta = 0
+            delete_bytes(fileobj, -delta, offset)
 
         fileobj.seek(offset)
         fileobj.write(data)
@@ -699,6 +941,32 @@ class MP4Tags(DictProxy, Metadata):
         return "\n".join(values)
 
 
+def _audio_trak(atoms, fileobj):
+    """The first 'soun' trak of the moov atom."""
+    for trak in list(atoms[b"moov"].findall(b"trak")):
+        hdlr = trak[b"mdia", b"hdlr"]
+        fileobj.seek(hdlr.offset)
+        data = fileobj.read(hdlr.length)
+        if data[16:20] == b"soun":
+            return trak
+    raise MP4StreamInfoError("track has no audio data")
+
+
+def _read_mdhd(trak, fileobj):
+    """(time scale, duration in units of the time scale) of a trak."""
+    mdhd = trak[b"mdia", b"mdhd"]
+    fileobj.seek(mdhd.offset)
+    data = fileobj.read(mdhd.length)
+    if data[8] == 0:
+        offset = 20
+        fmt = ">2I"
+    else:
+        offset = 28
+        fmt = ">IQ"
+    end = offset + struct.calcsize(fmt)
+    return struct.unpack(fmt, data[offset:end])
+
+
 class MP4Info(object):
     """MPEG-4 stream information.
 
@@ -717,26 +985,8 @@ class MP4Info(object):
     bits_per_sample = 0
 
     def __init__(self, atoms, fileobj):
-        for trak in list(atoms[b"moov"].findall(b"trak")):
-            hdlr = trak[b"mdia", b"hdlr"]
-            fileobj.seek(hdlr.offset)
-            data = fileobj.read(hdlr.length)
-            if data[16:20] == b"soun":
-                break
-        else:
-            raise MP4StreamInfoError("track has no audio data")
-
-        mdhd = trak[b"mdia", b"mdhd"]
-        fileobj.seek(mdhd.offset)
-        data = fileobj.read(mdhd.length)
-        if data[8] == 0:
-            offset = 20
-            fmt = ">2I"
-        else:
-            offset = 28
-            fmt = ">IQ"
-        end = offset + struct.calcsize(fmt)
-        unit, length = struct.unpack(fmt, data[offset:end])
+        trak = _audio_trak(atoms, fileobj)
+        unit, length = _read_mdhd(trak, fileobj)
         self.length = length / unit
 
         try:
@@ -775,6 +1025,350 @@ class MP4Info(object):
             self.length, self.bitrate)
 
 
+def _be_array(typecode, data):
+    """An array of the big-endian numbers in data."""
+    table = array.array(typecode)
+    table.frombytes(data)
+    if sys.byteorder == "little":
+        table.byteswap()
+    return table
+
+
+class SampleTable(object):
+    """Where the samples of the audio track are, in time and in the file.
+
+    The sample tables of the trak (stts, stsz, stsc and stco/co64) and
+    the track runs of all moof atoms are decoded into a few arrays of
+    cumulative sums: start time and first sample of every stts run,
+    end offset of every sample (unless all have the same size) and
+    first sample and offset of every chunk. Looking up a time or a
+    sample is a bisect over them, O(log n), and memory stays close to
+    the size of the tables themselves.
+
+    Attributes:
+
+    * timescale -- time units per second of the track
+    * track_id -- ID of the track
+    * duration -- sum of the sample durations in seconds, as a float
+    * chunks -- number of chunks (track runs in fragmented files)
+
+    Samples and chunks are numbered from 0; len() is the number of
+    samples.
+    """
+
+    def __init__(self, atoms, fileobj):
+        trak = _audio_trak(atoms, fileobj)
+        self.timescale = _read_mdhd(trak, fileobj)[0]
+        if not self.timescale:
+            raise MP4StreamInfoError("track has no time scale")
+        data = self.__read(fileobj, trak[b"tkhd", ])
+        self.track_id = cdata.uint_be(data[20:24] if data[8] == 0
+                                      else data[28:32])
+
+        stbl = trak[b"mdia", b"minf", b"stbl"]
+        counts, deltas = array.array("I"), array.array("I")
+        data = self.__read(fileobj, stbl, b"stts")
+        if data:
+            table = _be_array("I", data[16:16 + 8 * cdata.uint_be(data[12:16])])
+            counts, deltas = table[0::2], table[1::2]
+
+        # per sample sizes, None while they are all self.__size
+        sizes = None
+        self.__size = 0
+        self.__count = 0
+        data = self.__read(fileobj, stbl, b"stsz")
+        if data:
+            self.__size, self.__count = struct.unpack(">2I", data[12:20])
+            if not self.__size:
+                sizes = _be_array("I", data[20:20 + 4 * self.__count])
+
+        offsets = array.array("Q")
+        data = self.__read(fileobj, stbl, b"stco")
+        if data:
+            offsets = array.array("Q", _be_array(
+                "I", data[16:16 + 4 * cdata.uint_be(data[12:16])]))
+        else:
+            data = self.__read(fileobj, stbl, b"co64")
+            if data:
+                offsets = _be_array(
+                    "Q", data[16:16 + 8 * cdata.uint_be(data[12:16])])
+
+        # first sample of every chunk, from the runs of chunks of stsc
+        firsts = array.array("Q")
+        data = self.__read(fileobj, stbl, b"stsc")
+        if data:
+            table = _be_array("I", data[16:16 + 12 * cdata.uint_be(data[12:16])])
+            starts, per_chunk = table[0::3], table[1::3]
+            ends = starts[1:] + array.array("I", [len(offsets) + 1])
+            sample = 0
+            for start, end, per in zip(starts, ends, per_chunk):
+                count = max(min(end, len(offsets) + 1) - start, 0)
+                if per:
+                    firsts.extend(range(sample, sample + count * per, per))
+                else:
+                    firsts.extend([sample] * count)
+                sample += count * per
+        del offsets[len(firsts):]
+
+        moofs = [atom for atom in atoms.atoms if atom.name == b"moof"]
+        if moofs:
+            if sizes is None:
+                sizes = array.array("I", [self.__size]) * self.__count
+            defaults = self.__read_trex(fileobj, atoms)
+            for moof in moofs:
+                self.__read_moof(fileobj, moof, defaults, counts, deltas,
+                                 sizes, firsts, offsets)
+            self.__count = len(sizes)
+
+        self.__run_samples = array.array("Q", itertools.accumulate(
+            itertools.chain((0, ), counts)))
+        self.__run_times = array.array("Q", itertools.accumulate(
+            itertools.chain((0, ), map(operator.mul, counts, deltas))))
+        self.__deltas = deltas
+        # end offset of every sample relative to the first one
+        self.__ends = None
+        if sizes is not None:
+            self.__ends = array.array("Q", itertools.accumulate(
+                itertools.chain((0, ), sizes)))
+        self.__firsts = firsts
+        self.__offsets = offsets
+        self.chunks = len(offsets)
+        self.duration = self.__run_times[-1] / self.timescale
+
+    @classmethod
+    def from_file(cls, filething, store=None):
+        """The SampleTable of a filename, file object or buffer.
+
+        store is used as in MP4.load.
+        """
+
+        index = None
+        if store is not None and isinstance(filething, (str, os.PathLike)):
+            index = AtomIndex.for_file(filething, store=store)
+        with openfile(filething) as fileobj:
+            if index is not None:
+                atoms = index.atoms([b"moov", b"moof"])
+            else:
+                atoms = Atoms(fileobj)
+            return cls(atoms, fileobj)
+
+    @staticmethod
+    def __read(fileobj, atom, name=None):
+        """Data of atom or its child name, b"" if there is no such child."""
+        if name is not None:
+            try:
+                atom = atom[name, ]
+            except KeyError:
+                return b""
+        fileobj.seek(atom.offset)
+        return fileobj.read(atom.length)
+
+    def __read_trex(self, fileobj, atoms):
+        """Default (duration, size) of the samples in fragments."""
+        for mvex in atoms[b"moov"].findall(b"mvex"):
+            data = self.__read(fileobj, mvex)
+            pos = 8
+            while pos + 28 <= len(data):
+                length, name, track, _, duration, size = struct.unpack(
+                    ">I4s4xIIII", data[pos:pos + 28])
+                if name == b"trex" and track == self.track_id:
+                    return duration, size
+                if length < 8:
+                    break
+                pos += length
+        return 0, 0
+
+    def __read_moof(self, fileobj, moof, defaults, counts, deltas, sizes,
+                    firsts, offsets):
+        end = moof.offset
+        for traf in moof.findall(b"traf"):
+            data = self.__read(fileobj, traf[b"tfhd", ])
+            flags = cdata.uint_be(b"\x00" + data[9:12])
+            if cdata.uint_be(data[12:16]) != self.track_id:
+                continue
+            duration, size = defaults
+            pos = 16
+            base = moof.offset if flags & 0x20000 else end
+            if flags & 0x1:
+                base = cdata.ulonglong_be(data[pos:pos + 8])
+                pos += 8
+            if flags & 0x2:
+                pos += 4
+            if flags & 0x8:
+                duration = cdata.uint_be(data[pos:pos + 4])
+                pos += 4
+            if flags & 0x10:
+                size = cdata.uint_be(data[pos:pos + 4])
+
+            end = base
+            for trun in traf.findall(b"trun"):
+                data = self.__read(fileobj, trun)
+                flags = cdata.uint_be(b"\x00" + data[9:12])
+                count = cdata.uint_be(data[12:16])
+                pos = 16
+                offset = end
+                if flags & 0x1:
+                    offset = base + cdata.int_be(data[pos:pos + 4])
+                    pos += 4
+                if flags & 0x4:
+                    pos += 4
+                # per sample duration, size, flags and composition offset
+                fields = [bit for bit in (0x100, 0x200, 0x400, 0x800)
+                          if flags & bit]
+                table = _be_array("I", data[pos:pos + 4 * len(fields) * count])
+                step = len(fields)
+                if flags & 0x100:
+                    durations = table[fields.index(0x100)::step]
+                else:
+                    durations = [duration] * count
+                if flags & 0x200:
+                    run = table[fields.index(0x200)::step]
+                else:
+                    run = array.array("I", [size]) * count
+                for delta, group in itertools.groupby(durations):
+                    counts.append(sum(1 for sample in group))
+                    deltas.append(delta)
+                firsts.append(len(sizes))
+                offsets.append(offset)
+                sizes.extend(run)
+                end = offset + sum(run)
+
+    def __len__(self):
+        return self.__count
+
+    def __check(self, sample):
+        if not 0 <= sample < self.__count:
+            raise IndexError("sample %d out of range" % sample)
+
+    def span(self, start, stop):
+        """Bytes taken by the samples start to stop - 1."""
+
+        if self.__ends is None:
+            return (stop - start) * self.__size
+        return self.__ends[stop] - self.__ends[start]
+
+    def sample_at(self, time):
+        """The sample playing at time seconds; times before or after
+        the track give the first or last sample."""
+
+        if not self.__count:
+            raise IndexError("track has no samples")
+        ticks = round(time * self.timescale)
+        run = bisect.bisect_right(self.__run_times, ticks) - 1
+        if run < 0:
+            return 0
+        if run >= len(self.__deltas):
+            return self.__count - 1
+        sample = self.__run_samples[run]
+        if self.__deltas[run]:
+            sample += (ticks - self.__run_times[run]) // self.__deltas[run]
+        return min(sample, self.__count - 1)
+
+    def sample_at_byte(self, position):
+        """The sample holding byte position of the audio, counted as if
+        all samples were stored one after the other."""
+
+        if not self.__count:
+            raise IndexError("track has no samples")
+        if self.__ends is None:
+            sample = position // self.__size if self.__size else 0
+        else:
+            sample = bisect.bisect_right(self.__ends, position) - 1
+        return min(max(sample, 0), self.__count - 1)
+
+    def time_of(self, sample):
+        """Decoding time of sample in seconds, time_of(len(self)) is the
+        end of the track."""
+
+        if sample != self.__count:
+            self.__check(sample)
+        if not self.__deltas:
+            return 0.0
+        run = min(bisect.bisect_right(self.__run_samples, sample) - 1,
+                  len(self.__deltas) - 1)
+        ticks = self.__run_times[run] + \
+            (sample - self.__run_samples[run]) * self.__deltas[run]
+        return ticks / self.timescale
+
+    def chunk_of(self, sample):
+        """The chunk sample is stored in."""
+
+        self.__check(sample)
+        chunk = bisect.bisect_right(self.__firsts, sample) - 1
+        if chunk < 0:
+            raise MP4StreamInfoError("sample %d is in no chunk" % sample)
+        return chunk
+
+    def size_of(self, sample):
+        """Size of sample in bytes."""
+
+        self.__check(sample)
+        return self.span(sample, sample + 1)
+
+    def offset_of(self, sample):
+        """Offset of sample in the file."""
+
+        chunk = self.chunk_of(sample)
+        return self.__offsets[chunk] + \
+            self.span(self.__firsts[chunk], sample)
+
+    def seek(self, time):
+        """(sample, chunk, offset in the file) of the sample playing
+        at time seconds."""
+
+        sample = self.sample_at(time)
+        chunk = self.chunk_of(sample)
+        offset = self.__offsets[chunk] + \
+            self.span(self.__firsts[chunk], sample)
+        return sample, chunk, offset
+
+    def runs(self, start, stop):
+        """Yields (count, duration) for the runs of samples of the same
+        duration (in time scale units) from start to stop - 1."""
+
+        stop = min(stop, self.__count)
+        if start >= stop:
+            return
+        run = bisect.bisect_right(self.__run_samples, start) - 1
+        while run < len(self.__deltas) and self.__run_samples[run] < stop:
+            count = min(self.__run_samples[run + 1], stop) - \
+                max(self.__run_samples[run], start)
+            if count > 0:
+                yield count, self.__deltas[run]
+            run += 1
+
+    def sizes(self, start, stop):
+        """Sizes of the samples start to stop - 1, as an array."""
+
+        stop = min(stop, self.__count)
+        if start >= stop:
+            return array.array("I")
+        if self.__ends is None:
+            return array.array("I", [self.__size]) * (stop - start)
+        ends = self.__ends
+        return array.array("I", map(operator.sub, ends[start + 1:stop + 1],
+                                    ends[start:stop]))
+
+    def extents(self, start, stop):
+        """Yields (first sample, count, offset, length) for the parts of
+        the chunks that hold the samples start to stop - 1, in order."""
+
+        stop = min(stop, self.__count)
+        if start >= stop:
+            return
+        chunk = self.chunk_of(start)
+        while chunk < len(self.__firsts) and self.__firsts[chunk] < stop:
+            first = max(self.__firsts[chunk], start)
+            end = stop
+            if chunk + 1 < len(self.__firsts):
+                end = min(self.__firsts[chunk + 1], stop)
+            if end > first:
+                offset = self.__offsets[chunk] + \
+                    self.span(self.__firsts[chunk], first)
+                yield first, end - first, offset, self.span(first, end)
+            chunk += 1
+
+
 class MP4(FileType):
     """An MPEG-4 audio file, probably containing AAC.
 
@@ -789,11 +1383,23 @@ class MP4(FileType):
 
     _mimes = ["audio/mp4", "audio/x-m4a", "audio/mpeg4", "audio/aac"]
 
-    def load(self, filename):
+    def load(self, filename, store=None):
+        """Load file information from a filename, file object or buffer.
+
+        With a store directory the atom layout of a file given by name
+        is taken from an AtomIndex cached there (see AtomIndex.for_file)
+        instead of walking the file again.
+        """
+
         self.filename = filename
-        fileobj = open(filename, "rb")
-        try:
-            atoms = Atoms(fileobj)
+        index = None
+        if store is not None and isinstance(filename, (str, os.PathLike)):
+            index = AtomIndex.for_file(filename, store=store)
+        with openfile(filename) as fileobj:
+            if index is not None:
+                atoms = index.atoms([b"moov"])
+            else:
+                atoms = Atoms(fileobj)
 
             # ftyp is always the first atom in a valid MP4 file
             if not atoms.atoms or atoms.atoms[0].name != b"ftyp":
@@ -809,8 +1415,6 @@ class MP4(FileType):
                 self.tags = None
             except Exception as err:
                 raise MP4MetadataError(err).with_traceback(sys.exc_info()[2])
-        finally:
-            fileobj.close()
 
     def add_tags(self):
         if self.tags is None:
@@ -18,14 +18,75 @@ This implementation is based on the RFC 3533 standard found at
 http://www.xiph.org/ogg/doc/rfc3533.txt.
 """
 
-import struct
+import io
+import os
 import sys
+import array
+import bisect
+import struct
 import zlib
 
 from io import BytesIO
 
 from mutagenx import FileType
-from mutagenx._util import cdata, insert_bytes, delete_bytes
+from mutagenx._util import cdata, insert_bytes, delete_bytes, openfile
+
+def _read_header(fileobj, offset):
+    """Return (serial, position, flags, size) of the page at offset,
+    None if there is no valid page header there."""
+
+    fileobj.seek(offset)
+    header = fileobj.read(27)
+    if len(header) < 27 or header[:4] != b"OggS" or header[4] != 0:
+        return None
+    position, serial = struct.unpack("<qI", header[6:18])
+    lacings = fileobj.read(header[26])
+    if len(lacings) != header[26]:
+        return None
+    return serial, position, header[5], 27 + len(lacings) + sum(lacings)
+
+
+def _is_page(fileobj, offset, size):
+    """True if the page at offset has a matching checksum."""
+
+    fileobj.seek(offset)
+    data = bytearray(fileobj.read(size))
+    if len(data) != size:
+        return False
+    crc = bytes(data[22:26])
+    data[22:26] = b"\x00" * 4
+    return _crc(data) == crc
+
+
+def _sync(fileobj, offset, end, BUFFER_SIZE=2**16):
+    """Offset of the first valid page starting in [offset, end), found
+    by its capture pattern and checked by its CRC, or None."""
+
+    while offset < end:
+        fileobj.seek(offset)
+        data = fileobj.read(min(BUFFER_SIZE, end - offset) + 3)
+        if len(data) < 4:
+            return None
+        index = data.find(b"OggS")
+        while index != -1 and offset + index < end:
+            header = _read_header(fileobj, offset + index)
+            if header is not None and _is_page(fileobj, offset + index,
+                                               header[3]):
+                return offset + index
+            index = data.find(b"OggS", index + 1)
+        offset += len(data) - 3
+    return None
+
+
+def _crc(data):
+    """The checksum of a page, data must have a zeroed checksum field."""
+
+    # Python's CRC is swapped relative to Ogg's needs.
+    crc = (~zlib.crc32(data.translate(cdata.bitswap), -1)) & 0xffffffff
+    # Although we're using to_uint_be, this actually makes the CRC
+    # a proper le integer, since Python's CRC is byteswapped.
+    return cdata.to_uint_be(crc).translate(cdata.bitswap)
+
 
 class error(IOError):
     """Ogg stream parsing errors."""
@@ -153,13 +214,7 @@ class OggPage(object):
         data.extend(self.packets)
         data = b"".join(data)
 
-        # Python's CRC is swapped relative to Ogg's needs.
-        # crc32 returns uint prior to py2.6 on some platforms, so force uint
-        crc = (~zlib.crc32(data.translate(cdata.bitswap), -1)) & 0xffffffff
-        # Although we're using to_uint_be, this actually makes the CRC
-        # a proper le integer, since Python's CRC is byteswapped.
-        crc = cdata.to_uint_be(crc).translate(cdata.bitswap)
-        data = data[:22] + crc + data[26:]
+        data = data[:22] + _crc(data) + data[26:]
         return data
 
     @property
@@ -200,7 +255,7 @@ class OggPage(object):
         doc="This is the last page of a logical bitstream.")
 
     @staticmethod
-    def renumber(fileobj, serial, start):
+    def renumber(fileobj, serial, start, BUFFER_SIZE=2**20):
         """Renumber pages belonging to a specified logical stream.
 
         fileobj must be opened with mode r+b or w+b.
@@ -210,9 +265,13 @@ class OggPage(object):
 
         fileobj must point to the start of a valid Ogg page; any
         occuring after it and part of the specified logical stream
-        will be numbered. No adjustment will be made to the data in
-        the pages nor the granule position; only the page number, and
-        so also the CRC.
+        will be numbered, up to the last page of the stream. No
+        adjustment will be made to the data in the pages nor the
+        granule position; only the page number, and so also the CRC.
+
+        The file is read and written in blocks of BUFFER_SIZE bytes
+        and pages are patched in place, so the pass costs one read
+        and one write of the rest of the stream.
 
         If an error occurs (e.g. non-Ogg data is found), fileobj will
         be left pointing to the place in the stream the error occured,
@@ -221,22 +280,52 @@ class OggPage(object):
         """
 
         number = start
+        offset = fileobj.tell()
         while True:
-            try:
-                page = OggPage(fileobj)
-            except EOFError:
+            data = bytearray(fileobj.read(BUFFER_SIZE))
+            pos = 0
+            changed = False
+            done = False
+            while len(data) - pos >= 27:
+                if data[pos:pos + 4] != b"OggS":
+                    if changed:
+                        fileobj.seek(offset)
+                        fileobj.write(data[:pos])
+                    fileobj.seek(offset + pos)
+                    raise error("read %r, expected %r, at 0x%x" % (
+                        bytes(data[pos:pos + 4]), b"OggS", offset + pos))
+                segments = data[pos + 26]
+                if len(data) - pos < 27 + segments:
+                    break
+                size = 27 + segments + sum(data[pos + 27:pos + 27 + segments])
+                if len(data) - pos < size:
+                    break
+
+                if cdata.uint_le(data[pos + 14:pos + 18]) == serial:
+                    data[pos + 18:pos + 22] = cdata.to_uint_le(number)
+                    data[pos + 22:pos + 26] = b"\x00" * 4
+                    data[pos + 22:pos + 26] = _crc(data[pos:pos + size])
+                    number += 1
+                    changed = True
+                    if data[pos + 5] & 4:
+                        # Last page of the stream, nothing after it
+                        # can belong to it.
+                        done = True
+                pos += size
+                if done:
+                    break
+
+            if changed:
+                fileobj.seek(offset)
+                fileobj.write(data[:pos])
+            offset += pos
+            fileobj.seek(offset)
+            if done or len(data) < BUFFER_SIZE and pos == 0:
+                # The end, or a short page the file ends within.
                 break
-            else:
-                if page.serial != serial:
-                    # Wrong stream, skip this page.
-                    continue
-                # Changing the number can't change the page size,
-                # so seeking back based on the current size is safe.
-                fileobj.seek(-page.size, 1)
-            page.sequence = number
-            fileobj.write(page.write())
-            fileobj.seek(page.offset + page.size, 0)
-            number += 1
+            if pos == 0:
+                # A page larger than the buffer.
+                BUFFER_SIZE *= 2
 
     @staticmethod
     def to_packets(pages, strict=False):
@@ -366,22 +455,28 @@ class OggPage(object):
 
         new_data = b"".join(cls.write(p) for p in new_pages)
 
-        # Make room in the file for the new data.
-        delta = len(new_data)
-        fileobj.seek(old_pages[0].offset, 0)
-        insert_bytes(fileobj, delta, old_pages[0].offset)
-        fileobj.seek(old_pages[0].offset, 0)
-        fileobj.write(new_data)
-        new_data_end = old_pages[0].offset + delta
-
-        # Go through the old pages and delete them. Since we shifted
-        # the data down the file, we need to adjust their offsets. We
-        # also need to go backwards, so we don't adjust the deltas of
-        # the other pages.
-        old_pages.reverse()
-        for old_page in old_pages:
-            adj_offset = old_page.offset + delta
-            delete_bytes(fileobj, old_page.size, adj_offset)
+        # The old pages may be interleaved with pages of other
+        # streams; those are kept and end up after the new pages.
+        start = old_pages[0].offset
+        end = old_pages[-1].offset + old_pages[-1].size
+        region = new_data
+        if sum(page.size for page in old_pages) != end - start:
+            old_offsets = set(page.offset for page in old_pages)
+            fileobj.seek(start, 0)
+            while fileobj.tell() < end:
+                page = OggPage(fileobj)
+                if page.offset not in old_offsets:
+                    region += page.write()
+
+        # Move the rest of the file once, by the net change in size.
+        delta = len(region) - (end - start)
+        if delta > 0:
+            insert_bytes(fileobj, delta, end)
+        elif delta < 0:
+            delete_bytes(fileobj, -delta, end + delta)
+        fileobj.seek(start, 0)
+        fileobj.write(region)
+        new_data_end = start + len(new_data)
 
         # Finally, if there's any discrepency in length, we need to
         # renumber the pages for the logical stream.
@@ -392,16 +487,27 @@ class OggPage(object):
             cls.renumber(fileobj, serial, sequence)
 
     @staticmethod
-    def find_last(fileobj, serial):
+    def find_last(fileobj, serial, index=None):
         """Find the last page of the stream 'serial'.
 
-        If the file is not multiplexed this function is fast. If it is,
-        it must read the whole the stream.
+        With an OggIndex of the file the page is read from the offset
+        it recorded and nothing else is searched.
+
+        If the file is not multiplexed this function reads its last
+        64k. If it is, the page headers of the whole file are indexed
+        (see OggIndex.build), which skips the page data but is exact
+        however the streams are interleaved.
 
         This finds the last page in the actual file object, or the last
         page in the stream (with eos set), whichever comes first.
         """
 
+        if index is not None:
+            offset = index.last(serial)
+            if offset is not None:
+                fileobj.seek(offset)
+                return OggPage(fileobj)
+
         # For non-muxed streams, look at the last page.
         try:
             fileobj.seek(-256*256, 2)
@@ -428,22 +534,219 @@ class OggPage(object):
             else:
                 best_page = None
 
-        # The stream is muxed, so use the slow way.
-        fileobj.seek(0)
-        try:
-            page = OggPage(fileobj)
-            while not page.last:
-                page = OggPage(fileobj)
-                while page.serial != serial:
-                    page = OggPage(fileobj)
-                best_page = page
-            return page
-        except error:
+        # The stream is muxed or chained, find its last page by index.
+        offset = OggIndex.build(fileobj).last(serial)
+        if offset is None:
             return best_page
-        except EOFError:
+        fileobj.seek(offset)
+        try:
+            return OggPage(fileobj)
+        except (error, EOFError):
             return best_page
 
 
+class OggIndex(object):
+    """Offset, serial and granule position of every page of a file.
+
+    Built with a single pass that reads page headers only, then
+    answers length and seek queries for any logical stream with a
+    bisection. Indexes can be saved and loaded again as long as the
+    file did not change (size and mtime are stored with them).
+
+    Attributes:
+
+    * size, mtime -- of the indexed file, mtime in nanoseconds
+    * offsets, serials, positions, flags -- arrays, one entry per page
+    """
+
+    MAGIC = b"OggI"
+    VERSION = 1
+    _HEADER = struct.Struct("<4sBQQI")
+
+    def __init__(self, size=0, mtime=0):
+        self.size = size
+        self.mtime = mtime
+        self.offsets = array.array("Q")
+        self.serials = array.array("I")
+        self.positions = array.array("q")
+        self.flags = array.array("B")
+        self.__streams = None
+        self.__last = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def build(cls, fileobj, BUFFER_SIZE=2**20):
+        """Index every page of fileobj, skipping over damaged data."""
+
+        fileobj.seek(0, 2)
+        index = cls(fileobj.tell())
+        try:
+            index.mtime = os.fstat(fileobj.fileno()).st_mtime_ns
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            pass
+
+        offset = 0
+        data = b""
+        start = 0
+        while True:
+            pos = offset - start
+            if len(data) - pos < 27 + 255:
+                fileobj.seek(offset)
+                data = fileobj.read(BUFFER_SIZE)
+                start = offset
+                pos = 0
+                if len(data) < 27:
+                    break
+            if data[pos:pos + 4] != b"OggS" or data[pos + 4] != 0:
+                offset = _sync(fileobj, offset + 1, index.size)
+                if offset is None:
+                    break
+                data = b""
+                continue
+            segments = data[pos + 26]
+            size = 27 + segments + sum(data[pos + 27:pos + 27 + segments])
+            if offset + size > index.size:
+                # Truncated last page.
+                break
+            position, serial = struct.unpack_from("<qI", data, pos + 6)
+            index.offsets.append(offset)
+            index.serials.append(serial)
+            index.positions.append(position)
+            index.flags.append(data[pos + 5])
+            offset += size
+        return index
+
+    @property
+    def _streams(self):
+        # serial -> (page numbers with a granule position, their positions)
+        if self.__streams is None:
+            streams = {}
+            self.__last = {}
+            for number, (serial, position) in enumerate(
+                    zip(self.serials, self.positions)):
+                self.__last[serial] = number
+                if position != -1:
+                    pages, positions = streams.setdefault(
+                        serial, (array.array("I"), array.array("q")))
+                    pages.append(number)
+                    positions.append(position)
+            self.__streams = streams
+        return self.__streams
+
+    def last(self, serial):
+        """Offset of the last page of the stream, None if unknown."""
+
+        self._streams
+        try:
+            return self.offsets[self.__last[serial]]
+        except KeyError:
+            return None
+
+    def length(self, serial):
+        """Last granule position of the stream, 0 if unknown."""
+
+        try:
+            return self._streams[serial][1][-1]
+        except (KeyError, IndexError):
+            return 0
+
+    def find(self, serial, position):
+        """Offset of the page of the stream that ends the sample at
+        granule position 'position', None if it is past the end."""
+
+        try:
+            pages, positions = self._streams[serial]
+        except KeyError:
+            return None
+        number = bisect.bisect_left(positions, position)
+        if number == len(positions):
+            return None
+        return self.offsets[pages[number]]
+
+    def is_current(self, size, mtime):
+        return self.size == size and self.mtime == mtime
+
+    def save(self, path):
+        """Write the index to path."""
+
+        columns = [self.offsets, self.serials, self.positions, self.flags]
+        if sys.byteorder != "little":
+            columns = [array.array(c.typecode, c) for c in columns]
+            for column in columns:
+                column.byteswap()
+        with open(path, "wb") as fileobj:
+            fileobj.write(self._HEADER.pack(self.MAGIC, self.VERSION,
+                                            self.size, self.mtime, len(self)))
+            for column in columns:
+                fileobj.write(column.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save, raises error if it is invalid."""
+
+        with open(path, "rb") as fileobj:
+            header = fileobj.read(cls._HEADER.size)
+            try:
+                magic, version, size, mtime, count = cls._HEADER.unpack(header)
+            except struct.error:
+                raise error("truncated index %r" % path)
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise error("%r is not an Ogg index" % path)
+            index = cls(size, mtime)
+            for column in (index.offsets, index.serials, index.positions,
+                           index.flags):
+                data = fileobj.read(count * column.itemsize)
+                if len(data) != count * column.itemsize:
+                    raise error("truncated index %r" % path)
+                column.frombytes(data)
+                if sys.byteorder != "little":
+                    column.byteswap()
+        return index
+
+    @staticmethod
+    def store_path(store, stat):
+        """Where the index of a file with os.stat() result stat lives
+        in the directory store."""
+
+        return os.path.join(store, "%x-%x-%x-%x.oggi" % (
+            stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns))
+
+    @classmethod
+    def for_file(cls, filename, path=None, store=None):
+        """The index of filename, loaded from path if it is still
+        current, otherwise built (and saved to path if given).
+
+        Instead of a path a store directory shared by many files can
+        be given, as in AtomIndex.for_file.
+        """
+
+        stat = os.stat(filename)
+        if path is None and store is not None:
+            path = cls.store_path(store, stat)
+        if path is not None:
+            try:
+                index = cls.load(path)
+            except (IOError, error):
+                pass
+            else:
+                if index.is_current(stat.st_size, stat.st_mtime_ns):
+                    return index
+        with open(filename, "rb") as fileobj:
+            index = cls.build(fileobj)
+        # What was read is what stat saw, not what the file is now.
+        index.mtime = stat.st_mtime_ns
+        if path is not None:
+            try:
+                if store is not None:
+                    os.makedirs(store, exist_ok=True)
+                index.save(path)
+            except IOError:
+                pass
+        return index
+
+
 class OggFileType(FileType):
     """An generic Ogg file."""
 
@@ -452,22 +755,27 @@ class OggFileType(FileType):
     _Error = None
     _mimes = ["application/ogg", "application/x-ogg"]
 
-    def load(self, filename):
-        """Load file information from a filename."""
+    def load(self, filename, store=None):
+        """Load file information from a filename, file object or buffer.
+
+        With a store directory the last page of the stream of a file
+        given by name is taken from an OggIndex cached there (see
+        OggIndex.for_file) instead of searching the file for it.
+        """
 
         self.filename = filename
-        fileobj = open(filename, "rb")
-        try:
+        index = None
+        if store is not None and isinstance(filename, (str, os.PathLike)):
+            index = OggIndex.for_file(filename, store=store)
+        with openfile(filename) as fileobj:
             try:
                 self.info = self._Info(fileobj)
                 self.tags = self._Tags(fileobj, self.info)
-                self.info._post_tags(fileobj)
+                self.info._post_tags(fileobj, index)
             except error as e:
                 raise self._Error(e).with_traceback(sys.exc_info()[2])
             except EOFError:
                 raise self._Error("no appropriate stream found")
-        finally:
-            fileobj.close()
 
     def delete(self, filename=None):
         """Remove tags from a file.
@@ -479,32 +787,27 @@ class OggFileType(FileType):
             filename = self.filename
 
         self.tags.clear()
-        fileobj = open(filename, "rb+")
-        try:
+        with openfile(filename, writable=True) as fileobj:
             try:
                 self.tags._inject(fileobj)
             except error as e:
                 raise self._Error(e).with_traceback(sys.exc_info()[2])
             except EOFError:
                 raise self._Error("no appropriate stream found")
-        finally:
-            fileobj.close()
 
     def save(self, filename=None):
         """Save a tag to a file.
 
         If no filename is given, the one most recently loaded is used.
+        A file object opened for reading and writing can be given too.
         """
 
         if filename is None:
             filename = self.filename
-        fileobj = open(filename, "rb+")
-        try:
+        with openfile(filename, writable=True) as fileobj:
             try:
                 self.tags._inject(fileobj)
             except error as e:
                 raise self._Error(e).with_traceback(sys.exc_info()[2])
             except EOFError:
                 raise self._Error("no appropriate stream found")
-        finally:
-            fileobj.close()
@@ -73,10 +73,10 @@ class OggFLACStreamInfo(StreamInfo):
         stringobj = StrictFileObject(BytesIO(page.packets[0][17:]))
         super(OggFLACStreamInfo, self).load(stringobj)
 
-    def _post_tags(self, fileobj):
+    def _post_tags(self, fileobj, index=None):
         if self.length:
             return
-        page = OggPage.find_last(fileobj, self.serial)
+        page = OggPage.find_last(fileobj, self.serial, index)
         self.length = page.position / self.sample_rate
 
     def pprint(self):
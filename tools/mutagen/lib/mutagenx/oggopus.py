@@ -62,8 +62,8 @@ class OggOpusInfo(object):
         if major != 0:
             raise OggOpusHeaderError("version %r unsupported" % major)
 
-    def _post_tags(self, fileobj):
-        page = OggPage.find_last(fileobj, self.serial)
+    def _post_tags(self, fileobj, index=None):
+        page = OggPage.find_last(fileobj, self.serial, index)
         self.length = (page.position - self.__pre_skip) / 48000
 
     def pprint(self):
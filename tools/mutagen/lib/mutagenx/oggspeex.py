@@ -61,8 +61,8 @@ class OggSpeexInfo(object):
         self.bitrate = max(0, cdata.int_le(page.packets[0][52:56]))
         self.serial = page.serial
 
-    def _post_tags(self, fileobj):
-        page = OggPage.find_last(fileobj, self.serial)
+    def _post_tags(self, fileobj, index=None):
+        page = OggPage.find_last(fileobj, self.serial, index)
         self.length = page.position / self.sample_rate
 
     def pprint(self):
@@ -62,8 +62,8 @@ class OggTheoraInfo(object):
         self.granule_shift = (cdata.ushort_be(data[40:42]) >> 5) & 0x1F
         self.serial = page.serial
 
-    def _post_tags(self, fileobj):
-        page = OggPage.find_last(fileobj, self.serial)
+    def _post_tags(self, fileobj, index=None):
+        page = OggPage.find_last(fileobj, self.serial, index)
         position = page.position
         mask = (1 << self.granule_shift) - 1
         frames = (position >> self.granule_shift) + (position & mask)
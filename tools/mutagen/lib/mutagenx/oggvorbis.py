@@ -70,8 +70,8 @@ class OggVorbisInfo(object):
         else:
             self.bitrate = nominal_bitrate
 
-    def _post_tags(self, fileobj):
-        page = OggPage.find_last(fileobj, self.serial)
+    def _post_tags(self, fileobj, index=None):
+        page = OggPage.find_last(fileobj, self.serial, index)
         self.length = page.position / self.sample_rate
 
     def pprint(self):
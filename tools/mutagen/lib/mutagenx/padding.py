@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""How much padding tag writers leave behind.
+
+Tags are followed by padding so a later, slightly larger tag can be
+written in place instead of moving all the audio data behind it. The
+MP4, FLAC and ID3 writers ask a padding policy how much to leave: any
+callable that takes a PaddingInfo and returns the number of padding
+bytes to write. If it returns exactly PaddingInfo.padding the new tags
+are written in place.
+
+A policy can be passed to save() (``f.save(padding=fixed(4096))``) or
+made the default of every writer with set_default().
+
+Policies in this module:
+
+* fixed -- a fixed amount
+* proportional -- a share of the file size
+* reserve -- a larger amount the first time a file gets tags, for
+  libraries that will be re-tagged later
+"""
+
+__all__ = ["PaddingInfo", "fixed", "proportional", "reserve", "DEFAULT",
+           "set_default", "get_default", "choose"]
+
+
+class PaddingInfo(object):
+    """What a writer knows when it chooses the padding.
+
+    Attributes:
+
+    * padding -- bytes of padding that would be left if the new tags
+      were written in place of the old ones; negative if they don't
+      fit (or there are no tags to replace)
+    * size -- size of the whole file in bytes
+    * new -- True if the file has no tags of this kind yet
+    """
+
+    def __init__(self, padding, size, new=False):
+        self.padding = padding
+        self.size = size
+        self.new = new
+
+    def __repr__(self):
+        return "<%s padding=%d size=%d new=%r>" % (
+            type(self).__name__, self.padding, self.size, self.new)
+
+
+def _keep_or(info, amount, limit):
+    # Writing in place is always cheapest, unless it wastes a lot.
+    if 0 <= info.padding <= limit:
+        return info.padding
+    return amount
+
+
+def fixed(amount=1024, limit=None):
+    """Pad with amount bytes.
+
+    Existing padding the new tags fit into is kept as long as it is
+    no larger than limit (10 * amount by default).
+    """
+
+    if limit is None:
+        limit = 10 * amount
+
+    def policy(info):
+        return _keep_or(info, amount, limit)
+    return policy
+
+
+def proportional(share=0.001, minimum=1024, maximum=2**20, limit=None):
+    """Pad with share of the file size, but at least minimum and at
+    most maximum bytes.
+
+    Existing padding the new tags fit into is kept as long as it is
+    no larger than limit (maximum by default), so room reserved by
+    reserve() isn't given back on the next save.
+    """
+
+    if limit is None:
+        limit = maximum
+
+    def policy(info):
+        amount = min(max(int(info.size * share), minimum), maximum)
+        return _keep_or(info, amount, limit)
+    return policy
+
+
+def reserve(share=0.005, minimum=2**16, maximum=2**20, then=None):
+    """Reserve room for future growth the first time a file is tagged.
+
+    A file without tags gets share of its size (at least minimum, at
+    most maximum bytes) as padding, enough for a new cover or a longer
+    description later on. Files that already have tags keep their
+    padding if the new tags fit and it is no larger than maximum,
+    otherwise the policy then decides: the default if None, or DEFAULT
+    if this policy is the default itself.
+    """
+
+    def policy(info):
+        if info.new:
+            return min(max(int(info.size * share), minimum), maximum)
+        if 0 <= info.padding <= maximum:
+            return info.padding
+        if then is not None:
+            return then(info)
+        return (DEFAULT if _default is policy else _default)(info)
+    return policy
+
+
+DEFAULT = proportional()
+"""The policy used while set_default was not called."""
+
+_default = DEFAULT
+
+
+def set_default(policy):
+    """Make policy the default of all writers, None restores DEFAULT."""
+
+    global _default
+    _default = DEFAULT if policy is None else policy
+
+
+def get_default():
+    return _default
+
+
+def choose(info, policy=None):
+    """The padding a writer has to use, asks policy or the default."""
+
+    amount = int((policy or _default)(info))
+    if amount < 0:
+        raise ValueError("padding can't be negative (%d)" % amount)
+    return amount